@@ -9,5 +9,8 @@ class Args:
     title: str
     debug: bool
     verbose: bool
+    stale: bool
+    stats: bool
     draft: bool
     branch: str
+    stop: bool
@@ -1,3 +1,4 @@
+from . import gh_graphql as ghgql
 from . import styling as s
 from .common import (
     Args,
@@ -11,21 +12,20 @@ from .gitools import checkout, get_current_branch
 
 
 def branch_submit(args: Args) -> None:
-    repo, stack, gh = connect(args)
+    repo, stack, gh = connect(args, profile=ghgql.SUBMIT)
     if not gh:
         return
     origin = repo.remotes['origin']
     if not origin:
         raise GhitError(s.danger('No origin found for the repository.'))
     current = get_current_branch(repo)
-    for record in stack.traverse():
-        if record.branch_name == current.branch_name:
-            push_and_pr(repo, gh, origin, record, args.title, args.draft)
-            break
-    else:
+    record = stack.find(current.branch_name)
+    if record is None or not record.is_enabled():
         raise GhitError(
             s.danger("Couldn't find current branch in the stack."),
         )
+    push_and_pr(repo, gh, origin, record, args.title, args.draft)
+    gh.send_updates()
     return
 
 
@@ -39,12 +39,8 @@ def create(args: Args) -> None:
         )
 
     current = get_current_branch(repo)
-    parent = None
-    for record in stack.traverse(True):
-        if record.branch_name == current.branch_name:
-            parent = record
-            break
-    else:
+    parent = stack.find(current.branch_name)
+    if parent is None or not parent.is_enabled():
         parent = stack.add_child(current.branch_name)
 
     branch = repo.branches.local.create(name=args.branch, commit=repo.get(repo.head.target))
@@ -56,6 +52,6 @@ def create(args: Args) -> None:
 
 
 def check(args: Args) -> None:
-    repo, stack, gh = connect(args)
+    repo, stack, gh = connect(args, readonly=True, profile=ghgql.CLEANUP)
     if not check_record(repo, gh, stack):
         raise GhitError
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from dataclasses import astuple, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .private import private_dir
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from .gh_graphql import PR
+
+CACHE_FILENAME = 'cache'
+# Bump when the pickled classes change.
+CACHE_VERSION = 7
+# Resolving threads and reacting don't touch the PR updatedAt, so entries are
+# refetched after a while even if the PR looks unchanged.
+MAX_AGE_SECONDS = 600
+# Stay well below the SQLite limit of bound parameters per statement.
+MAX_PARAMETERS = 500
+
+
+@dataclass
+class RepositoryMeta:
+    """What is known of the GitHub repository of an origin remote URL."""
+
+    url: str
+    owner: str
+    name: str
+    # The repository node id, queried when a PR is first created.
+    id: str | None = None
+    # The PR template, with its path relative to the work tree and the
+    # st_mtime_ns of the file it has been read from.
+    template_path: str | None = None
+    template_mtime: int | None = None
+    template: str | None = None
+
+
+def cache_path(workdir: Path) -> Path:
+    """Returns the cache database of the work tree. The PRs are pickled, so
+    the database is kept in a directory of the user cache directory that
+    only the user may access, rather than in the work tree, which a cloned
+    repository could fill."""
+    home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    digest = hashlib.sha256(str(workdir.resolve()).encode()).hexdigest()[:16]
+    return private_dir(Path(home) / 'ghit') / f'{CACHE_FILENAME}-{digest}'
+
+
+def _chunks(values: list[str]) -> Iterator[list[str]]:
+    for start in range(0, len(values), MAX_PARAMETERS):
+        yield values[start : start + MAX_PARAMETERS]
+
+
+def _marks(values: list[str]) -> str:
+    return ', '.join('?' * len(values))
+
+
+class PRCache:
+    """Keeps the decoded PRs between the runs in an SQLite database, together
+    with the PR updatedAt, so that only the changed PRs need to be refetched.
+    Every PR is stored with the name of the fetch profile it has been fetched
+    with, and is only reused for the profiles it covers. The database also
+    keeps the metadata of the repository, by origin remote URL."""
+
+    def __init__(self, filename: Path | str) -> None:
+        self.filename = filename
+
+    @functools.cached_property
+    def _db(self) -> sqlite3.Connection:
+        """The database, only opened when first used."""
+        # The stale-while-revalidate refresh writes from another thread.
+        db = sqlite3.connect(str(self.filename), check_same_thread=False)
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row != (str(CACHE_VERSION),):
+                logging.debug('resetting PR cache of version %s', row)
+                db.execute('DROP TABLE IF EXISTS prs')
+                db.execute('DROP TABLE IF EXISTS repositories')
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(CACHE_VERSION),))
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS prs ('
+                'id TEXT PRIMARY KEY, head TEXT NOT NULL, number INTEGER NOT NULL, '
+                'updated_at TEXT NOT NULL, fetched_at REAL NOT NULL, profile TEXT NOT NULL, pr BLOB NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS prs_head ON prs (head)')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS repositories ('
+                'remote TEXT PRIMARY KEY, url TEXT NOT NULL, owner TEXT NOT NULL, name TEXT NOT NULL, id TEXT, '
+                'template_path TEXT, template_mtime INTEGER, template TEXT)'
+            )
+        return db
+
+    def versions(self, ids: list[str], profiles: list[str]) -> dict[str, str]:
+        """Returns the updatedAt of the cached PRs that are young enough and
+        have been fetched with one of the profiles."""
+        oldest = time.time() - MAX_AGE_SECONDS
+        result: dict[str, str] = {}
+        for chunk in _chunks(ids):
+            result.update(
+                self._db.execute(
+                    f'SELECT id, updated_at FROM prs WHERE fetched_at > ? '  # noqa: S608
+                    f'AND profile IN ({_marks(profiles)}) AND id IN ({_marks(chunk)})',
+                    (oldest, *profiles, *chunk),
+                )
+            )
+        return result
+
+    def load(self, ids: list[str], profiles: list[str] | None = None) -> dict[str, PR]:
+        """Returns the cached PRs, only the ones fetched with one of the
+        profiles if given."""
+        condition = f'profile IN ({_marks(profiles)}) AND ' if profiles is not None else ''
+        result: dict[str, PR] = {}
+        for chunk in _chunks(ids):
+            for pr_id, pr in self._db.execute(
+                f'SELECT id, pr FROM prs WHERE {condition}id IN ({_marks(chunk)})',  # noqa: S608
+                (*(profiles or ()), *chunk),
+            ):
+                result[pr_id] = pickle.loads(pr)  # noqa: S301 the cache directory is private to the user
+        return result
+
+    def load_heads(self, heads: list[str], profiles: list[str]) -> list[PR]:
+        result: list[PR] = []
+        for chunk in _chunks(heads):
+            result.extend(
+                pickle.loads(pr)  # noqa: S301 the cache directory is private to the user
+                for (pr,) in self._db.execute(
+                    f'SELECT pr FROM prs WHERE profile IN ({_marks(profiles)}) '  # noqa: S608
+                    f'AND head IN ({_marks(chunk)}) ORDER BY head, number',
+                    (*profiles, *chunk),
+                )
+            )
+        return result
+
+    def store(self, prs: list[PR], profile: str) -> None:
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO prs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (pr.id, pr.head, pr.number, pr.updated_at.isoformat(), now, profile, pickle.dumps(pr))
+                    for pr in prs
+                ),
+            )
+
+    def retain(self, heads: list[str], ids: list[str]) -> None:
+        """Forgets the PRs of the heads that are not in ids anymore."""
+        keep = set(ids)
+        stale: list[str] = []
+        for chunk in _chunks(heads):
+            stale.extend(
+                pr_id
+                for (pr_id,) in self._db.execute(
+                    f'SELECT id FROM prs WHERE head IN ({_marks(chunk)})',  # noqa: S608
+                    chunk,
+                )
+                if pr_id not in keep
+            )
+        with self._db:
+            for chunk in _chunks(stale):
+                self._db.execute(f'DELETE FROM prs WHERE id IN ({_marks(chunk)})', chunk)  # noqa: S608
+
+    def load_repository(self, remote: str) -> RepositoryMeta | None:
+        """Returns the metadata of the repository of the origin remote URL."""
+        row = self._db.execute(
+            'SELECT url, owner, name, id, template_path, template_mtime, template FROM repositories WHERE remote = ?',
+            (remote,),
+        ).fetchone()
+        return RepositoryMeta(*row) if row else None
+
+    def store_repository(self, remote: str, meta: RepositoryMeta) -> None:
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO repositories VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (remote, *astuple(meta)),
+            )
+
+    def close(self) -> None:
+        if '_db' in self.__dict__:
+            self._db.close()
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import logging
 import os
 from pathlib import Path
@@ -8,7 +10,9 @@ from . import gh_formatting as ghf
 from . import gh_graphql as ghgql
 from . import styling as s
 from . import terminal
-from .args import Args
+from .args import Args  # noqa: TC001 the commands import it from here
+from .cache import cache_path
+from .daemon import connect_daemon
 from .error import GhitError
 from .gh import GH, init_gh
 from .gh_formatting import pr_number_with_style
@@ -24,12 +28,31 @@ GHIT_STACK_DIR = '.ghit'
 GHIT_STACK_FILENAME = 'stack'
 
 
+def ghit_dir(repo: git.Repository) -> Path:
+    return Path(repo.path).resolve().parent / GHIT_STACK_DIR
+
+
+def cache_filename(repo: git.Repository) -> Path | None:
+    """Returns the cache database of the repositories that ghit has been
+    initialized in, if the user cache directory is private."""
+    dotghit = ghit_dir(repo)
+    if not dotghit.is_dir():
+        return None
+    try:
+        return cache_path(dotghit.parent)
+    except (OSError, GhitError) as e:
+        terminal.stderr(s.warning(f'Not caching the PRs: {e}'))
+        return None
+
+
 def stack_filename(repo: git.Repository) -> Path:
     env = os.getenv('GHIT_STACK')
     return Path(env) if env else Path(repo.path).resolve().parent / GHIT_STACK_DIR / GHIT_STACK_FILENAME
 
 
-def connect(args: Args) -> tuple[git.Repository, Stack, GH]:
+def connect(
+    args: Args, readonly: bool = False, profile: ghgql.Profile = ghgql.FULL
+) -> tuple[git.Repository, Stack, GH]:
     if ConnectionsCache._connections:
         return ConnectionsCache._connections
     repo = git.Repository(args.repository)
@@ -43,10 +66,31 @@ def connect(args: Args) -> tuple[git.Repository, Stack, GH]:
         stack = Stack()
         current = get_current_branch(repo)
         stack.add_child(current.branch_name)
-    ConnectionsCache._connections = (repo, stack, init_gh(repo, stack, args.offline))
+    ConnectionsCache._connections = (
+        repo,
+        stack,
+        init_gh(
+            repo,
+            stack,
+            args.offline,
+            cache_filename(repo),
+            args.stale,
+            connect_daemon(ghit_dir(repo)),
+            readonly,
+            profile,
+        ),
+    )
     return ConnectionsCache._connections
 
 
+def disconnect() -> None:
+    if ConnectionsCache._connections:
+        _, _, gh = ConnectionsCache._connections
+        if gh:
+            gh.close()
+        ConnectionsCache._connections = None
+
+
 def update_upstream(repo: git.Repository, origin: git.Remote, branch: git.Branch):
     # TODO: weak logic?
     branch_ref: str = origin.get_refspec(0).transform(branch.resolve().name)
@@ -95,13 +139,12 @@ def push_and_pr(
         logging.debug('found pr: %d closed=%s merged=%s', pr.number, pr.closed, pr.merged)
     if prs:
         for pr in prs:
-            if gh.update_dependencies(pr):
-                terminal.stdout(f'Updated dependencies in {pr_number_with_style(pr)}.')
+            gh.update_dependencies(pr, f'Updated dependencies in {pr_number_with_style(pr)}.')
 
             if pr.closed or pr.merged:
                 continue
-            if gh.update_pr(record, pr):
-                terminal.stdout(f'Set PR {pr_number_with_style(pr)} base branch to {s.emphasis(pr.base)}.')
+            base = record.get_parent().branch_name
+            gh.update_pr(record, pr, f'Set PR {pr_number_with_style(pr)} base branch to {s.emphasis(base)}.')
 
     else:
         pr = gh.create_pr(record.get_parent().branch_name, record.branch_name, title, draft)
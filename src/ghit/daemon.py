@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
+from . import terminal
+from .error import GhitError
+from .private import check_private, private_dir
+
+if TYPE_CHECKING:
+    import pygit2 as git
+
+    from .gh import GH
+    from .gh_graphql import PR
+    from .stack import Stack
+
+DAEMON_SOCKET = 'daemon.sock'
+# Unix socket paths are limited to about a hundred bytes.
+MAX_SOCKET_PATH = 100
+# Seconds between the checks of the stack file and of the branch refs.
+POLL_SECONDS = 1
+# The PRs are refreshed at least that often, and not more often than the
+# minimum, whatever changes, to stay well within the GitHub rate limits.
+REFRESH_SECONDS = 60
+MIN_REFRESH_SECONDS = 5
+# A fresh request waits for a refresh, which may take a while.
+CLIENT_TIMEOUT = 120
+
+
+def is_supported() -> bool:
+    return hasattr(socket, 'AF_UNIX')
+
+
+def runtime_dir() -> Path:
+    """Returns the directory of the sockets that don't fit in .ghit, which
+    only the user may access: $XDG_RUNTIME_DIR, or a directory of the user
+    in the temporary directory."""
+    xdg = os.environ.get('XDG_RUNTIME_DIR')
+    if xdg:
+        path = Path(xdg)
+        check_private(path, stat.S_IFDIR)
+        return path
+    return private_dir(Path(tempfile.gettempdir()) / f'ghit-{os.getuid()}')
+
+
+def socket_path(dotghit: Path) -> Path:
+    path = dotghit / DAEMON_SOCKET
+    if len(str(path)) < MAX_SOCKET_PATH:
+        return path
+    digest = hashlib.sha256(str(dotghit.resolve()).encode()).hexdigest()[:16]
+    return runtime_dir() / f'ghit-{digest}.sock'
+
+
+def _check_peer(s: socket.socket) -> None:
+    """Checks that the daemon runs as the user, where the peer credentials
+    are available."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return
+    _, uid, _ = struct.unpack('3i', s.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    if uid != os.getuid():
+        raise GhitError(f'ghit daemon runs as user {uid}.')
+
+
+class DaemonClient:
+    """Talks to a running `ghit daemon`. Every call returns None when there
+    is no daemon to talk to, so that the caller falls back to GitHub."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _call(self, request: dict[str, any]) -> dict[str, any] | None:
+        # The responses are pickled, so the daemon must be the user's own.
+        try:
+            check_private(self.path, stat.S_IFSOCK)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(CLIENT_TIMEOUT)
+                s.connect(str(self.path))
+                _check_peer(s)
+                s.sendall(json.dumps(request).encode() + b'\n')
+                s.shutdown(socket.SHUT_WR)
+                with s.makefile('rb') as f:
+                    response = f.read()
+        except (OSError, GhitError) as e:
+            logging.debug('ghit daemon is not available: %s', e)
+            return None
+        try:
+            result = pickle.loads(response)  # noqa: S301 the socket and its peer are checked to be the user's
+        except Exception as e:  # noqa: BLE001 a truncated or foreign response may raise anything
+            logging.debug('ghit daemon response is not readable: %s', e)
+            return None
+        if not isinstance(result, dict):
+            logging.debug('ghit daemon response is not readable: %s', type(result))
+            return None
+        if 'error' in result:
+            logging.debug('ghit daemon failed: %s', result['error'])
+            return None
+        return result
+
+    def prs(self, heads: list[str], fresh: bool) -> list[PR] | None:
+        result = self._call({'command': 'prs', 'heads': heads, 'fresh': fresh})
+        return result['prs'] if result else None
+
+    def refresh(self) -> bool:
+        return self._call({'command': 'refresh'}) is not None
+
+    def stop(self) -> bool:
+        return self._call({'command': 'stop'}) is not None
+
+
+def connect_daemon(dotghit: Path) -> DaemonClient | None:
+    if not is_supported():
+        return None
+    try:
+        path = socket_path(dotghit)
+    except (OSError, GhitError) as e:
+        logging.debug('ghit daemon is not available: %s', e)
+        return None
+    return DaemonClient(path) if path.exists() else None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            response = self.server.daemon.handle(json.loads(self.rfile.readline()))
+        except BaseException as e:  # noqa: BLE001 graphql() raises BaseException
+            logging.exception('request failed')
+            response = {'error': str(e)}
+        self.wfile.write(pickle.dumps(response))
+
+
+class Daemon:
+    """Keeps the PRs of the stack warm: refreshes them when the stack file or
+    the branches change, and periodically, and serves them over a Unix
+    socket to the other ghit commands."""
+
+    def __init__(
+        self,
+        repo: git.Repository,
+        gh: GH,
+        load_stack: Callable[[], Stack],
+        stack_filename: Path,
+        path: Path,
+    ) -> None:
+        self.repo = repo
+        self.gh = gh
+        self.load_stack = load_stack
+        self.stack_filename = stack_filename
+        self.path = path
+        self._prs: dict[str, list[PR]] = {}
+        self._heads: list[str] = []
+        self._lock = threading.Lock()
+        self._refreshed = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._server: socketserver.BaseServer | None = None
+
+    def handle(self, request: dict[str, any]) -> dict[str, any]:
+        command = request.get('command')
+        if command == 'prs':
+            return {'prs': self.prs(request['heads'], request.get('fresh', False))}
+        if command == 'refresh':
+            self._wake.set()
+            return {}
+        if command == 'stop':
+            self._stop.set()
+            threading.Thread(target=self._server.shutdown).start()
+            return {}
+        return {'error': f'unknown command {command}'}
+
+    def prs(self, heads: list[str], fresh: bool) -> list[PR]:
+        with self._lock:
+            missing = heads if fresh else [head for head in heads if head not in self._prs]
+            if missing:
+                self._update(missing)
+            return [pr for head in heads for pr in self._prs.get(head, [])]
+
+    def _update(self, heads: list[str]) -> None:
+        logging.debug('refreshing PRs of %d heads', len(heads))
+        prs = self.gh.fetch_prs(heads)
+        for head in heads:
+            self._prs[head] = []
+        for pr in prs:
+            self._prs.setdefault(pr.head, []).append(pr)
+
+    def refresh(self) -> None:
+        stack = self.load_stack()
+        with self._lock:
+            self.gh.stack = stack
+            self._heads = self.gh.heads()
+            self._prs = {}
+            self._update(self._heads)
+
+    def _signature(self) -> tuple:
+        try:
+            mtime = self.stack_filename.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        refs = []
+        for head in self._heads:
+            ref = self.repo.references.get(f'refs/heads/{head}')
+            refs.append(str(ref.target) if ref else None)
+        return mtime, tuple(refs)
+
+    def _watch(self) -> None:
+        signature = None
+        while not self._stop.is_set():
+            since = time.monotonic() - self._refreshed
+            changed = self._signature() != signature or self._wake.is_set() or since >= REFRESH_SECONDS
+            if changed and since >= MIN_REFRESH_SECONDS:
+                self._wake.clear()
+                try:
+                    self.refresh()
+                except BaseException:  # noqa: BLE001 graphql() raises BaseException
+                    logging.exception('refresh failed')
+                self._refreshed = time.monotonic()
+                signature = self._signature()
+            self._stop.wait(POLL_SECONDS)
+
+    def serve(self) -> None:
+        if self.path.exists():
+            if DaemonClient(self.path).refresh():
+                raise GhitError(f'ghit daemon is already running on {self.path}.')
+            self.path.unlink()
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+            daemon = self
+
+        # The socket is created accessible only by the user, which chmod
+        # after bind would leave a window open for.
+        umask = os.umask(0o177)
+        try:
+            self._server = Server(str(self.path), _Handler)
+        finally:
+            os.umask(umask)
+        watcher = threading.Thread(target=self._watch, daemon=True)
+        watcher.start()
+        terminal.stdout(f'ghit daemon is listening on {self.path}.')
+        try:
+            self._server.serve_forever(POLL_SECONDS)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop.set()
+            self._server.server_close()
+            self.path.unlink(missing_ok=True)
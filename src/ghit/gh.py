@@ -1,30 +1,60 @@
 from __future__ import annotations
 
-import json
+import functools
 import logging
 import os
 import subprocess
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 from typing import TYPE_CHECKING
 from urllib.parse import ParseResult, urlparse
 
 from . import gh_graphql as ghgql
-from . import graphql as gql
+from . import terminal
+from .cache import PRCache, RepositoryMeta
 from .error import GhitError
+from .gh_transport import Transport
 
 if TYPE_CHECKING:
     import pygit2 as git
 
+    from .daemon import DaemonClient
     from .stack import Stack
 
 GH_SCHEME = 'git@github.com:'
 
 GH_TEMPLATES = ['.github', 'docs', '']
 
+# Set to 'search' to look the stack PRs up with the search API.
+GHIT_FETCH_MODE = 'GHIT_FETCH_MODE'
+# Caps the number of concurrent GraphQL requests.
+GHIT_MAX_WORKERS = 'GHIT_MAX_WORKERS'
+
 COMMENT_BEGIN = '<!-- GHIT dependencies begin -->'
 COMMENT_FIRST_LINE = 'Current dependencies on/for this PR:'
 COMMENT_END = '<!-- GHIT dependencies end -->'
+# The PR author reacting with these doesn't settle a review thread.
+IGNORED_REACTIONS = ('EYES', 'CONFUSED')
+
+
+def _reacted(comment: ghgql.Comment, login: str) -> bool:
+    """Tells whether the user has reacted to the comment. The reaction counts
+    of a summary save looking through the reactions, and fetching their
+    further pages, when nobody has reacted."""
+    if comment.reaction_groups is not None and not any(
+        count for content, count in comment.reaction_groups.items() if content not in IGNORED_REACTIONS
+    ):
+        return False
+    return any(r.author.login == login and r.content not in IGNORED_REACTIONS for r in comment.reactions)
+
+
+def _mtime(filename: Path) -> int | None:
+    try:
+        return filename.stat().st_mtime_ns
+    except OSError:
+        return None
+
 
 def get_gh_owner_repository(url: ParseResult) -> tuple[str, str]:
     _, owner, repository = url.path.split('/', 2)
@@ -83,23 +113,86 @@ def _patch_body(body: str, comment: str) -> str | None:
     return body + '\n' + comment
 
 class GH:
-    def __init__(self, repo: git.Repository, stack: Stack) -> None:
+    def __init__(
+        self,
+        repo: git.Repository,
+        stack: Stack,
+        transport: Transport | None = None,
+        cache: PRCache | None = None,
+        stale: bool = False,
+        daemon: DaemonClient | None = None,
+        readonly: bool = False,
+        profile: ghgql.Profile = ghgql.FULL,
+    ) -> None:
         self.stack = stack
         self.repo = repo
-        self.url = get_gh_url(repo)
-        self.owner, self.repository = get_gh_owner_repository(self.url)
-        self.token = get_gh_token(self.url)
-        self.template: str | None = None
-        for t in GH_TEMPLATES:
-            filename = Path(repo.workdir) / t / 'pull_request_template.md'
-            if filename.exists():
-                self.template = filename.open().read()
-                logging.debug('found PR template: %s', filename)
-                break
-        else:
-            logging.debug('no PR templates found')
+        self.cache = cache
+        self.max_workers = int(os.getenv(GHIT_MAX_WORKERS, ghgql.MAX_WORKERS))
+        # The local-only commands never need the credentials nor the metadata,
+        # which are only looked up when first used.
+        self.__transport = transport
+        self.__transport_lock = threading.Lock()
+        self.stale = stale and readonly and cache is not None
+        self.daemon = daemon
+        self.readonly = readonly
+        self.profile = profile
+        # The cached PRs fetched with these profiles have all the parts needed.
+        self.profiles = [name for name, other in ghgql.PROFILES.items() if other.covers(profile)]
+        self.__refresh: threading.Thread | None = None
+        self.__mutated = False
+        self.__updates = ghgql.MutationBatch()
+        # The messages to report by branch once its updates are sent.
+        self.__update_messages: dict[str, list[str]] = {}
         self.__prs = None
 
+    @functools.cached_property
+    def meta(self) -> RepositoryMeta:
+        """The repository metadata, cached by the origin remote URL."""
+        meta = self.cache.load_repository(self.remote) if self.cache else None
+        if meta is None:
+            url = get_gh_url(self.repo)
+            meta = RepositoryMeta(url.geturl(), *get_gh_owner_repository(url))
+            if self.cache:
+                self.cache.store_repository(self.remote, meta)
+        return meta
+
+    @property
+    def remote(self) -> str:
+        return self.repo.remotes['origin'].url
+
+    @property
+    def url(self) -> ParseResult:
+        return urlparse(self.meta.url)
+
+    @property
+    def owner(self) -> str:
+        return self.meta.owner
+
+    @property
+    def repository(self) -> str:
+        return self.meta.name
+
+    @property
+    def transport(self) -> Transport:
+        """The transport, created with the token on the first request."""
+        with self.__transport_lock:
+            if self.__transport is None:
+                self.__transport = Transport(get_gh_token(self.url), pool_size=self.max_workers)
+            return self.__transport
+
+    def close(self) -> None:
+        if self.__mutated and self.daemon:
+            self.daemon.refresh()
+        if self.__refresh:
+            logging.debug('waiting for the PR cache refresh')
+            self.__refresh.join()
+        if self.cache:
+            self.cache.close()
+        if ghgql.STATS.prs:
+            logging.debug(ghgql.STATS.dump())
+        if self.__transport:
+            self.__transport.close()
+
     def get_prs(self, branch_name: str) -> list[ghgql.PR]:
         if self.__prs is None:
             self.__prs = self._search_stack_prs()
@@ -115,17 +208,16 @@ class GH:
         return True
 
     @classmethod
-    def unresolved(cls: GH, pr: ghgql.PR) -> dict[ghgql.Author, list[ghgql.Comment]]:
-        result = [thread for thread in pr.threads.data if not thread.resolved]
+    def unresolved(cls: GH, pr: ghgql.PR, first: bool = False) -> dict[ghgql.Author, list[ghgql.Comment]]:
+        """Returns the comments of the unresolved threads the PR author has not
+        answered, or only of the first such thread if first is set."""
+        result = (thread for thread in pr.threads if not thread.resolved)
 
         def author_reacted(thread: ghgql.ReviewThread) -> bool:
             if not thread.comments.data:
                 logging.debug('no comments?')
                 return False
-            for reaction in thread.comments.data[-1].reactions.data:
-                if reaction.author.login == pr.author.login and reaction.content not in ['EYES', 'CONFUSED']:
-                    return True
-            return False
+            return _reacted(thread.comments.data[-1], pr.author.login)
 
         def author_commented(thread: ghgql.ReviewThread) -> bool:
             return thread.comments.data and thread.comments.data[-1].author.login == pr.author.login
@@ -135,11 +227,13 @@ class GH:
             lambda cd: not author_commented(cd) and not author_reacted(cd),
             result,
         ):
-            for c in thread.comments.data:
+            for c in thread.comments:
                 if c.author in comments:
                     comments[c.author].append(c)
                 else:
                     comments[c.author] = [c]
+            if first:
+                break
         return comments
 
     @dataclass
@@ -149,13 +243,16 @@ class GH:
         approved: list[ghgql.Review]
         in_sync: bool
 
-    def pr_stats(self, record: Stack) -> dict[ghgql.PR, PRStats]:
+    def pr_stats(self, record: Stack, summary: bool = False) -> dict[ghgql.PR, PRStats]:
+        """Returns the stats of the PRs of the record. The summary only tells
+        whether there are unresolved comments, which may save fetching the
+        remaining review threads."""
         stats: dict[ghgql.PR, GH.PRStats] = {}
         for pr in self.get_prs(record.branch_name):
             authors: dict[str, ghgql.Review] = {}
-            for r in pr.reviews.data:
+            for r in pr.reviews:
                 authors[r.author.login] = r
-            nr = GH.unresolved(pr)
+            nr = GH.unresolved(pr, first=summary)
             cr = [r for r in authors.values() if r.state == 'CHANGES_REQUESTED']
             approved = [r for r in authors.values() if r.state == 'APPROVED']
             sync = self.is_sync(pr, record)
@@ -183,8 +280,8 @@ class GH:
             if not record.get_parent():
                 prs[record.branch_name] = []
 
-        heads = [record.branch_name for record in self.stack.traverse() if record.get_parent() or not record.length()]
-        for pr in ghgql.search_prs(self.token, self.owner, self.repository, heads):
+        heads = self.heads()
+        for pr in self._fetch_prs(heads):
             if pr.head not in prs:
                 prs.update({pr.head: [pr]})
             else:
@@ -193,60 +290,172 @@ class GH:
         logging.debug('Query done.')
         return prs
 
-    def update_dependencies(self, pr: ghgql.PR) -> bool:
+    def heads(self) -> list[str]:
+        """Returns the stack branches that may have PRs."""
+        return [record.branch_name for record in self.stack.traverse() if record.get_parent() or not record.length()]
+
+    def _fetch_prs(self, heads: list[str]) -> list[ghgql.PR]:
+        if self.daemon:
+            # Don't rely on what the daemon has seen if the PRs are to be updated.
+            prs = self.daemon.prs(heads, fresh=not self.readonly)
+            if prs is not None:
+                return prs
+        return self.fetch_prs(heads)
+
+    def fetch_prs(self, heads: list[str]) -> list[ghgql.PR]:
+        """Fetches the PRs of the heads, from the cache when available."""
+        if os.getenv(GHIT_FETCH_MODE) == 'search':
+            return ghgql.search_prs(
+                self.transport, self.owner, self.repository, heads, self.max_workers, self.profile
+            )
+        if not self.cache:
+            return ghgql.fetch_stack_prs(
+                self.transport, self.owner, self.repository, heads, self.max_workers, self.profile
+            )
+        if self.stale:
+            prs = self._defer_pages(self.cache.load_heads(heads, self.profiles))
+            if prs:
+                logging.debug('rendering %d cached PRs, refreshing the cache in background', len(prs))
+                self.__refresh = threading.Thread(target=self._refresh_cache, args=(heads,), daemon=True)
+                self.__refresh.start()
+                return prs
+        return self._refresh_cache(heads)
+
+    def _refresh_cache(self, heads: list[str]) -> list[ghgql.PR]:
+        versions = ghgql.fetch_pr_versions(self.transport, self.owner, self.repository, heads, self.max_workers)
+        ids = [pr_id for pr_id, _ in versions]
+        cached = self.cache.versions(ids, self.profiles)
+        changed = [pr_id for pr_id, updated_at in versions if cached.get(pr_id) != updated_at.isoformat()]
+        logging.debug('%d of %d PRs changed since cached', len(changed), len(ids))
+        # The former versions of the changed PRs tell how large they are.
+        cached_prs = self.cache.load(changed, self.profiles)
+        history = {pr_id: ghgql.observed_sizes(pr) for pr_id, pr in cached_prs.items()}
+        fresh = ghgql.fetch_prs_by_id(
+            self.transport, self.owner, self.repository, changed, self.max_workers, history, self.profile
+        )
+        self.cache.store(fresh, self.profile.name)
+        self.cache.retain(heads, ids)
+        unchanged = set(ids).difference(changed)
+        prs = self.cache.load([pr_id for pr_id in ids if pr_id in unchanged])
+        self._defer_pages(list(prs.values()))
+        prs.update((pr.id, pr) for pr in fresh)
+        return [prs[pr_id] for pr_id in ids if pr_id in prs]
+
+    def _defer_pages(self, prs: list[ghgql.PR]) -> list[ghgql.PR]:
+        """Lets the cached PRs of a lazy profile fetch their missing pages."""
+        if self.profile.lazy:
+            for pr in prs:
+                ghgql.defer_pages(self.transport, pr, self.profile)
+        return prs
+
+    def _queue_update(self, pr: ghgql.PR, message: str, **fields: any) -> None:
+        self.__updates.update_pr(pr.head, pr.id, **fields)
+        if message:
+            self.__update_messages.setdefault(pr.head, []).append(message)
+
+    def update_dependencies(self, pr: ghgql.PR, message: str = '') -> bool:
+        """Queues the update of the dependencies in the PR body, and the
+        message to report once it is sent."""
         logging.debug('adding dependencies to pr #%s', pr.number)
         comment_md = self._make_stack_comment(pr.number)
         body = _patch_body(pr.body, comment_md)
         if not body:
             logging.debug('dependencies are up to date')
             return False
-        body = json.dumps(body, ensure_ascii=False)
-        ghgql.graphql(
-            self.token,
-            ghgql.make_update_pr_query(gql.input(pullRequestId=f'"{pr.id}"', body=body)),
-        )
+        self._queue_update(pr, message, body=body)
+        pr.body = body
         return True
 
-    def update_pr(self, record: Stack, pr: ghgql.PR) -> bool:
+    def update_pr(self, record: Stack, pr: ghgql.PR, message: str = '') -> bool:
+        """Queues the update of the PR base to the parent of the record, and
+        the message to report once it is sent."""
         base = record.get_parent().branch_name
         if pr.base == base:
             return False
         logging.debug('updating PR base from %s to %s', pr.base, base)
-        ghgql.graphql(
-            self.token,
-            ghgql.make_update_pr_query(gql.input(pullRequestId=f'"{pr.id}"', baseRefName=f'"{base}"')),
-        )
+        self._queue_update(pr, message, baseRefName=base)
         pr.base = base
         return True
 
+    def send_updates(self) -> None:
+        """Sends the PR updates queued by update_dependencies and update_pr
+        in a few batched requests, and reports the updated branches and the
+        branches that failed."""
+        if not self.__updates:
+            return
+        logging.debug('sending %d PR updates', len(self.__updates))
+        self.__mutated = True
+        reports, self.__update_messages = self.__update_messages, {}
+        errors = self.__updates.send(self.transport)
+        for branch, messages in reports.items():
+            if branch not in errors:
+                for message in messages:
+                    terminal.stdout(message)
+        for branch, messages in errors.items():
+            for message in messages:
+                terminal.stderr(f'{branch}: {message}')
+        if errors:
+            raise GhitError(f'Failed to update the PRs of {", ".join(errors)}.')
+
+    def _store_meta(self) -> None:
+        if self.cache:
+            self.cache.store_repository(self.remote, self.meta)
+
+    @property
+    def template(self) -> str | None:
+        """The PR template, looked up only when a PR is created, and read
+        again only when its file has changed."""
+        meta = self.meta
+        workdir = Path(self.repo.workdir)
+        if meta.template_path is not None and _mtime(workdir / meta.template_path) == meta.template_mtime:
+            return meta.template
+        for t in GH_TEMPLATES:
+            path = Path(t) / 'pull_request_template.md'
+            filename = workdir / path
+            if filename.exists():
+                logging.debug('found PR template: %s', filename)
+                meta.template_path, meta.template_mtime = str(path), _mtime(filename)
+                meta.template = filename.read_text()
+                break
+        else:
+            logging.debug('no PR templates found')
+            meta.template_path = meta.template_mtime = meta.template = None
+        self._store_meta()
+        return meta.template
+
+    def repository_id(self) -> str:
+        if not self.meta.id:
+            repo_id_json = ghgql.graphql(
+                self.transport,
+                ghgql.GQL_REPO_ID_QUERY,
+                {'owner': self.owner, 'name': self.repository},
+            )
+            self.meta.id = repo_id_json['data']['repository']['id']
+            self._store_meta()
+        return self.meta.id
+
     def create_pr(self, base: str, branch_name: str, title: str = '', draft: bool = False) -> ghgql.PR:
         logging.debug('creating PR with base %s and head %s', base, branch_name)
         base_branch = self.repo.lookup_branch(base)
         if not base_branch.upstream:
             raise GhitError(f'Base branch {base} has no upstream.')
-        repo_id_json = ghgql.graphql(
-            self.token,
-            ghgql.make_repo_id_query(owner=self.owner, repository=self.repository),
-        )
-
-        repository_id = repo_id_json['data']['repository']['id']
+        repository_id = self.repository_id()
         head = f'{self.owner}:{branch_name}'
-        title = json.dumps(title or branch_name, ensure_ascii=False)
-        draft = 'true' if draft else 'false'
-        body = json.dumps(self.template, ensure_ascii=False)
 
+        self.__mutated = True
         pr_json = ghgql.graphql(
-            self.token,
-            ghgql.make_create_pr_query(
-                gql.input(
-                    repositoryId=f'"{repository_id}"',
-                    baseRefName=f'"{base}"',
-                    headRefName=f'"{head}"',
-                    title=title,
-                    draft=draft,
-                    body=body,
-                )
-            ),
+            self.transport,
+            ghgql.GQL_CREATE_PR_MUTATION,
+            {
+                'input': {
+                    'repositoryId': repository_id,
+                    'baseRefName': base,
+                    'headRefName': head,
+                    'title': title or branch_name,
+                    'draft': draft,
+                    'body': self.template,
+                }
+            },
         )
         pr = ghgql.make_pr({'node': pr_json['data']['createPullRequest']['pullRequest']})
         if branch_name in self.__prs:
@@ -257,10 +466,22 @@ class GH:
         return pr
 
 
-def init_gh(repo: git.Repository, stack: Stack, offline: bool) -> GH | None:
-    gh = GH(repo, stack) if not offline and is_gh(repo) else None
+def init_gh(
+    repo: git.Repository,
+    stack: Stack,
+    offline: bool,
+    cache_filename: Path | None = None,
+    stale: bool = False,
+    daemon: DaemonClient | None = None,
+    readonly: bool = False,
+    profile: ghgql.Profile = ghgql.FULL,
+) -> GH | None:
+    gh = None
+    if not offline and is_gh(repo):
+        cache = PRCache(cache_filename) if cache_filename else None
+        gh = GH(repo, stack, cache=cache, stale=stale, daemon=daemon, readonly=readonly, profile=profile)
     if gh:
-        logging.debug('found gh repository %s', gh.repository)
+        logging.debug('found gh repository %s', gh.remote)
     elif offline:
         logging.debug('working offline')
     else:
@@ -1,222 +1,43 @@
 from __future__ import annotations
 
+import functools
 import logging
-import os
-from dataclasses import dataclass
+import math
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import astuple, dataclass, replace
 from datetime import datetime
-from typing import Callable
-
-import requests
+from operator import attrgetter
+from typing import TYPE_CHECKING, Callable, TypeVar
 
 from . import graphql as gql
 from . import terminal
 
-# region query
-
-FIRST_FEW = {'first': 10}
-
-GQL_REACTION = gql.fields('content', gql.obj('user', 'login', 'name'))
-GQL_AUTHOR = gql.obj('author', 'login', gql.on('User', 'name'))
-GQL_COMMENT = gql.fields(
-    'id',
-    'url',
-    'body',
-    'createdAt',
-    GQL_AUTHOR,
-    gql.paged('reactions', FIRST_FEW, GQL_REACTION),
-)
-GQL_REVIEW_THREAD = gql.fields(
-    'path',
-    'isResolved',
-    'isOutdated',
-    gql.paged('comments', {'last': 1}, GQL_COMMENT),
-)
-GQL_REVIEW = gql.fields('state', 'url', GQL_AUTHOR)
-GQL_COMMIT = gql.obj('commit', gql.paged('comments', {'last': 1}, GQL_COMMENT))
-GQL_PR = gql.fields(
-    'number',
-    'id',
-    'title',
-    GQL_AUTHOR,
-    'body',
-    'url',
-    'baseRefName',
-    'headRefName',
-    'isDraft',
-    'locked',
-    'closed',
-    'merged',
-    'mergedAt',
-    'state',
-    gql.paged('comments', FIRST_FEW, GQL_COMMENT),
-    gql.paged('reviewThreads', FIRST_FEW, GQL_REVIEW_THREAD),
-    gql.paged('reviews', FIRST_FEW, GQL_REVIEW),
-    gql.paged('commits', FIRST_FEW, GQL_COMMIT),
-)
-
-
-def first_n_after(name: str, q: str, n: int, after: str, **opts):
-    return gql.paged(name, {'first': n, 'after': gql.cursor_or_null(after), **opts}, q)
-
-
-def make_prs_query(owner: str, repository: str, heads: list[str], after: str | None = None):
-    return gql.query(
-        'query search_prs',
-        first_n_after(
-            'search',
-            gql.on('PullRequest', GQL_PR),
-            10,
-            after,
-            type='ISSUE',
-            query=f'"repo:{owner}/{repository} is:pr {heads}"',
-        ),
-    )
-
-
-def pr_details_query(name: str, detail: Callable[..., str]):
-    def q(owner: str, repository: str, pr_number: int, *after: str):
-        return gql.query(
-            f'query {name}',
-            gql.func(
-                'repository',
-                {'owner': f'"{owner}"', 'name': f'"{repository}"'},
-                gql.func('pullRequest', {'number': pr_number}, detail(*after)),
-            ),
-        )
-
-    return q
-
-
-GQL_PR_COMMENTS_QUERY = pr_details_query(
-    'pr_comments',
-    lambda after: first_n_after(
-        'comments',
-        GQL_COMMENT,
-        10,
-        after,
-    ),
-)
-
-GQL_PR_COMMENT_REACTIONS_QUERY = pr_details_query(
-    'pr_comments_reactions',
-    lambda comment_cursor, after: first_n_after(
-        'comments',
-        first_n_after('reactions', GQL_REACTION, 10, after),
-        1,
-        comment_cursor,
-    ),
-)
-
-GQL_PR_THREADS_QUERY = pr_details_query(
-    'pr_reviewThreads',
-    lambda after: first_n_after('reviewThreads', GQL_REVIEW_THREAD, 40, after),
-)
-
-GQL_PR_THREAD_COMMENTS_QUERY = pr_details_query(
-    'pr_thread_comments',
-    lambda thread_cursor, comment_cursor, after: first_n_after(
-        'reviewThreads',
-        first_n_after(
-            'comments',
-            first_n_after('reactions', GQL_REACTION, 10, after),
-            1,
-            comment_cursor,
-        ),
-        1,
-        thread_cursor,
-    ),
-)
-
-GQL_PR_COMMITS_QUERY = pr_details_query('pr_commits', lambda after: first_n_after('commits', GQL_COMMIT, 10, after))
-
-GQL_PR_COMMIT_COMMENTS_QUERY = pr_details_query(
-    'pr_threads_comments',
-    lambda commit_cursor, after: first_n_after(
-        'commits',
-        first_n_after('comments', GQL_COMMENT, 10, after),
-        1,
-        commit_cursor,
-    ),
-)
-
-GQL_PR_COMMIT_COMMENT_REACTIONS_QUERY = pr_details_query(
-    'pr_threads_comments',
-    lambda commit_cursor, comment_cursor, after: first_n_after(
-        'commits',
-        first_n_after(
-            'comments',
-            first_n_after('reactions', GQL_REACTION, 10, after),
-            1,
-            comment_cursor,
-        ),
-        1,
-        commit_cursor,
-    ),
-)
-
-GQL_PR_REVIEWS_QUERY = pr_details_query('pr_reviews', lambda after: first_n_after('reviews', GQL_REVIEW, 40, after))
-
-
-def make_repo_id_query(owner: str, repository: str) -> str:
-    return gql.query(
-        'query get_repo_id',
-        gql.func(
-            'repository',
-            {'owner': f'"{owner}"', 'name': f'"{repository}"'},
-            'id',
-        ),
-    )
-
-
-# endregion query
-
-# region mutations
-
-
-def make_add_comment_query(comment_input: any) -> str:
-    return gql.query(
-        'mutation add_pr_comment',
-        gql.func('addComment', comment_input, 'clientMutationId'),
-    )
-
-
-def make_update_comment_query(comment_input: any) -> str:
-    return gql.query(
-        'mutation update_pr_comment',
-        gql.func('updateIssueComment', comment_input, 'clientMutationId'),
-    )
-
-
-def make_create_pr_query(pr_input: any) -> str:
-    return gql.query(
-        'mutation create_pr',
-        gql.func(
-            'createPullRequest',
-            pr_input,
-            'clientMutationId',
-            gql.obj('pullRequest', GQL_PR),
-        ),
-    )
-
+if TYPE_CHECKING:
+    from .gh_transport import Transport
 
-def make_update_pr_query(pr_input: any) -> str:
-    return gql.query(
-        'mutation update_pr',
-        gql.func(
-            'updatePullRequest',
-            pr_input,
-            'clientMutationId',
-        ),
-    )
+T = TypeVar('T')
 
 
-# endregion mutations
+def parse_timestamp(value: str) -> datetime:
+    """Parses a GitHub timestamp, whose Z suffix fromisoformat only accepts
+    from Python 3.11."""
+    return datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
 
 # region classes
 
+# The model classes declare __slots__, as there may be tens of thousands of
+# comments and reactions, and dataclass(slots=True) needs Python 3.10.
 
-@dataclass
+
+@dataclass(eq=False)
 class Author:
+    """The authors are interned by login, so that they compare and hash by
+    identity."""
+
+    __slots__ = ('login', 'name')
     login: str
     name: str | None
 
@@ -225,30 +46,47 @@ class Author:
             return f'{self.name} ({self.login})'
         return self.name or self.login
 
-    def __hash__(self) -> int:
-        return hash(self.login)
+    def __reduce__(self) -> tuple:
+        return intern_author, (self.login, self.name)
+
+
+_AUTHORS: dict[str, Author] = {}
+
+
+def intern_author(login: str, name: str | None = None) -> Author:
+    author = _AUTHORS.get(login)
+    if author is None:
+        author = _AUTHORS.setdefault(login, Author(login, name))
+    if name and not author.name:
+        author.name = name
+    return author
 
 
 @dataclass
 class Reaction:
+    __slots__ = ('content', 'author')
     content: str
-    author: Author
+    author: Author | None
 
 
 @dataclass
 class Comment:
+    __slots__ = ('id', 'author', 'created_at', 'body', 'url', 'reactions', 'cursor', 'reaction_groups')
     id: str
-    author: Author
-    created_at: datetime
-    body: str
-    reacted: bool
-    url: str
+    author: Author | None
+    created_at: datetime | None
+    body: str | None
+    url: str | None
     reactions: gql.Pages[Reaction]
     cursor: str
+    # The number of reactors by reaction content, when fetched as a summary.
+    reaction_groups: dict[str, int] | None
 
 
 @dataclass
 class ReviewThread:
+    __slots__ = ('id', 'path', 'resolved', 'outdated', 'comments', 'cursor')
+    id: str
     path: str
     resolved: bool
     outdated: bool
@@ -258,29 +96,54 @@ class ReviewThread:
 
 @dataclass
 class Review:
-    author: Author
+    __slots__ = ('author', 'state', 'url')
+    author: Author | None
     state: str
-    url: str
+    url: str | None
 
 
 @dataclass
 class Commit:
+    __slots__ = ('id', 'comments', 'cursor')
+    id: str
     comments: gql.Pages[Comment]
     cursor: str
 
 
 @dataclass
 class PR:
+    __slots__ = (
+        'number',
+        'id',
+        'author',
+        'title',
+        'body',
+        'url',
+        'state',
+        'closed',
+        'merged',
+        'merged_at',
+        'updated_at',
+        'locked',
+        'draft',
+        'base',
+        'head',
+        'threads',
+        'comments',
+        'reviews',
+        'commits',
+    )
     number: int
     id: str
-    author: Author
+    author: Author | None
     title: str
-    body: str
+    body: str | None
     url: str
     state: str
     closed: bool
     merged: bool
     merged_at: datetime | None
+    updated_at: datetime
     locked: bool
     draft: bool
     base: str
@@ -296,126 +159,707 @@ class PR:
 
 # endregion classes
 
-# region constructors
+# region query
+
+# GitHub refuses queries that may return more than this many nodes.
+MAX_QUERY_NODES = 500_000
+# Rate limit points a single batched query is allowed to cost.
+MAX_QUERY_COST = 100
+# Most heads have a single PR, a few have been reopened once or twice.
+PRS_PER_HEAD = 2
+# GraphQL requests in flight when completing the PR connections.
+MAX_WORKERS = 8
+# GitHub rejects the search queries longer than this.
+MAX_SEARCH_QUERY_LENGTH = 256
+
+
+@dataclass(frozen=True)
+class PageSizes:
+    prs: int = 10
+    comments: int = 10
+    reactions: int = 10
+    threads: int = 10
+    reviews: int = 10
+    commits: int = 10
+
+    def head_cost(self) -> tuple[int, int]:
+        """Estimates the nodes and the requests of one PRs connection the way
+        GitHub does: every connection is requested once per parent node."""
+        pr_requests = 4 + self.comments + 2 * self.threads + 2 * self.commits
+        pr_nodes = (
+            self.comments * (1 + self.reactions)
+            + self.threads * (2 + self.reactions)
+            + self.reviews
+            + self.commits * (2 + self.reactions)
+        )
+        return self.prs * (1 + pr_nodes), 1 + self.prs * pr_requests
+
+    def variables(self) -> dict[str, int]:
+        """The values of the nested page size variables of the PR fragment."""
+        return {
+            'comments': self.comments,
+            'reactions': self.reactions,
+            'threads': self.threads,
+            'reviews': self.reviews,
+            'commits': self.commits,
+        }
+
+    def restrict(self, profile: Profile) -> PageSizes:
+        """Returns the page sizes of the connections the profile selects,
+        and zero for the others, which are left out of the query cost."""
+        return PageSizes(
+            prs=self.prs,
+            comments=self.comments if profile.comments else 0,
+            reactions=self.reactions if profile.comments or profile.reviews else 0,
+            threads=self.threads if profile.reviews else 0,
+            reviews=self.reviews if profile.reviews else 0,
+            commits=self.commits if profile.comments else 0,
+        )
+
+    def merge(self, other: PageSizes) -> PageSizes:
+        """Returns the page sizes that fit both."""
+        return PageSizes(*(max(a, b) for a, b in zip(astuple(self), astuple(other))))
+
+
+BATCH_PAGE_SIZES = tuple(PageSizes(PRS_PER_HEAD, n, 10, n, n, n) for n in (100, 50, 25, 10))
+# The same for PRs looked up by id, one PR per id.
+NODES_PAGE_SIZES = tuple(replace(sizes, prs=1) for sizes in BATCH_PAGE_SIZES)
+# Heads per query when only the PR versions are fetched.
+VERSIONS_PER_QUERY = 100
+# GitHub returns at most this many items per page.
+MAX_PAGE_SIZE = 100
+# The nested page sizes of a PR fetched before are rounded up to the next
+# step above what it had then, leaving some room for new items.
+PAGE_SIZE_STEPS = (5, 10, 25, 50, MAX_PAGE_SIZE)
+# The continuation page sizes when the connection total count is not known.
+CONTINUATION_SIZES = PageSizes(prs=10, comments=10, reactions=10, threads=40, reviews=40, commits=10)
+
+
+def heads_per_query(sizes: PageSizes) -> int:
+    nodes, requests = sizes.head_cost()
+    return max(1, min(MAX_QUERY_NODES // nodes, MAX_QUERY_COST * 100 // requests))
+
+
+def fit_page_sizes(heads: int, tiers: tuple[PageSizes, ...] = BATCH_PAGE_SIZES) -> tuple[PageSizes, int]:
+    """Picks the largest nested page sizes that still allow fetching all the
+    heads in one query, or the smallest ones and the number of heads per query."""
+    for sizes in tiers:
+        chunk = heads_per_query(sizes)
+        if chunk >= heads:
+            break
+    return sizes, chunk
+
+
+def _next_step(n: int) -> int:
+    return next((step for step in PAGE_SIZE_STEPS if step > n), MAX_PAGE_SIZE)
+
+
+def adapt_page_sizes(observed: PageSizes) -> PageSizes:
+    """Picks the nested page sizes for refetching a PR of the observed sizes,
+    so that the connections are likely complete after the first page."""
+    return PageSizes(1, *(_next_step(n) for n in astuple(observed)[1:]))
+
+
+def _continuations(n: int, first: int, then: int) -> int:
+    return math.ceil(max(0, n - first) / then)
+
+
+class PageStats:
+    """Counts the continuation requests made to complete the PR connections,
+    and the ones that the fixed page sizes would have needed."""
+
+    def __init__(self) -> None:
+        self.prs = 0
+        self.continuations = 0
+        self.fixed_continuations = 0
+        self._lock = threading.Lock()
+
+    def add_continuation(self) -> None:
+        with self._lock:
+            self.continuations += 1
+
+    def add_prs(self, prs: list[PR], fixed: PageSizes) -> None:
+        """Accounts for the PRs fetched, had their first pages been of the
+        fixed sizes, and their continuations of the CONTINUATION_SIZES."""
+        then = CONTINUATION_SIZES
+        needed = 0
+        for pr in prs:
+            sizes = observed_sizes(pr)
+            needed += (
+                _continuations(sizes.comments, fixed.comments, then.comments)
+                + _continuations(sizes.threads, fixed.threads, then.threads)
+                + _continuations(sizes.reviews, fixed.reviews, then.reviews)
+                + _continuations(sizes.commits, fixed.commits, then.commits)
+                + sum(
+                    _continuations(len(comment.reactions.data), fixed.reactions, then.reactions)
+                    for comment in pr.comments.data
+                )
+            )
+        with self._lock:
+            self.prs += len(prs)
+            self.fixed_continuations += needed
+
+    def dump(self) -> str:
+        return (
+            f'{self.prs} PRs completed with {self.continuations} continuation requests, '
+            f'{self.fixed_continuations - self.continuations} fewer than with fixed page sizes'
+        )
+
+
+STATS = PageStats()
+
 
+@dataclass
+class OperationStats:
+    calls: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    cost: int = 0
+    max_cost: int = 0
+
+
+class CallStats:
+    """Accounts for the GraphQL requests by operation name: the calls, the
+    bytes of the responses, the seconds they took, retries included, and
+    the rate limit points GitHub reported."""
+
+    def __init__(self) -> None:
+        self.operations: dict[str, OperationStats] = {}
+        self._lock = threading.Lock()
+
+    def add(self, operation: str, size: int, seconds: float, cost: int) -> None:
+        with self._lock:
+            stats = self.operations.setdefault(operation, OperationStats())
+            stats.calls += 1
+            stats.bytes += size
+            stats.seconds += seconds
+            stats.cost += cost
+            stats.max_cost = max(stats.max_cost, cost)
+
+    def calls(self, operation: str | None = None) -> int:
+        """Returns the calls of the operation, or of all of them."""
+        with self._lock:
+            if operation is not None:
+                return self.operations[operation].calls if operation in self.operations else 0
+            return sum(stats.calls for stats in self.operations.values())
+
+    def expected_cost(self, operation: str) -> int:
+        """Returns the rate limit points the next call of the operation is
+        expected to cost, from the most it has cost so far, or 1."""
+        with self._lock:
+            stats = self.operations.get(operation)
+            return max(1, stats.max_cost) if stats else 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.operations.clear()
+
+    def dump(self) -> str:
+        with self._lock:
+            operations = sorted(self.operations.items(), key=lambda item: (-item[1].calls, item[0]))
+            total = OperationStats(*(sum(values) for values in zip(*(astuple(stats) for _, stats in operations))))
+        return '\n'.join(
+            f'{name:24} {stats.calls:5} calls {stats.bytes / 1024:9.1f} KB {stats.seconds:7.3f}s {stats.cost:4} points'
+            for name, stats in [*operations, ('total', total)]
+        )
+
+
+CALLS = CallStats()
+
+
+def operation_name(query: str) -> str:
+    """Returns the name of the operation of the query, or its kind."""
+    return query.split('{', 1)[0].split('(', 1)[0].rsplit(maxsplit=1)[-1]
+
+
+def _size(name: str) -> str:
+    return f'Int = {getattr(PageSizes(), name)}'
+
+
+GQL_REACTION_GROUPS = gql.obj('reactionGroups', 'content', gql.obj('reactors', 'totalCount'))
+# The latest review of every reviewer, decoded as the reviews.
+LATEST_REVIEWS = gql.alias('reviews', 'latestReviews')
+
+
+@dataclass(frozen=True)
+class Profile:
+    """The parts of the PRs that a command uses. The other parts are not
+    fetched, and are left empty or None in the decoded PRs."""
+
+    name: str
+    # The reviews, and the review threads with their last comment.
+    reviews: bool = False
+    # The author names, the dates and the URLs of the reviews and comments.
+    details: bool = False
+    # The PR description.
+    body: bool = False
+    # The PR conversation and the commit comments, with the comment bodies.
+    comments: bool = False
+    # Only the latest review of every reviewer, and the reaction counts of the
+    # comments along with the first page of their reactions.
+    summary: bool = False
+    # The further pages of the connections are only fetched when iterated.
+    lazy: bool = False
+
+    def covers(self, other: Profile) -> bool:
+        """Tells whether the PRs fetched with this profile have all the parts
+        that the other profile fetches."""
+        parts = ('reviews', 'details', 'body', 'comments')
+        richer = all(getattr(self, part) or not getattr(other, part) for part in parts)
+        # A summary lacks the former reviews.
+        summary = other.summary or not self.summary or not other.reviews
+        lazy = other.lazy or not self.lazy
+        return richer and summary and lazy
+
+
+CLEANUP = Profile('cleanup', lazy=True)
+LS = Profile('ls', reviews=True, summary=True, lazy=True)
+VERBOSE_LS = Profile('verbose_ls', reviews=True, details=True)
+SUBMIT = Profile('submit', body=True)
+FULL = Profile('full', reviews=True, details=True, body=True, comments=True)
+PROFILES = {profile.name: profile for profile in (CLEANUP, LS, VERBOSE_LS, SUBMIT, FULL)}
 
-def _make_author(obj: any) -> Author:
-    return Author(
-        login=obj['login'],
-        name=gql.path(obj, 'name'),
+
+# region schema
+
+# Every model is declared once, field by field. Both the fragments of the
+# profiles and the decoders are generated from the schemas, so that they
+# never disagree. The when predicates are given the profile.
+
+
+def _reaction_groups(groups: list[any]) -> dict[str, int] | None:
+    return {sys.intern(group['content']): group['reactors']['totalCount'] for group in groups} or None
+
+
+def _make_reactions(node: any) -> gql.Pages[Reaction]:
+    # A summary cached without the reactions only counts them, and the
+    # reactions are left to fetch if any.
+    groups = node.get('reactionGroups')
+    reacted = 'reactions' not in node and groups and any(group['reactors']['totalCount'] for group in groups)
+    return gql.Pages('reactions', _make_reaction, None if reacted else node)
+
+
+def _author(name: str = 'author', **options) -> gql.Field:
+    return gql.Field(
+        'author',
+        name,
+        select=lambda fragments: gql.obj(name, fragments['actor']),
+        decode=_make_author,
+        uses=('actor',),
+        **options,
     )
 
 
-def _make_reaction(edge: any) -> Reaction:
-    node = edge['node']
-    return Reaction(
-        content=node['content'],
-        author=_make_author(node['user']),
+def _connection(attr: str, name: str, item: str, decode: Callable[[any], T], size: str, **options) -> gql.Field:
+    """A connection of the PR, fetched with the $size variable as page size
+    and decoded as the Pages of the item model."""
+    key = name.partition(':')[0]
+    return gql.Field(
+        attr,
+        key,
+        select=lambda fragments: gql.counted(name, {'first': gql.var(size)}, fragments[item]),
+        decode=functools.partial(gql.Pages, key, decode),
+        node=True,
+        uses=(item,),
+        variables={size: _size(size)},
+        **options,
     )
 
 
-def query_reactions(subject: str, args: dict[str, any]) -> str:
-    return gql.query('query reactions', gql.func(subject, args, GQL_REACTION))
+def _last_comment(name: str = 'comments') -> gql.Field:
+    return gql.Field(
+        'comments',
+        name,
+        select=lambda fragments: gql.paged('comments', {'last': 1}, fragments['comment']),
+        decode=functools.partial(gql.Pages, 'comments', _make_comment),
+        node=True,
+        uses=('comment',),
+    )
+
 
+ACTOR_SCHEMA = (
+    gql.Field('login'),
+    gql.Field('name', select=gql.on('User', 'name'), when=attrgetter('details')),
+)
+_make_author = gql.decoder('_make_author', __name__, intern_author, ACTOR_SCHEMA, edge=False)
 
-def query_pr_comments(owner: str, repository: str, pr: int) -> str:
-    return gql.query(
-        'query pr_comments',
-        gql.func(
-            'repository',
-            {'owner': f'"{owner}"', 'name': f'"{repository}"'},
-            gql.func('pullRequest', {'id': pr}),
-            GQL_COMMENT,
+REACTION_SCHEMA = (
+    gql.Field('content', decode=sys.intern),
+    _author('user'),
+)
+_make_reaction = gql.decoder('_make_reaction', __name__, Reaction, REACTION_SCHEMA)
+
+COMMENT_SCHEMA = (
+    gql.Field('id'),
+    gql.Field('body', when=attrgetter('comments')),
+    gql.Field('created_at', 'createdAt', decode=parse_timestamp, when=attrgetter('details')),
+    _author(),
+    gql.Field('url', select=gql.on('UniformResourceLocatable', 'url'), when=attrgetter('details')),
+    gql.Field(
+        'reactions',
+        select=lambda fragments: gql.on(
+            'Reactable', gql.counted('reactions', {'first': gql.var('reactions')}, fragments['reaction'])
         ),
-    )
+        decode=_make_reactions,
+        node=True,
+        uses=('reaction',),
+        variables={'reactions': _size('reactions')},
+    ),
+    gql.Field(
+        'reaction_groups',
+        'reactionGroups',
+        select=gql.on('Reactable', GQL_REACTION_GROUPS),
+        decode=_reaction_groups,
+        when=attrgetter('summary'),
+    ),
+    gql.Field('cursor', edge=True),
+)
+_make_comment = gql.decoder('_make_comment', __name__, Comment, COMMENT_SCHEMA)
+
+THREAD_SCHEMA = (
+    gql.Field('id'),
+    gql.Field('path', decode=sys.intern),
+    gql.Field('resolved', 'isResolved'),
+    gql.Field('outdated', 'isOutdated'),
+    _last_comment(),
+    gql.Field('cursor', edge=True),
+)
+_make_thread = gql.decoder('_make_thread', __name__, ReviewThread, THREAD_SCHEMA)
 
+REVIEW_SCHEMA = (
+    gql.Field('state', decode=sys.intern),
+    gql.Field('url', when=attrgetter('details')),
+    _author(),
+)
+_make_review = gql.decoder('_make_review', __name__, Review, REVIEW_SCHEMA)
 
-def _make_comment(edge: any) -> Comment:
-    node = edge['node']
-    return Comment(
-        id=node['id'],
-        author=_make_author(node['author']),
-        created_at=datetime.fromisoformat(node['createdAt']),
-        body=node['body'],
-        reacted=False,
-        url=node['url'],
-        reactions=gql.Pages('reactions', _make_reaction, node),
-        cursor=edge['cursor'],
+COMMIT_SCHEMA = (
+    gql.Field('id'),
+    gql.Field(
+        'comments',
+        'commit',
+        select=lambda fragments: gql.obj('commit', gql.paged('comments', {'last': 1}, fragments['comment'])),
+        decode=functools.partial(gql.Pages, 'comments', _make_comment),
+        uses=('comment',),
+    ),
+    gql.Field('cursor', edge=True),
+)
+_make_commit = gql.decoder('_make_commit', __name__, Commit, COMMIT_SCHEMA)
+
+PR_SCHEMA = (
+    gql.Field('number'),
+    gql.Field('id'),
+    gql.Field('title'),
+    _author(when=lambda profile: profile.reviews or profile.details),
+    gql.Field('body', when=attrgetter('body')),
+    gql.Field('url'),
+    gql.Field('base', 'baseRefName'),
+    gql.Field('head', 'headRefName'),
+    gql.Field('draft', 'isDraft'),
+    gql.Field('locked'),
+    gql.Field('closed'),
+    gql.Field('merged'),
+    gql.Field('merged_at', 'mergedAt', decode=parse_timestamp),
+    gql.Field('updated_at', 'updatedAt', decode=parse_timestamp),
+    gql.Field('state', decode=sys.intern),
+    _connection('comments', 'comments', 'comment', _make_comment, 'comments', when=attrgetter('comments')),
+    _connection('threads', 'reviewThreads', 'thread', _make_thread, 'threads', when=attrgetter('reviews')),
+    _connection(
+        'reviews', 'reviews', 'review', _make_review, 'reviews', when=lambda p: p.reviews and not p.summary
+    ),
+    _connection('reviews', LATEST_REVIEWS, 'review', _make_review, 'reviews', when=lambda p: p.reviews and p.summary),
+    _connection('commits', 'commits', 'commit', _make_commit, 'commits', when=attrgetter('comments')),
+)
+make_pr = gql.decoder('make_pr', __name__, PR, PR_SCHEMA)
+
+# The fragment names and types of the models, in the order they use each other.
+MODELS = (
+    ('actor', 'Actor', ACTOR_SCHEMA),
+    ('reaction', 'Reaction', REACTION_SCHEMA),
+    ('comment', 'Comment', COMMENT_SCHEMA),
+    ('thread', 'PullRequestReviewThread', THREAD_SCHEMA),
+    ('review', 'PullRequestReview', REVIEW_SCHEMA),
+    ('commit', 'PullRequestCommit', COMMIT_SCHEMA),
+    ('pr', 'PullRequest', PR_SCHEMA),
+)
+
+# endregion schema
+
+
+@dataclass(frozen=True)
+class Selection:
+    """The fragments selecting the parts of the PRs of a profile."""
+
+    profile: Profile
+    actor: gql.Fragment
+    reaction: gql.Fragment
+    comment: gql.Fragment
+    thread: gql.Fragment
+    review: gql.Fragment
+    commit: gql.Fragment
+    pr: gql.Fragment
+
+
+@functools.cache
+def make_selection(profile: Profile) -> Selection:
+    # The fragment names of the different profiles must not clash in a query.
+    prefix = '' if profile == FULL else f'{profile.name}_'
+    fragments: dict[str, gql.Fragment] = {}
+    for name, on_type, schema in MODELS:
+        fragments[name] = gql.schema_fragment(f'{prefix}{name}', on_type, schema, profile, fragments)
+    return Selection(profile, **fragments)
+
+
+_FULL = make_selection(FULL)
+GQL_ACTOR = _FULL.actor
+GQL_REACTION = _FULL.reaction
+GQL_COMMENT = _FULL.comment
+GQL_REVIEW_THREAD = _FULL.thread
+GQL_REVIEW = _FULL.review
+GQL_COMMIT = _FULL.commit
+GQL_PR = _FULL.pr
+GQL_PR_VERSION = gql.fields('id', 'updatedAt')
+
+GQL_RATE_LIMIT = gql.obj('rateLimit', 'cost', 'remaining', 'resetAt')
+
+REPOSITORY_VARIABLES = {'owner': 'String!', 'name': 'String!'}
+
+
+def _query(name: str, variables: dict[str, str], *f: str, fragments: tuple[gql.Fragment, ...] = ()) -> str:
+    """Builds a query operation that also reports its rate limit cost."""
+    return gql.operation('query', name, variables, *f, GQL_RATE_LIMIT, fragments=fragments)
+
+
+def _repository(*f: str) -> str:
+    return gql.func('repository', {'owner': gql.var('owner'), 'name': gql.var('name')}, *f)
+
+
+def first_n_after(name: str, q: str, n: int | str, after: str = 'after', **opts):
+    return gql.paged(name, {'first': n, 'after': gql.var(after), **opts}, q)
+
+
+@functools.cache
+def make_search_prs_query(profile: Profile = FULL) -> str:
+    pr = make_selection(profile).pr
+    return _query(
+        'search_prs',
+        {'query': 'String!', 'first': 'Int!', 'after': 'String'},
+        first_n_after('search', pr, gql.var('first'), type='ISSUE', query=gql.var('query')),
+        fragments=(pr,),
     )
 
 
-def _make_review(edge: any) -> Review:
-    node = edge['node']
-    return Review(
-        author=_make_author(node['author']),
-        state=node['state'],
-        url=node['url'],
+@functools.cache
+def make_heads_query(name: str, heads: int, pr: str, fragments: tuple[gql.Fragment, ...] = ()) -> str:
+    """Builds one query with an aliased PRs connection per stack head, the
+    head names being passed as the $h0, $h1... variables."""
+    return _query(
+        name,
+        {**REPOSITORY_VARIABLES, 'first': 'Int!', 'after': 'String', **{f'h{i}': 'String!' for i in range(heads)}},
+        _repository(
+            *(
+                gql.alias(f'h{i}', first_n_after('pullRequests', pr, gql.var('first'), headRefName=gql.var(f'h{i}')))
+                for i in range(heads)
+            )
+        ),
+        fragments=fragments,
     )
 
 
-def _make_commit(edge: any) -> Commit:
-    node = edge['node']
-    return Commit(
-        comments=gql.Pages('comments', _make_comment, node),
-        cursor=edge['cursor'],
+def make_stack_prs_query(heads: int, profile: Profile = FULL) -> str:
+    pr = make_selection(profile).pr
+    return make_heads_query('stack_prs', heads, pr, (pr,))
+
+
+def make_pr_versions_query(heads: int) -> str:
+    return make_heads_query('stack_pr_versions', heads, GQL_PR_VERSION)
+
+
+@functools.cache
+def make_prs_by_id_query(profile: Profile = FULL) -> str:
+    pr = make_selection(profile).pr
+    return _query('prs_by_id', {'ids': '[ID!]!'}, gql.func('nodes', {'ids': gql.var('ids')}, pr), fragments=(pr,))
+
+
+@dataclass(frozen=True)
+class ContinuationKind:
+    """A connection whose next pages are fetched by looking its parent node up
+    by id, with the nodes and the requests every item of a page costs."""
+
+    parent: str
+    path: tuple[str, ...]
+    item: Callable[[Selection], gql.Fragment]
+    size: int
+    item_nodes: int
+    item_requests: int
+
+
+_REACTIONS = PageSizes().reactions
+CONTINUATION_KINDS = {
+    'comments': ContinuationKind(
+        'PullRequest', ('comments',), attrgetter('comment'), CONTINUATION_SIZES.comments, 1 + _REACTIONS, 1
+    ),
+    'reviewThreads': ContinuationKind(
+        'PullRequest', ('reviewThreads',), attrgetter('thread'), CONTINUATION_SIZES.threads, 2 + _REACTIONS, 2
+    ),
+    'reviews': ContinuationKind('PullRequest', ('reviews',), attrgetter('review'), CONTINUATION_SIZES.reviews, 1, 0),
+    'latestReviews': ContinuationKind(
+        'PullRequest', (LATEST_REVIEWS,), attrgetter('review'), CONTINUATION_SIZES.reviews, 1, 0
+    ),
+    'commits': ContinuationKind(
+        'PullRequest', ('commits',), attrgetter('commit'), CONTINUATION_SIZES.commits, 2 + _REACTIONS, 2
+    ),
+    'reactions': ContinuationKind(
+        'Reactable', ('reactions',), attrgetter('reaction'), CONTINUATION_SIZES.reactions, 1, 0
+    ),
+    'threadComments': ContinuationKind(
+        'PullRequestReviewThread',
+        ('comments',),
+        attrgetter('comment'),
+        CONTINUATION_SIZES.comments,
+        1 + _REACTIONS,
+        1,
+    ),
+    'commitComments': ContinuationKind(
+        'PullRequestCommit',
+        ('commit', 'comments'),
+        attrgetter('comment'),
+        CONTINUATION_SIZES.comments,
+        1 + _REACTIONS,
+        1,
+    ),
+}
+# Parent nodes looked up by a single continuation query.
+MAX_CONTINUATIONS_PER_QUERY = 100
+
+
+def _continuation(alias: str, kind: ContinuationKind, item: gql.Fragment) -> str:
+    *outer, name = kind.path
+    connection = gql.counted(name, {'first': gql.var(f'{alias}First'), 'after': gql.var(f'{alias}After')}, item)
+    for field in reversed(outer):
+        connection = gql.obj(field, connection)
+    return gql.alias(alias, gql.func('node', {'id': gql.var(f'{alias}Id')}, gql.on(kind.parent, connection)))
+
+
+@functools.cache
+def make_continuations_query(kinds: tuple[tuple[str, int], ...], profile: Profile = FULL) -> str:
+    """Builds one query fetching the next page of the connections of as many
+    parent nodes of every kind, aliased as comments0, comments1, reactions0...
+    with the $comments0Id, $comments0First and $comments0After variables."""
+    selection = make_selection(profile)
+    variables: dict[str, str] = {}
+    aliases: list[str] = []
+    items: dict[gql.Fragment, None] = {}
+    for name, count in kinds:
+        kind = CONTINUATION_KINDS[name]
+        item = kind.item(selection)
+        items[item] = None
+        for i in range(count):
+            alias = f'{name}{i}'
+            variables.update({f'{alias}Id': 'ID!', f'{alias}First': 'Int!', f'{alias}After': 'String'})
+            aliases.append(_continuation(alias, kind, item))
+    return _query('continuations', variables, *aliases, fragments=tuple(items))
+
+
+GQL_REPO_ID_QUERY = _query('get_repo_id', REPOSITORY_VARIABLES, _repository('id'))
+
+
+# endregion query
+
+# region mutations
+
+
+def _mutation(name: str, field: str, input_type: str, *f: str, fragments: tuple[gql.Fragment, ...] = ()) -> str:
+    return gql.operation(
+        'mutation',
+        name,
+        {'input': f'{input_type}!'},
+        gql.func(field, {'input': gql.var('input')}, 'clientMutationId', *f),
+        fragments=fragments,
     )
 
 
-def _make_thread(edge: any) -> ReviewThread:
-    node = edge['node']
-    return ReviewThread(
-        path=node['path'],
-        resolved=node['isResolved'],
-        outdated=node['isOutdated'],
-        comments=gql.Pages('comments', _make_comment, node),
-        cursor=edge['cursor'],
+GQL_ADD_COMMENT_MUTATION = _mutation('add_pr_comment', 'addComment', 'AddCommentInput')
+GQL_UPDATE_COMMENT_MUTATION = _mutation('update_pr_comment', 'updateIssueComment', 'UpdateIssueCommentInput')
+GQL_CREATE_PR_MUTATION = _mutation(
+    'create_pr',
+    'createPullRequest',
+    'CreatePullRequestInput',
+    gql.obj('pullRequest', make_selection(SUBMIT).pr),
+    fragments=(make_selection(SUBMIT).pr,),
+)
+GQL_UPDATE_PR_MUTATION = _mutation('update_pr', 'updatePullRequest', 'UpdatePullRequestInput')
+# Aliased mutations sent by a single request of a MutationBatch.
+MUTATIONS_PER_REQUEST = 10
+
+
+@functools.cache
+def make_mutations_query(mutations: tuple[tuple[str, str], ...]) -> str:
+    """Builds one request of the (field, input type) mutations aliased as m0,
+    m1... with the $m0, $m1... inputs."""
+    return gql.operation(
+        'mutation',
+        'batch',
+        {f'm{i}': f'{input_type}!' for i, (_, input_type) in enumerate(mutations)},
+        *(
+            gql.alias(f'm{i}', gql.func(field, {'input': gql.var(f'm{i}')}, 'clientMutationId'))
+            for i, (field, _) in enumerate(mutations)
+        ),
     )
 
 
-def make_pr(edge: any) -> PR:
+# endregion mutations
+
+
+# region constructors
+
+
+def make_pr_version(edge: any) -> tuple[str, datetime]:
     node = edge['node']
-    return PR(
-        number=node['number'],
-        id=node['id'],
-        author=_make_author(node['author']),
-        title=node['title'],
-        body=node['body'],
-        url=node['url'],
-        draft=node['isDraft'],
-        locked=node['locked'],
-        closed=node['closed'],
-        merged=node['merged'],
-        merged_at=datetime.fromisoformat(node['mergedAt']) if node['merged'] else None,
-        state=node['state'],
-        base=node['baseRefName'],
-        head=node['headRefName'],
-        comments=gql.Pages('comments', _make_comment, node),
-        threads=gql.Pages('reviewThreads', _make_thread, node),
-        reviews=gql.Pages('reviews', _make_review, node),
-        commits=gql.Pages('commits', _make_commit, node),
+    return node['id'], parse_timestamp(node['updatedAt'])
+
+
+def observed_sizes(pr: PR) -> PageSizes:
+    """Returns the page sizes that would have fetched the complete PR
+    connections at once."""
+    comments = [
+        *pr.comments.data,
+        *(comment for thread in pr.threads.data for comment in thread.comments.data),
+        *(comment for commit in pr.commits.data for comment in commit.comments.data),
+    ]
+    return PageSizes(
+        prs=1,
+        comments=len(pr.comments.data),
+        reactions=max((len(comment.reactions.data) for comment in comments), default=0),
+        threads=len(pr.threads.data),
+        reviews=len(pr.reviews.data),
+        commits=len(pr.commits.data),
     )
 
 
 # endregion constructors
 
 
-def graphql(token: str, query: str) -> any:
-    logging.debug('query GH graphql: %s', query)
-    response = requests.post(
-        url=os.getenv('GITHUB_API_URL', 'https://api.github.com/graphql'),
-        headers={
-            'Authorization': f'Bearer {token}',
-            'Accept': 'application/vnd.github.v3+json',
-        },
-        json={'query': query},
-        timeout=30,
+def graphql(transport: Transport, query: str, variables: dict[str, any] | None = None, check: bool = True) -> any:
+    """Posts the query. The errors of the response are reported and raised,
+    unless check is False, when they are left to the caller."""
+    logging.debug('query GH graphql: %s with %s', query, variables)
+    operation = operation_name(query)
+    start = time.perf_counter()
+    response = transport.post(
+        {'query': query, 'variables': variables or {}},
+        mutation=query.startswith('mutation'),
+        cost=CALLS.expected_cost(operation),
     )
+    seconds = time.perf_counter() - start
     logging.debug('response: %s', response.status_code)
     if not response.ok:
+        CALLS.add(operation, len(response.content), seconds, 0)
         raise BaseException(response.text)
     result = response.json()
+    CALLS.add(operation, len(response.content), seconds, gql.path(result, 'data', 'rateLimit', 'cost') or 0)
     logging.debug('response json: %s', result)
-    if 'errors' in result:
+    if check and 'errors' in result:
         for error in result['errors']:
             if 'type' in error:
                 terminal.stderr(f"{error['type']}: {error['message']}")
@@ -423,156 +867,440 @@ def graphql(token: str, query: str) -> any:
                 terminal.stderr(error['message'])
 
         raise BaseException('errors in GraphQL response')
+    rate_limit = gql.path(result, 'data', 'rateLimit')
+    if rate_limit:
+        transport.rate_limit.update(
+            rate_limit['remaining'],
+            parse_timestamp(rate_limit['resetAt']).timestamp(),
+            rate_limit['cost'],
+        )
     return result
 
 
-def search_prs(token: str, owner: str, repository: str, branches: list[str] = None) -> list[PR]:
-    if branches is None:
-        branches = []
+@dataclass
+class _Mutation:
+    key: str
+    field: str
+    input_type: str
+    input: dict[str, any]
+
+
+class MutationBatch:
+    """Collects the mutations of a command, to send them as aliased mutations
+    with a few requests. The mutations of the same field and node are merged,
+    so that every PR is updated once. The errors are reported by the keys the
+    mutations have been added with, e.g. the branch names."""
+
+    def __init__(self) -> None:
+        self._pending: dict[tuple[str, str], _Mutation] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, key: str, field: str, input_type: str, node_id: str, mutation_input: dict[str, any]) -> None:
+        pending = self._pending.setdefault((field, node_id), _Mutation(key, field, input_type, {}))
+        pending.input.update(mutation_input)
+
+    def update_pr(self, key: str, pr_id: str, **fields: any) -> None:
+        self.add(key, 'updatePullRequest', 'UpdatePullRequestInput', pr_id, {'pullRequestId': pr_id, **fields})
+
+    def send(self, transport: Transport) -> dict[str, list[str]]:
+        """Sends the pending mutations and returns the error messages by key."""
+        mutations = list(self._pending.values())
+        self._pending.clear()
+        errors: dict[str, list[str]] = {}
+        for start in range(0, len(mutations), MUTATIONS_PER_REQUEST):
+            chunk = mutations[start : start + MUTATIONS_PER_REQUEST]
+            logging.debug('sending %d mutations', len(chunk))
+            result = graphql(
+                transport,
+                make_mutations_query(tuple((mutation.field, mutation.input_type) for mutation in chunk)),
+                {f'm{i}': mutation.input for i, mutation in enumerate(chunk)},
+                check=False,
+            )
+            for error in result.get('errors', ()):
+                # The errors without a path fail the whole request.
+                alias = (error.get('path') or [None])[0]
+                failed = [chunk[int(alias[1:])]] if alias else chunk
+                for mutation in failed:
+                    errors.setdefault(mutation.key, []).append(error['message'])
+        return errors
+
+
+def _size_variables(sizes: PageSizes, pr: gql.Fragment) -> dict[str, int]:
+    return {name: size for name, size in sizes.variables().items() if name in pr.variables}
+
+
+def search_prs(
+    transport: Transport,
+    owner: str,
+    repository: str,
+    branches: list[str] = None,
+    max_workers: int = MAX_WORKERS,
+    profile: Profile = FULL,
+) -> list[PR]:
+    """Looks the PRs of the branches up with the search API. The heads are
+    split into search queries of bounded length, which run concurrently."""
     if not branches:
         return []
+    sizes, chunk = fit_page_sizes(len(branches), tuple(sizes.restrict(profile) for sizes in BATCH_PAGE_SIZES))
+    searches = _chunk_search(f'repo:{owner}/{repository} is:pr', branches, chunk)
+    logging.debug('searching PRs of %d heads with %d queries', len(branches), len(searches))
+    results: list[list[PR]] = [[] for _ in searches]
+    selection = make_selection(profile)
+
+    def fetch_chunk(prs: list[PR], search: str, heads: int) -> list[gql.Task]:
+        variables = {
+            'query': search,
+            'first': min(MAX_PAGE_SIZE, heads * sizes.prs),
+            **_size_variables(sizes, selection.pr),
+        }
+        prs_pages = gql.Pages('search', make_pr)
+        prs_pages.append_all(
+            lambda after: gql.path(
+                graphql(transport, make_search_prs_query(profile), {**variables, 'after': after}),
+                'data',
+            )
+        )
+        prs.extend(prs_pages.data)
+        return []
+
+    gql.run_tasks(
+        [functools.partial(fetch_chunk, prs, *search) for prs, search in zip(results, searches)],
+        max_workers,
+    )
+    prs = [pr for prs in results for pr in prs]
+    _complete_prs(transport, prs, max_workers, profile)
+    STATS.add_prs(prs, sizes)
+    return prs
 
-    heads = ' '.join(f'head:{branch}' for branch in branches)
 
-    prs_pages = gql.Pages('search', make_pr)
-    prs_pages.append_all(
-        lambda after: gql.path(
-            graphql(token, make_prs_query(owner, repository, heads, after)),
-            'data',
+def fetch_stack_prs(
+    transport: Transport,
+    owner: str,
+    repository: str,
+    branches: list[str],
+    max_workers: int = MAX_WORKERS,
+    profile: Profile = FULL,
+) -> list[PR]:
+    """Fetches the PRs of all the branches with aliased PRs connections,
+    making a single query for the whole stack when the cost budget allows."""
+    if not branches:
+        return []
+    sizes, chunk = fit_page_sizes(len(branches), tuple(sizes.restrict(profile) for sizes in BATCH_PAGE_SIZES))
+    logging.debug('fetching PRs of %d heads, %d per query, with %s', len(branches), chunk, sizes)
+    chunks = _chunk_heads(branches, chunk)
+    results: list[list[PR]] = [[] for _ in chunks]
+    selection = make_selection(profile)
+
+    def fetch_chunk(prs: list[PR], heads: dict[str, str]) -> list[gql.Task]:
+        prs.extend(
+            _fetch_heads(
+                transport,
+                functools.partial(make_stack_prs_query, profile=profile),
+                {'owner': owner, 'name': repository, 'first': sizes.prs, **_size_variables(sizes, selection.pr)},
+                heads,
+                make_pr,
+            )
         )
+        return []
+
+    gql.run_tasks(
+        [functools.partial(fetch_chunk, prs, heads) for prs, heads in zip(results, chunks)],
+        max_workers,
     )
-    prs = prs_pages.data
-    pr_path = ['data', 'repository', 'pullRequest']
-    for pr in prs:
-        _fetch_level_one(token, owner, repository, pr_path, pr)
-    for pr in prs:
-        _fetch_level_two(token, owner, repository, pr_path, pr)
-    for pr in prs:
-        _fetch_level_three(token, owner, repository, pr_path, pr)
+    prs = [pr for prs in results for pr in prs]
+    _complete_prs(transport, prs, max_workers, profile)
+    STATS.add_prs(prs, sizes)
     return prs
 
 
-def _fetch_level_one(token: str, owner: str, repository: str, pr_path: list[str], pr: PR):
-    pr.comments.append_all(
-        lambda after: gql.path(
-            graphql(
-                token,
-                GQL_PR_COMMENTS_QUERY(owner, repository, pr.number, after),
-            ),
-            *pr_path,
+def fetch_pr_versions(
+    transport: Transport,
+    owner: str,
+    repository: str,
+    branches: list[str],
+    max_workers: int = MAX_WORKERS,
+) -> list[tuple[str, datetime]]:
+    """Fetches only the id and the last update time of the stack PRs."""
+    chunks = _chunk_heads(branches, VERSIONS_PER_QUERY)
+    results: list[list[tuple[str, datetime]]] = [[] for _ in chunks]
+
+    def fetch_chunk(versions: list[tuple[str, datetime]], heads: dict[str, str]) -> list[gql.Task]:
+        versions.extend(
+            _fetch_heads(
+                transport,
+                make_pr_versions_query,
+                {'owner': owner, 'name': repository, 'first': VERSIONS_PER_QUERY},
+                heads,
+                make_pr_version,
+            )
         )
+        return []
+
+    gql.run_tasks(
+        [functools.partial(fetch_chunk, versions, heads) for versions, heads in zip(results, chunks)],
+        max_workers,
     )
-    pr.threads.append_all(
-        lambda after: gql.path(
-            graphql(
-                token,
-                GQL_PR_THREADS_QUERY(owner, repository, pr.number, after),
-            ),
-            *pr_path,
-        )
+    return [version for versions in results for version in versions]
+
+
+def fetch_prs_by_id(
+    transport: Transport,
+    owner: str,
+    repository: str,
+    ids: list[str],
+    max_workers: int = MAX_WORKERS,
+    history: dict[str, PageSizes] | None = None,
+    profile: Profile = FULL,
+) -> list[PR]:
+    """Fetches the PRs with the given node ids, in the same order. The nested
+    page sizes of the PRs with a history are adapted to their former sizes."""
+    if not ids:
+        return []
+    history = history or {}
+    default, _ = fit_page_sizes(
+        sum(1 for pr_id in ids if pr_id not in history),
+        tuple(sizes.restrict(profile) for sizes in NODES_PAGE_SIZES),
     )
-    pr.reviews.append_all(
-        lambda after: gql.path(
-            graphql(
-                token,
-                GQL_PR_REVIEWS_QUERY(owner, repository, pr.number, after),
-            ),
-            *pr_path,
-        )
+    chunks = _pack_ids(
+        {
+            pr_id: adapt_page_sizes(history[pr_id]).restrict(profile) if pr_id in history else default
+            for pr_id in ids
+        }
     )
-    pr.commits.append_all(
-        lambda after: gql.path(
-            graphql(
-                token,
-                GQL_PR_COMMITS_QUERY(owner, repository, pr.number, after),
-            ),
-            *pr_path,
+    logging.debug('fetching %d PRs by id in %d queries', len(ids), len(chunks))
+    results: list[list[PR]] = [[] for _ in chunks]
+    selection = make_selection(profile)
+
+    def fetch_chunk(prs: list[PR], sizes: PageSizes, ids: list[str]) -> list[gql.Task]:
+        variables = {'ids': ids, **_size_variables(sizes, selection.pr)}
+        nodes = gql.path(graphql(transport, make_prs_by_id_query(profile), variables), 'data', 'nodes')
+        prs.extend(make_pr({'node': node}) for node in nodes if node)
+        return []
+
+    gql.run_tasks(
+        [functools.partial(fetch_chunk, prs, *chunk) for prs, chunk in zip(results, chunks)],
+        max_workers,
+    )
+    fetched = {pr.id: pr for prs in results for pr in prs}
+    _complete_prs(transport, list(fetched.values()), max_workers, profile)
+    STATS.add_prs(list(fetched.values()), default)
+    return [fetched[pr_id] for pr_id in ids if pr_id in fetched]
+
+
+def _pack_ids(sizes: dict[str, PageSizes]) -> list[tuple[PageSizes, list[str]]]:
+    """Packs the ids into queries, the smallest PRs first. The PRs of one
+    query share the page sizes that fit them all, within the query budget."""
+    packed: list[tuple[PageSizes, list[str]]] = []
+    for pr_id in sorted(sizes, key=lambda pr_id: sizes[pr_id].head_cost()):
+        if packed:
+            merged = packed[-1][0].merge(sizes[pr_id])
+            if heads_per_query(merged) > len(packed[-1][1]):
+                packed[-1] = (merged, [*packed[-1][1], pr_id])
+                continue
+        packed.append((sizes[pr_id], [pr_id]))
+    return packed
+
+
+def _chunk_search(prefix: str, branches: list[str], chunk: int) -> list[tuple[str, int]]:
+    """Splits the head qualifiers into search queries of at most chunk heads
+    and MAX_SEARCH_QUERY_LENGTH characters, returned with their head count."""
+    searches: list[tuple[str, int]] = []
+    search, heads = prefix, 0
+    for branch in branches:
+        term = f' head:{branch}'
+        if heads and (heads >= chunk or len(search) + len(term) > MAX_SEARCH_QUERY_LENGTH):
+            searches.append((search, heads))
+            search, heads = prefix, 0
+        search += term
+        heads += 1
+    searches.append((search, heads))
+    return searches
+
+
+def _chunk_heads(branches: list[str], chunk: int) -> list[dict[str, str]]:
+    return [
+        {f'h{i}': branch for i, branch in enumerate(branches[start : start + chunk])}
+        for start in range(0, len(branches), chunk)
+    ]
+
+
+def _fetch_heads(
+    transport: Transport,
+    query: Callable[[int], str],
+    variables: dict[str, any],
+    heads: dict[str, str],
+    obj_ctor: Callable[[any], T],
+) -> list[T]:
+    """Queries the aliased PRs connections of the heads, and completes the
+    connections that have more pages one by one, with the single head query."""
+    data = gql.path(
+        graphql(transport, query(len(heads)), {**variables, **heads, 'after': None}),
+        'data',
+        'repository',
+    )
+    result: list[T] = []
+    for name, head in heads.items():
+        head_pages = gql.Pages(name, obj_ctor, data)
+        head_pages.append_all(
+            lambda after, name=name, head=head: {
+                name: gql.path(
+                    graphql(transport, query(1), {**variables, 'h0': head, 'after': after}),
+                    'data',
+                    'repository',
+                    'h0',
+                )
+            }
         )
+        result.extend(head_pages.data)
+    return result
+
+
+def _no_connections(_: any) -> list[Connection]:
+    return []
+
+
+@dataclass(frozen=True)
+class Connection:
+    """A connection to complete: its pages, the id and the kind of its parent
+    node, and the nested connections of every one of its items."""
+
+    pages: gql.Pages
+    parent: str
+    kind: str
+    nested: Callable[[any], list[Connection]] = _no_connections
+
+    def first(self) -> int:
+        # Ask for all the remaining items at once when the total is known.
+        remaining = self.pages.remaining()
+        return CONTINUATION_KINDS[self.kind].size if remaining is None else max(1, min(MAX_PAGE_SIZE, remaining))
+
+    def cost(self) -> tuple[int, int]:
+        kind = CONTINUATION_KINDS[self.kind]
+        first = self.first()
+        return first * kind.item_nodes, 1 + first * kind.item_requests
+
+
+def _comment_connections(comment: Comment) -> list[Connection]:
+    return [Connection(comment.reactions, comment.id, 'reactions')]
+
+
+def _thread_connections(thread: ReviewThread) -> list[Connection]:
+    return [Connection(thread.comments, thread.id, 'threadComments', _comment_connections)]
+
+
+def _commit_connections(commit: Commit) -> list[Connection]:
+    return [Connection(commit.comments, commit.id, 'commitComments', _comment_connections)]
+
+
+def _pr_connections(pr: PR, profile: Profile) -> list[Connection]:
+    return [
+        Connection(pr.comments, pr.id, 'comments', _comment_connections),
+        Connection(pr.threads, pr.id, 'reviewThreads', _thread_connections),
+        Connection(pr.reviews, pr.id, 'latestReviews' if profile.summary else 'reviews'),
+        Connection(pr.commits, pr.id, 'commits', _commit_connections),
+    ]
+
+
+def _expand(connection: Connection, start: int = 0) -> list[Connection]:
+    """Returns the connection and the nested connections of its items from
+    the start one, recursively."""
+    return [
+        connection,
+        *(
+            nested
+            for item in connection.pages.data[start:]
+            for child in connection.nested(item)
+            for nested in _expand(child)
+        ),
+    ]
+
+
+def _pack_connections(connections: list[Connection]) -> list[list[Connection]]:
+    """Packs the connections into queries within the cost budget."""
+    packed: list[list[Connection]] = []
+    nodes, requests = 0, 0
+    for connection in connections:
+        n, r = connection.cost()
+        if (
+            not packed
+            or len(packed[-1]) >= MAX_CONTINUATIONS_PER_QUERY
+            or nodes + n > MAX_QUERY_NODES
+            or requests + r > MAX_QUERY_COST * 100
+        ):
+            packed.append([])
+            nodes, requests = 0, 0
+        packed[-1].append(connection)
+        nodes += n
+        requests += r
+    return packed
+
+
+def _fetch_next_pages(transport: Transport, profile: Profile, connections: list[Connection]) -> list[any]:
+    """Fetches the next page of every connection with a single query, and
+    returns the data of each that its pages decode."""
+    STATS.add_continuation()
+    counts = Counter(connection.kind for connection in connections)
+    # The query only depends on the counts of the kinds.
+    kinds = tuple((name, counts[name]) for name in CONTINUATION_KINDS if counts[name])
+    index: Counter[str] = Counter()
+    aliases: list[str] = []
+    variables: dict[str, any] = {}
+    for connection in connections:
+        alias = f'{connection.kind}{index[connection.kind]}'
+        index[connection.kind] += 1
+        aliases.append(alias)
+        variables[f'{alias}Id'] = connection.parent
+        variables[f'{alias}First'] = connection.first()
+        variables[f'{alias}After'] = connection.pages.next_cursor
+    data = gql.path(graphql(transport, make_continuations_query(kinds, profile), variables), 'data')
+    return [
+        gql.path(data, alias, *CONTINUATION_KINDS[connection.kind].path[:-1])
+        for alias, connection in zip(aliases, connections)
+    ]
+
+
+def _complete(transport: Transport, profile: Profile, connections: list[Connection], max_workers: int) -> None:
+    """Completes the connections and the nested ones. Every round fetches the
+    next pages of all the incomplete connections, whatever their PR and their
+    level, with as few aliased node queries as the cost budget allows."""
+
+    def fetch(batch: list[Connection]) -> list[gql.Task]:
+        for connection, data in zip(batch, _fetch_next_pages(transport, profile, batch)):
+            connection.pages.fetch_page(lambda _, data=data: data)
+        return []
+
+    pending = [nested for connection in connections for nested in _expand(connection)]
+    while True:
+        pending = [connection for connection in pending if not connection.pages.complete()]
+        if not pending:
+            return
+        loaded = [len(connection.pages.data) for connection in pending]
+        gql.run_tasks([functools.partial(fetch, batch) for batch in _pack_connections(pending)], max_workers)
+        pending = [nested for connection, start in zip(pending, loaded) for nested in _expand(connection, start)]
+
+
+def _defer(transport: Transport, profile: Profile, connection: Connection) -> None:
+    connection.pages.lazy(
+        lambda _: _fetch_next_pages(transport, profile, [connection])[0],
+        lambda items: [_defer(transport, profile, nested) for item in items for nested in connection.nested(item)],
     )
 
 
-def _fetch_level_two(token: str, owner: str, repository: str, pr_path: list[str], pr: PR):
-    for comment in pr.comments.data:
-        comment.reactions.append_all(
-            lambda after, cc=comment.cursor: gql.path(
-                graphql(
-                    token,
-                    GQL_PR_COMMENT_REACTIONS_QUERY(owner, repository, pr.number, cc, after),
-                    *pr_path,
-                    'comments',
-                )
-            )
-        )
-    for thread in pr.threads.data:
-        thread.comments.append_all(
-            lambda after, tc=thread.cursor: gql.path(
-                graphql(
-                    token,
-                    GQL_PR_THREAD_COMMENTS_QUERY(owner, repository, pr.number, tc, after),
-                ),
-                *pr_path,
-                'reviewThreads',
-                'edges',
-                0,
-                'node',
-                'comments',
-            )
-        )
-    for commit in pr.commits.data:
-        commit.comments.append_all(
-            lambda after: gql.path(
-                graphql(
-                    token,
-                    GQL_PR_COMMIT_COMMENTS_QUERY(owner, repository, pr.number, after),
-                ),
-                *pr_path,
-                'commits',
-                'edges',
-                0,
-                'node',
-                'comments',
-            ),
-        )
+def defer_pages(transport: Transport, pr: PR, profile: Profile) -> None:
+    """Makes the incomplete PR connections, and the nested ones, fetch their
+    next pages when they are iterated past the loaded items."""
+    for connection in _pr_connections(pr, profile):
+        _defer(transport, profile, connection)
 
 
-def _fetch_level_three(token: str, owner: str, repository: str, pr_path: list[str], pr: PR):
-    for thread in pr.threads.data:
-        for comment in thread.comments.data:
-            comment.reactions.append_all(
-                lambda after, cc=comment.cursor: gql.path(
-                    graphql(
-                        token,
-                        GQL_PR_COMMENT_REACTIONS_QUERY(owner, repository, pr.number, cc, after),
-                    ),
-                    *pr_path,
-                    'comments',
-                    'edges',
-                    0,
-                    'reactions',
-                )
-            )
-    for commit in pr.commits.data:
-        for comment in commit.comments.data:
-            comment.reactions.append_all(
-                lambda after, cic=commit.cursor, coc=comment.cursor: gql.path(
-                    graphql(
-                        token,
-                        GQL_PR_COMMIT_COMMENT_REACTIONS_QUERY(
-                            owner,
-                            repository,
-                            pr.number,
-                            cic,
-                            coc,
-                            after,
-                        ),
-                    ),
-                    *pr_path,
-                    'commits',
-                    'edges',
-                    0,
-                    'comments',
-                    'edges',
-                    0,
-                    'reactions',
-                )
-            )
+def _complete_prs(transport: Transport, prs: list[PR], max_workers: int = MAX_WORKERS, profile: Profile = FULL):
+    """Completes the connections of the PRs, or only defers them for the lazy
+    profiles."""
+    if profile.lazy:
+        for pr in prs:
+            defer_pages(transport, pr, profile)
+    else:
+        connections = [connection for pr in prs for connection in _pr_connections(pr, profile)]
+        _complete(transport, profile, connections, max_workers)
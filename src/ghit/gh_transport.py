@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import logging
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Callable
+
+from . import terminal
+from .error import GhitError
+
+if TYPE_CHECKING:
+    import requests
+
+GITHUB_API_URL = 'https://api.github.com/graphql'
+
+# Connections kept alive to the API host, enough for the concurrent fetches.
+POOL_SIZE = 8
+TIMEOUT = 30
+
+# Attempts of a request failing with a transient error or hitting a rate limit.
+MAX_ATTEMPTS = 5
+# The retries wait a random delay up to BACKOFF_SECONDS * 2**attempt, capped.
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+# GitHub asks to wait a minute after a secondary rate limit without Retry-After.
+SECONDARY_LIMIT_SECONDS = 60.0
+# Give up rather than wait longer than that for a rate limit to reset.
+MAX_WAIT_SECONDS = 15 * 60
+# The longer waits are told to the user.
+NOTICE_SECONDS = 5.0
+# GitHub asks for mutations to be sent one by one, at least a second apart.
+MUTATION_INTERVAL = 1.0
+TRANSIENT_STATUSES = frozenset((500, 502, 503, 504))
+RATE_LIMIT_STATUSES = frozenset((403, 429))
+
+
+class RateLimit:
+    """Tracks the GraphQL point budget reported by the responses, and tells
+    how long the next request has to wait for the budget to reset."""
+
+    def __init__(self) -> None:
+        self.cost = 0
+        self.remaining: int | None = None
+        self.reset_at: float | None = None
+        self._lock = threading.Lock()
+
+    def update(self, remaining: int, reset_at: float, cost: int = 0) -> None:
+        with self._lock:
+            self.cost += cost
+            # The concurrent responses may arrive out of order.
+            if self.remaining is None or reset_at != self.reset_at:
+                self.remaining = remaining
+            else:
+                self.remaining = min(self.remaining, remaining)
+            self.reset_at = reset_at
+
+    def update_from_headers(self, headers: dict[str, str]) -> None:
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining and reset:
+            self.update(int(remaining), float(reset))
+
+    def delay(self, cost: int = 1) -> float:
+        """Returns how long a request of the estimated cost has to wait for
+        the budget to reset."""
+        with self._lock:
+            if self.remaining is None or self.remaining >= cost:
+                return 0.0
+            return max(0.0, self.reset_at - time.time())
+
+
+class Transport:
+    """Posts GraphQL queries through a pooled keep-alive session, so that the
+    queries of one command share the TCP and TLS connections. The queries
+    are throttled when the rate limit budget runs low, and retried with a
+    jittered backoff on transient failures. The mutations are serialized
+    and only retried when GitHub has refused them because of a rate limit."""
+
+    def __init__(
+        self,
+        token: str,
+        url: str | None = None,
+        pool_size: int = POOL_SIZE,
+        timeout: float = TIMEOUT,
+    ) -> None:
+        self.url = url or os.getenv('GITHUB_API_URL', GITHUB_API_URL)
+        self.timeout = timeout
+        self.requests = 0
+        self.rate_limit = RateLimit()
+        self.sleep: Callable[[float], None] = time.sleep
+        self._mutations = threading.Lock()
+        self._last_mutation = 0.0
+        self._notice = ''
+        # requests takes about as long to import as the rest of ghit, and the
+        # transport is only created for the first GraphQL call.
+        import requests  # noqa: PLC0415
+        from requests.adapters import HTTPAdapter  # noqa: PLC0415
+
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self._session = requests.Session()
+        self._session.mount('https://', self._adapter)
+        self._session.mount('http://', self._adapter)
+        self._session.headers.update(
+            {
+                'Authorization': f'Bearer {token}',
+                'Accept': 'application/vnd.github.v3+json',
+                'Connection': 'keep-alive',
+            }
+        )
+
+    def post(self, body: dict[str, any], mutation: bool = False, cost: int = 1) -> requests.Response:
+        """Posts the query, after the rate limit budget has reset if fewer
+        points remain than its estimated cost."""
+        if not mutation:
+            return self._post(body, idempotent=True, cost=cost)
+        with self._mutations:
+            self._wait(self._last_mutation + MUTATION_INTERVAL - time.monotonic())
+            try:
+                return self._post(body, idempotent=False, cost=cost)
+            finally:
+                self._last_mutation = time.monotonic()
+
+    def _post(self, body: dict[str, any], idempotent: bool, cost: int) -> requests.Response:
+        import requests  # noqa: PLC0415
+
+        attempt = 0
+        while True:
+            attempt += 1
+            self._throttle(cost)
+            self.requests += 1
+            try:
+                response = self._session.post(url=self.url, json=body, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent or attempt == MAX_ATTEMPTS:
+                    raise
+                delay = _backoff(attempt)
+                reason = f'retrying after {e}'
+            else:
+                self.rate_limit.update_from_headers(response.headers)
+                delay = _retry_delay(response, attempt, idempotent)
+                if delay is None or attempt == MAX_ATTEMPTS:
+                    return response
+                reason = f'retrying after status {response.status_code}'
+            logging.debug('%s in %.1fs', reason, delay)
+            self._wait(delay, reason)
+
+    def _throttle(self, cost: int) -> None:
+        delay = self.rate_limit.delay(cost)
+        if not delay:
+            return
+        reset = time.strftime('%H:%M:%S', time.localtime(time.time() + delay))
+        if delay > MAX_WAIT_SECONDS:
+            raise GhitError(f'The GitHub rate limit is exhausted until {reset}.')
+        self._wait(delay, f'the GitHub rate limit resets at {reset}')
+
+    def _wait(self, seconds: float, reason: str = '') -> None:
+        if seconds <= 0:
+            return
+        logging.debug('waiting %.1fs before the next request', seconds)
+        # The concurrent requests waiting for the same reason tell it once.
+        if reason and seconds >= NOTICE_SECONDS and reason != self._notice:
+            self._notice = reason
+            terminal.stderr(f'Waiting {seconds:.0f}s: {reason}.')
+        self.sleep(seconds)
+
+    def connections(self) -> int:
+        """Returns the number of connections opened so far."""
+        pools = self._adapter.poolmanager.pools
+        # The pools container can't be iterated, only its keys.
+        return sum(pools[key].num_connections for key in pools.keys())  # noqa: SIM118
+
+    def close(self) -> None:
+        if self.requests:
+            logging.debug(
+                '%d GraphQL requests costing %d points over %d connections',
+                self.requests,
+                self.rate_limit.cost,
+                self.connections(),
+            )
+        self._session.close()
+
+    def __enter__(self) -> Transport:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2**attempt))  # noqa: S311
+
+
+def _retry_after(response: requests.Response) -> float | None:
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+
+def _rate_limit_delay(response: requests.Response) -> float | None:
+    """Returns how long to wait when the request has been refused because of
+    a primary or a secondary rate limit, or None for other failures."""
+    if response.ok:
+        # The exhausted primary rate limit is reported as a GraphQL error.
+        if b'"RATE_LIMITED"' not in response.content:
+            return None
+    elif response.status_code not in RATE_LIMIT_STATUSES:
+        return None
+    retry_after = _retry_after(response)
+    if retry_after is not None:
+        return retry_after
+    if response.headers.get('X-RateLimit-Remaining') == '0' and 'X-RateLimit-Reset' in response.headers:
+        return max(0.0, float(response.headers['X-RateLimit-Reset']) - time.time()) + 1
+    if response.status_code == 429 or b'secondary rate limit' in response.content.lower():  # noqa: PLR2004
+        return SECONDARY_LIMIT_SECONDS
+    # Some other permission problem.
+    return None
+
+
+def _retry_delay(response: requests.Response, attempt: int, idempotent: bool) -> float | None:
+    """Returns how long to wait before retrying the request, or None if the
+    response is final."""
+    delay = _rate_limit_delay(response)
+    if delay is None and idempotent and response.status_code in TRANSIENT_STATUSES:
+        delay = _retry_after(response)
+        if delay is None:
+            delay = _backoff(attempt)
+    if delay is not None and delay > MAX_WAIT_SECONDS:
+        logging.debug('not waiting %.0fs for the rate limit to reset', delay)
+        return None
+    return delay
@@ -1,57 +1,81 @@
 import argparse
+import importlib
 import logging
+import sys
+from typing import Callable
 
-from . import branch_commands as bcom
-from . import stack_commands as scom
 from . import terminal
-from . import top_commands as top
+from .__init__ import __version__
 from .error import GhitError
 
 
+def _command(module: str, name: str) -> Callable[[argparse.Namespace], None]:
+    """Imports the module of a command, with pygit2 and requests, only when
+    the command runs."""
+
+    def run(args: argparse.Namespace) -> None:
+        return getattr(importlib.import_module(f'.{module}', __package__), name)(args)
+
+    return run
+
+
+def version(_: argparse.Namespace) -> None:
+    terminal.stdout(__version__)
+
+
 def add_top_commands(parser: argparse.ArgumentParser):
     commands = parser.add_subparsers(required=True)
 
     commands.add_parser(
         'init',
         help='create `.ghit/stack` file with the current branch',
-    ).set_defaults(func=top.init)
+    ).set_defaults(func=_command('top_commands', 'init'))
 
     commands.add_parser(
         'ls',
         help='show the branches of stack with',
-    ).set_defaults(func=top.ls)
+    ).set_defaults(func=_command('top_commands', 'ls'))
     commands.add_parser(
         'up',
         help='check out one branch up the stack',
-    ).set_defaults(func=top.up)
-    commands.add_parser('down', help='check out one branch down the stack').set_defaults(func=top.down)
+    ).set_defaults(func=_command('top_commands', 'up'))
+    commands.add_parser(
+        'down',
+        help='check out one branch down the stack',
+    ).set_defaults(func=_command('top_commands', 'down'))
     commands.add_parser(
         'top',
         help='check out the top of the stack',
-    ).set_defaults(func=top.top)
-    commands.add_parser('bottom', help='check out the bottom of the stack').set_defaults(func=top.bottom)
-    commands.add_parser('version', help='show program version').set_defaults(func=top.version)
+    ).set_defaults(func=_command('top_commands', 'top'))
+    commands.add_parser(
+        'bottom',
+        help='check out the bottom of the stack',
+    ).set_defaults(func=_command('top_commands', 'bottom'))
+    commands.add_parser('version', help='show program version').set_defaults(func=version)
+    daemon = commands.add_parser('daemon', help='keep the stack PRs up to date in background for the other commands')
+    daemon.add_argument('--stop', action='store_true', help='stop the running daemon')
+    daemon.set_defaults(func=_command('top_commands', 'daemon'))
 
     return commands
 
 
 def add_stack_commands(parser: argparse.ArgumentParser):
     parser_stack_sub = parser.add_subparsers()
-    parser_stack_sub.add_parser('check').set_defaults(func=scom.check)
+    parser_stack_sub.add_parser('check').set_defaults(func=_command('stack_commands', 'check'))
     parser_stack_sub.add_parser(
         'submit',
         help='push stack branches upstream and update PRs',
-    ).set_defaults(func=scom.stack_submit)
+    ).set_defaults(func=_command('stack_commands', 'stack_submit'))
     parser_stack_sub.add_parser(
         'cleanup', help='removes unexisting branches from the stack, or the ones with merged PRs'
-    ).set_defaults(func=scom.cleanup)
+    ).set_defaults(func=_command('stack_commands', 'cleanup'))
 
 
 def add_branch_commands(parser: argparse.ArgumentParser) -> None:
     parser_branch_sub = parser.add_subparsers()
     cr = parser_branch_sub.add_parser('create', help='create branch, set remote upstream, update stack file')
     cr.add_argument('branch', help='branch name to create')
-    cr.set_defaults(func=bcom.create)
+    cr.set_defaults(func=_command('branch_commands', 'create'))
 
     upr = parser_branch_sub.add_parser(
         'submit',
@@ -59,10 +83,10 @@ def add_branch_commands(parser: argparse.ArgumentParser) -> None:
     )
     upr.add_argument('-t', '--title', help='PR title')
     upr.add_argument('-d', '--draft', help='create draft PR', action='store_true')
-    upr.set_defaults(func=bcom.branch_submit)
+    upr.set_defaults(func=_command('branch_commands', 'branch_submit'))
 
     parser_branch_sub.add_parser('check', help='check the state of the branch and possible PRs').set_defaults(
-        func=bcom.check
+        func=_command('branch_commands', 'check')
     )
 
 
@@ -73,6 +97,12 @@ def ghit(argv: list[str]) -> int:
     parser.add_argument('-o', '--offline', action='store_true', help='do not call GitHub')
     parser.add_argument('-g', '--debug', action='store_true')
     parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('--stats', action='store_true', help='show the GraphQL requests made, by operation')
+    parser.add_argument(
+        '--stale',
+        action='store_true',
+        help='show the cached PRs of ls and check right away, and refresh the cache meanwhile',
+    )
 
     commands = add_top_commands(parser)
     add_stack_commands(commands.add_parser('stack', aliases=['s', 'st']))
@@ -83,6 +113,19 @@ def ghit(argv: list[str]) -> int:
         parser.print_usage()
         terminal.stderr('Please provide the full command, with necessary subcommands.', args)
         return 1
+    try:
+        return _run(args)
+    finally:
+        # Only the commands that have connected have anything to close.
+        common = sys.modules.get(f'{__package__}.common')
+        if common:
+            common.disconnect()
+        ghgql = sys.modules.get(f'{__package__}.gh_graphql')
+        if args.stats and ghgql:
+            terminal.stderr(ghgql.CALLS.dump())
+
+
+def _run(args: argparse.Namespace) -> int:
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
         try:
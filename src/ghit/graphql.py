@@ -1,10 +1,13 @@
 from __future__ import annotations
 
+import inspect
 import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from typing import TYPE_CHECKING, Callable, Generic, TypeVar
 
 if TYPE_CHECKING:
-    from collections.abc import Iterator
+    from collections.abc import Iterable, Iterator
 
 # region builder
 
@@ -24,6 +27,10 @@ def on(t: str, *f) -> str:
 query = obj
 
 
+def alias(name: str, f: str) -> str:
+    return f'{name}: {f}'
+
+
 def func(name: str, args: dict[str, str], *f: str) -> str:
     extra = ', '.join(f'{k}: {v}' for k, v in args.items())
     return obj(f'{name}({extra})', *f)
@@ -38,12 +45,187 @@ def paged(name: str, args: dict[str, str], *f: str) -> str:
     )
 
 
+def counted(name: str, args: dict[str, str], *f: str) -> str:
+    """A paged connection that also tells the total count of its items."""
+    return func(
+        name,
+        args,
+        'totalCount',
+        obj('pageInfo', 'endCursor', 'hasNextPage'),
+        obj('edges', 'cursor', obj('node', *f)),
+    )
+
+
+def var(name: str) -> str:
+    return f'${name}'
+
+
+class Fragment(str):
+    """The spread of a named fragment, which also knows the definitions of
+    the fragment and of the fragments it uses, and the variables they need."""
+
+    definition: str
+    uses: tuple[Fragment, ...]
+    variables: dict[str, str]
+
+    def __new__(
+        cls,
+        name: str,
+        on_type: str,
+        *f: str,
+        uses: Iterable[Fragment] = (),
+        variables: dict[str, str] | None = None,
+    ) -> Fragment:
+        spread = super().__new__(cls, f'...{name}')
+        spread.definition = obj(f'fragment {name} on {on_type}', *f)
+        spread.uses = tuple(uses)
+        spread.variables = {k: v for fragment in spread.uses for k, v in fragment.variables.items()}
+        spread.variables.update(variables or {})
+        return spread
+
+    def definitions(self) -> dict[str, str]:
+        result: dict[str, str] = {}
+        for fragment in self.uses:
+            result.update(fragment.definitions())
+        result[str(self)] = self.definition
+        return result
+
+
+def operation(
+    kind: str,
+    name: str,
+    variables: dict[str, str],
+    *f: str,
+    fragments: Iterable[Fragment] = (),
+) -> str:
+    """Builds a query or a mutation with the declarations of its variables and
+    of the variables of the fragments, followed by the fragment definitions."""
+    definitions: dict[str, str] = {}
+    declared: dict[str, str] = {}
+    for fragment in fragments:
+        definitions.update(fragment.definitions())
+        declared.update(fragment.variables)
+    declared.update(variables)
+    signature = ', '.join(f'{var(k)}: {v}' for k, v in declared.items())
+    return fields(obj(f'{kind} {name}({signature})' if signature else f'{kind} {name}', *f), *definitions.values())
+
+
 # endregion builder
 
+# region schema
+
+
+@dataclass(frozen=True)
+class Field:
+    """A model attribute, declared once for both the selection and the
+    decoding. The value is read from the key of the node, or is the cursor
+    of the edge, or decode is given the whole node, e.g. to build the Pages
+    of a connection. decode is not applied to null values. The selection
+    defaults to the key, and is built by select from the fragments of the
+    other models, by name, if callable. The field is only selected when the
+    when predicate accepts the options of the query, if given."""
+
+    attr: str
+    key: str = ''
+    select: str | Callable[[dict[str, Fragment]], str] = ''
+    decode: Callable[[any], any] | None = None
+    edge: bool = False
+    node: bool = False
+    when: Callable[[any], bool] | None = None
+    uses: tuple[str, ...] = ()
+    variables: dict[str, str] | None = None
+
+    def selected(self, options: any) -> bool:
+        return not self.edge and (self.when is None or self.when(options))
+
+
+def schema_fragment(
+    name: str,
+    on_type: str,
+    schema: Iterable[Field],
+    options: any,
+    fragments: dict[str, Fragment],
+) -> Fragment:
+    """Builds the fragment selecting the fields of the schema that the options
+    select, using the fragments of the other models."""
+    selected = [field for field in schema if field.selected(options)]
+    return Fragment(
+        name,
+        on_type,
+        *(
+            field.select(fragments) if callable(field.select) else field.select or field.key or field.attr
+            for field in selected
+        ),
+        uses=[fragments[use] for field in selected for use in field.uses],
+        variables={k: v for field in selected for k, v in (field.variables or {}).items()},
+    )
+
+
+def _getter(field: Field) -> Callable[[any, any], any]:
+    """Returns the function reading the value of the field from the edge and
+    its node."""
+    decode, key = field.decode, field.key or field.attr
+    if field.edge:
+        return lambda edge, _: edge['cursor']
+    if field.node:
+        return lambda _, node: decode(node)
+    if not decode:
+        return (lambda _, node: node[key]) if field.when is None else (lambda _, node: node.get(key))
+
+    def get(_: any, node: any) -> any:
+        value = node.get(key)
+        return None if value is None else decode(value)
+
+    return get
+
+
+def decoder(name: str, module: str, ctor: Callable[..., T], schema: Iterable[Field], edge: bool = True) -> Callable:
+    """Returns the function decoding an edge, or a node, into ctor called
+    with the schema attributes, reading every field straight from the node.
+    The fields that only some queries select are None when absent. The first
+    field of an attribute wins. The attributes are passed positionally, which
+    is much faster than by keyword, so they must be the first parameters of
+    ctor. The function must be assigned to the name in the module, where
+    pickle looks it up."""
+    getters: dict[str, Callable[[any, any], any]] = {}
+    for field in schema:
+        getters.setdefault(field.attr, _getter(field))
+    parameters = list(inspect.signature(ctor).parameters)[: len(getters)]
+    if sorted(parameters) != sorted(getters):
+        raise TypeError(f'{name}: the attributes {list(getters)} are not the first parameters of {ctor.__name__}')
+    ordered = tuple(getters[parameter] for parameter in parameters)
+
+    def function(value: any) -> T:
+        node = value['node'] if edge else value
+        return ctor(*[get(value, node) for get in ordered])
+
+    function.__name__ = function.__qualname__ = name
+    function.__module__ = module
+    return function
+
+
+# endregion schema
+
 T = TypeVar('T')
 
 
 class Pages(Generic[T]):
+    """The loaded items of a paged connection. Iterating a lazy Pages fetches
+    the next pages only when the iteration goes past the loaded items, while
+    data holds only what has been loaded so far."""
+
+    __slots__ = (
+        'name',
+        'obj_ctor',
+        'next_cursor',
+        'end_cursor',
+        'has_next_page',
+        'data',
+        'total_count',
+        'next_page',
+        'on_page',
+    )
+
     def __init__(
         self,
         name: str,
@@ -53,27 +235,104 @@ class Pages(Generic[T]):
         super().__init__()
         self.name = name
         self.obj_ctor = obj_ctor
-        self.next_cursor: str = last_edge_cursor(node, name)
-        self.end_cursor, self.has_next_page = end_cursor(node, name) if node else (None, True)
-        self.data = list(map(obj_ctor, edges(node, name))) if node else []
+        connection = node.get(name) if node else None
+        if connection:
+            page = connection['edges']
+            self.next_cursor: str | None = page[-1]['cursor'] if page else None
+            self.end_cursor = connection['pageInfo']['endCursor']
+            self.has_next_page = bool(connection['pageInfo']['hasNextPage'])
+            self.data = list(map(obj_ctor, page))
+            self.total_count: int | None = connection.get('totalCount')
+        else:
+            # A node without the connection has none to fetch.
+            self.next_cursor, self.end_cursor, self.has_next_page = None, None, not node
+            self.data = []
+            self.total_count = None
+        self.next_page: Callable[[str], any] | None = None
+        self.on_page: Callable[[list[T]], None] | None = None
+
+    def __iter__(self) -> Iterator[T]:
+        loaded = 0
+        while True:
+            yield from self.data[loaded:]
+            loaded = len(self.data)
+            if self.complete() or not self.next_page:
+                return
+            self.fetch_page(self.next_page)
+
+    def __getstate__(self) -> dict[str, any]:
+        # The loaders hold the transport, and are attached again when needed.
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot not in ('next_page', 'on_page')}
+
+    def __setstate__(self, state: dict[str, any]) -> None:
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self.next_page = None
+        self.on_page = None
 
     def complete(self) -> bool:
         return self.next_cursor == self.end_cursor and not self.has_next_page
 
-    def append_all(self, next_page) -> None:
+    def remaining(self) -> int | None:
+        """Returns the number of items left to fetch, if the total is known."""
+        if self.total_count is None:
+            return None
+        return max(0, self.total_count - len(self.data))
+
+    def lazy(self, next_page: Callable[[str], any], on_page: Callable[[list[T]], None] | None = None) -> None:
+        """Makes the iteration fetch the next pages with next_page. on_page is
+        called with the items of every page, the already loaded included."""
+        self.next_page = next_page
+        self.on_page = on_page
+        if on_page:
+            on_page(list(self.data))
+
+    def fetch_page(self, next_page: Callable[[str], any]) -> None:
+        logging.debug('querying %s after cursor %s', self.name, self.next_cursor)
+        data = next_page(self.next_cursor)
+        logging.debug('data=%s', data)
+        if not data:
+            raise Exception('No data in response')
+        self.end_cursor, self.has_next_page = end_cursor(data, self.name)
+        total_count = path(data, self.name, 'totalCount')
+        if total_count is not None:
+            self.total_count = total_count
+        new_data = list(map(self.obj_ctor, edges(data, self.name)))
+        self.data.extend(new_data)
+        self.next_cursor = last_edge_cursor(data, self.name)
+        if not self.has_next_page:
+            logging.debug('queried all %s', self.name)
+        if self.on_page:
+            self.on_page(new_data)
+
+    def append_all(self, next_page: Callable[[str], any] | None = None) -> None:
         while not self.complete():
-            logging.debug('querying %s after cursor %s', self.name, self.next_cursor)
-            data = next_page(self.next_cursor)
-            logging.debug('data=%s', data)
-            if not data:
-                raise Exception('No data in response')
-            self.end_cursor, self.has_next_page = end_cursor(data, self.name)
-            new_data = list(map(self.obj_ctor, edges(data, self.name)))
-            self.data.extend(new_data)
-            self.next_cursor = last_edge_cursor(data, self.name)
-            if not self.has_next_page:
-                logging.debug('queried all %s', self.name)
+            self.fetch_page(next_page or self.next_page)
+
+
+# region scheduling
+
+# A task returns the tasks that may only start after it has completed.
+Task = Callable[[], 'list[Task]']
+
+
+def run_tasks(tasks: Iterable[Task], max_workers: int) -> None:
+    """Runs the tasks and their follow-ups on at most max_workers threads.
+    Every follow-up is submitted as soon as the task it depends on is done."""
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='ghit') as pool:
+        pending = {pool.submit(task) for task in tasks}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.update(pool.submit(task) for task in future.result())
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
 
+# endregion scheduling
 
 # region helpers
 
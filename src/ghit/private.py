@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import os
+import stat
+from typing import TYPE_CHECKING
+
+from .error import GhitError
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def check_private(path: Path, mode: int) -> None:
+    """Checks that the path is of the file type of mode, and that only the
+    user owns and may access it, where files have owners."""
+    info = path.lstat()
+    if stat.S_IFMT(info.st_mode) != mode:
+        raise GhitError(f'{path} is not private to the user.')
+    if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise GhitError(f'{path} is not private to the user.')
+
+
+def private_dir(path: Path) -> Path:
+    """Creates the directory, only accessible by the user, if missing, and
+    checks that it is."""
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    check_private(path, stat.S_IFDIR)
+    return path
@@ -11,6 +11,12 @@ if TYPE_CHECKING:
 
 
 class Stack:
+    """A branch of the stack, or the root of the stack with no branch. The
+    children of a disabled branch count as the children of its closest
+    enabled ancestor. The effective parents, child counts, sibling indices
+    and the traversal order of the enabled records are indexed for the
+    whole stack at once, when first needed after add_child or disable."""
+
     def __init__(
         self,
         branch_name: str | None = None,
@@ -21,75 +27,154 @@ class Stack:
         self.__parent = parent
         self._enabled = enabled
         self.depth = parent.depth + 1 if parent else -1
-        self._index = parent.length() if parent else 0
         self._children = dict[str, Stack]()
+        self._root: Stack = parent._root if parent else self
+        # The records of the whole stack by branch name, kept by the root. A
+        # branch may appear more than once, e.g. disabled and then enabled.
+        self._names: dict[str, list[Stack]] = {}
+        # The index, up to date unless the root is stale.
+        self._stale = True
+        self._index = 0
+        self._length = 0
+        self._last = True
+        self._enabled_parent: Stack | None = None
+        self._position: int | None = None
+        self._order: list[Stack] = []
+
+    def _indexed(self) -> Stack:
+        if self._root._stale:
+            self._root._reindex()
+        return self
+
+    def _reindex(self) -> None:
+        """Indexes the whole stack, in two passes over the records."""
+        records: list[Stack] = []
+        pending = [self]
+        while pending:
+            record = pending.pop()
+            records.append(record)
+            pending.extend(reversed(record._children.values()))
+        for record in reversed(records):
+            record._length = sum(1 if c._enabled else c._length for c in record._children.values())
+        # The parent that the siblings of a record are counted in, which is
+        # the root for the first level.
+        siblings_parent: dict[Stack, Stack] = {}
+        counts: dict[Stack, int] = {}
+        self._order = []
+        for record in records[1:]:
+            record._position = len(self._order) if record._enabled else None
+            if record._enabled:
+                self._order.append(record)
+            parent = record.__parent
+            siblings = parent if parent._enabled or parent is self else siblings_parent[parent]
+            siblings_parent[record] = siblings
+            record._enabled_parent = None if siblings is self else siblings
+            record._index = counts.get(siblings, 0)
+            if record._enabled:
+                counts[siblings] = record._index + 1
+            record._last = record._index >= siblings._length - 1
+        self._stale = False
+
+    def records(self) -> list[Stack]:
+        """Returns the enabled records of the whole stack in the order of
+        traverse(). The list is shared and must not be changed."""
+        return self._root._indexed()._order
+
+    def position(self) -> int | None:
+        """Returns the position of an enabled record in records()."""
+        return self._indexed()._position
 
     def get_parent(self, ignore_enabled: bool = False) -> Stack:
-        if self.__parent is None:
-            return None
-        p = self.__parent
-        return p if p._enabled or ignore_enabled else p.get_parent(ignore_enabled)
+        if ignore_enabled:
+            return self.__parent
+        if not self._root._stale:
+            return self._enabled_parent
+        # Saves reindexing the stack for every record disabled in a loop.
+        parent = self.__parent
+        while parent is not None and not parent._enabled:
+            parent = parent.__parent
+        return parent
 
     def disable(self) -> None:
         self._enabled = False
+        self._root._stale = True
 
     def add_child(self, branch_name: str, enabled: bool = True) -> Stack:
         if branch_name in self._children:
             raise GhitError(f"'{branch_name}' already exist in '{self.branch_name}'")
         child = Stack(branch_name, enabled, self)
         self._children.update({branch_name: child})
+        self._root._names.setdefault(branch_name, []).append(child)
+        self._root._stale = True
         return child
 
     def is_last_child(self) -> bool:
-        return self.is_root() or self._index == self.get_parent().length() - 1
+        return self.is_root() or self._indexed()._last
 
     def length(self) -> int:
         # Skip disabled children
-        length = 0
-        for v in self._children.values():
-            if v._enabled:
-                length += 1
-            else:
-                length += v.length()
-        return length
+        return self._indexed()._length
 
     def is_root(self) -> bool:
         return self.branch_name is None
 
+    def is_enabled(self) -> bool:
+        return self._enabled
+
     def traverse(self, with_first_level: bool = True, ignored_disabled: bool = False) -> Iterator[Stack]:
-        if not self.is_root() and (self._enabled or ignored_disabled) and \
-            (self.get_parent(ignored_disabled) or with_first_level):
-            yield self
-        for r in self._children.values():
-            yield from r.traverse(with_first_level, ignored_disabled)
+        # The iterators of the children of the records on the way down, so
+        # that deep stacks neither recurse nor nest generators.
+        pending: list[Iterator[Stack]] = [iter((self,))]
+        while pending:
+            record = next(pending[-1], None)
+            if record is None:
+                pending.pop()
+                continue
+            if not record.is_root() and (record._enabled or ignored_disabled) and \
+                (record.get_parent(ignored_disabled) or with_first_level):
+                yield record
+            pending.append(iter(record._children.values()))
+
+    def _holds(self, record: Stack) -> bool:
+        ancestor = record
+        while ancestor.depth > self.depth:
+            ancestor = ancestor.__parent
+        return ancestor is self
 
     def find(self, branch_name: str) -> Stack:
-        for s in self.traverse(True, True):
-            if s.branch_name == branch_name:
-                return s
-        return None
-
-    def _find_depth(self) -> int:
-        depth = 0
-        for record in self.traverse():
-            depth = max(depth, record.depth)
-        return depth
+        """Returns the record of the branch in this part of the stack, an
+        enabled one if any, or else a disabled one."""
+        found = None
+        for record in self._root._names.get(branch_name, ()):
+            if self.is_root() or self._holds(record):
+                if record._enabled:
+                    return record
+                found = found or record
+        return found
+
+    def __contains__(self, branch_name: str) -> bool:
+        return self.find(branch_name) is not None
 
     def rtraverse(self, with_first_level: bool = True) -> Iterator[Stack]:
-        depth = self._find_depth()
-        while depth:
-            for record in self.traverse(with_first_level):
-                if record.depth == depth:
-                    yield record
-            depth -= 1
+        """Yields the records of the deepest level first, down to the first
+        level after the main branches, each level in the traverse order."""
+        levels: dict[int, list[Stack]] = {}
+        for record in self.traverse(with_first_level):
+            levels.setdefault(record.depth, []).append(record)
+        for depth in sorted(levels, reverse=True):
+            if depth:
+                yield from levels[depth]
 
     def dumps(self, lines: list[str] = None, depth: int = 0) -> list[str]:
         if lines is None:
             lines = []
-        if not self.is_root():
-            lines.append(('' if self._enabled else '#') + '.' * depth + self.branch_name)
-        for record in self._children.values():
-            record.dumps(lines, depth + (not self.is_root()))
+        pending = [(self, depth)]
+        while pending:
+            record, depth = pending.pop()
+            if not record.is_root():
+                lines.append(('' if record._enabled else '#') + '.' * depth + record.branch_name)
+            children = depth + (not record.is_root())
+            pending.extend((child, children) for child in reversed(record._children.values()))
         return lines
 
 
@@ -101,9 +186,7 @@ def parse_line(line: str, parents: list[Stack]) -> Stack:
     if not branch_name:
         return None
 
-    depth = 0
-    while stack_line[depth] == '.':
-        depth += 1
+    depth = len(stack_line) - len(stack_line.lstrip('.'))
 
     while True:
         parent = parents[-1] if parents else None
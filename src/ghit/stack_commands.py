@@ -1,3 +1,4 @@
+from . import gh_graphql as ghgql
 from . import styling as s
 from . import terminal
 from .args import Args
@@ -6,7 +7,7 @@ from .error import GhitError
 
 
 def check(args: Args) -> None:
-    repo, stack, gh = connect(args)
+    repo, stack, gh = connect(args, readonly=True, profile=ghgql.CLEANUP)
     if repo.is_empty:
         return
 
@@ -19,7 +20,7 @@ def check(args: Args) -> None:
 
 
 def stack_submit(args: Args) -> None:
-    repo, stack, gh = connect(args)
+    repo, stack, gh = connect(args, profile=ghgql.SUBMIT)
     if repo.is_empty or args.offline or not gh:
         return
     origin = repo.remotes['origin']
@@ -35,12 +36,14 @@ def stack_submit(args: Args) -> None:
 
     if needs_update and len(prs) > 1:
         # Update the deps section in all PRs except the last one, which doesn't
-        # need to be updated, if a new PR has been created.
+        # need to be updated, if a new PR has been created. The updates are
+        # only queued, so that every PR is updated once.
         for pr in prs[:-1]:
             gh.update_dependencies(pr)
+    gh.send_updates()
 
 def cleanup(args: Args) -> None:
-    repo, stack, gh = connect(args)
+    repo, stack, gh = connect(args, profile=ghgql.CLEANUP)
     if repo.is_empty:
         return
 
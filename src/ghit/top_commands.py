@@ -4,13 +4,14 @@ from pathlib import Path
 
 import pygit2 as git
 
+from . import gh_graphql as ghgql
 from . import styling as s
 from . import terminal
-from .__init__ import __version__
 from .args import Args
-from .common import GHIT_STACK_DIR, connect, stack_filename
+from .common import GHIT_STACK_DIR, cache_filename, connect, ghit_dir, stack_filename
+from .daemon import Daemon, DaemonClient, is_supported, socket_path
 from .error import GhitError
-from .gh import GH
+from .gh import GH, init_gh
 from .gh_formatting import format_info
 from .gitools import checkout, get_current_branch
 from .stack import Stack, open_stack
@@ -28,7 +29,7 @@ def _print_gh_info(
 ) -> int:
     error = 0
     info: list[str] = []
-    for pr, stats in gh.pr_stats(record).items():
+    for pr, stats in gh.pr_stats(record, summary=not verbose).items():
         if stats.unresolved or stats.change_requested:
             error = 1
         info.extend(list(format_info(gh, verbose, record, pr, stats)))
@@ -48,7 +49,7 @@ def _print_gh_info(
 
 
 def ls(args: Args) -> None:
-    repo, stack, gh = connect(args)
+    repo, stack, gh = connect(args, readonly=True, profile=ghgql.VERBOSE_LS if args.verbose else ghgql.LS)
     if repo.is_empty:
         return
 
@@ -138,27 +139,16 @@ def _print_line(
 
 def _move(args: Args, command: str) -> None:
     repo, stack, _ = connect(args)
-    current = get_current_branch(repo).branch_name
-    i = stack.traverse()
-    p = None
-    record = None
-    for r in i:
-        if r.branch_name == current:
-            if command == 'up':
-                record = p
-            else:
-                try:
-                    record = next(i)
-                except StopIteration:
-                    return None
-            break
-        p = r
-
-    if record:
-        if record.branch_name != current:
-            checkout(repo, record)
-    else:
+    current = stack.find(get_current_branch(repo).branch_name)
+    if current is None or not current.is_enabled():
         return _jump(args, 'top')
+    records = stack.records()
+    position = current.position() + (-1 if command == 'up' else 1)
+    if position >= len(records):
+        return None
+    if position < 0:
+        return _jump(args, 'top')
+    checkout(repo, records[position])
     return None
 
 
@@ -172,16 +162,11 @@ def down(args: Args) -> None:
 
 def _jump(args: Args, command: str) -> None:
     repo, stack, _ = connect(args)
-    record: Stack = None
-    if command == 'top':
-        try:
-            record = next(stack.traverse())
-        except StopIteration:
-            return
-    else:
-        for r in stack.traverse():
-            record = r
-    if record and record.branch_name != get_current_branch(repo).branch_name:
+    records = stack.records()
+    if not records:
+        return
+    record = records[0 if command == 'top' else -1]
+    if record.branch_name != get_current_branch(repo).branch_name:
         checkout(repo, record)
     return
 
@@ -220,5 +205,25 @@ def init(args: Args) -> None:
         branch_name = repo.config['init.defaultBranch'] if repo.is_empty else get_current_branch(repo).branch_name
         ghitstack.write(branch_name + '\n')
 
-def version(_: Args) -> None:
-    terminal.stdout(__version__)
+
+def daemon(args: Args) -> None:
+    repo = git.Repository(args.repository)
+    if not is_supported():
+        raise GhitError(s.danger('ghit daemon needs Unix domain sockets.'))
+    path = socket_path(ghit_dir(repo))
+    if args.stop:
+        if not DaemonClient(path).stop():
+            raise GhitError(s.warning('ghit daemon is not running.'))
+        return
+    filename = Path(args.stack) if args.stack else stack_filename(repo)
+
+    def load_stack() -> Stack:
+        return open_stack(filename) or Stack()
+
+    gh = init_gh(repo, load_stack(), False, cache_filename(repo))
+    if not gh:
+        raise GhitError(s.danger('Not a GitHub repository.'))
+    try:
+        Daemon(repo, gh, load_stack, filename, path).serve()
+    finally:
+        gh.close()
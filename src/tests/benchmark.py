@@ -0,0 +1,202 @@
+"""Measures the GraphQL requests, the bytes transferred and the wall time of
+the ghit commands on stacks of synthetic branches, served by MockGitHub:
+
+    python -m tests.benchmark --sizes 1,10,50,200 --latency 0.05
+
+or the time of the Stack operations on a linear stack of branches, or on a
+wide one:
+
+    python -m tests.benchmark --deep 5000
+    python -m tests.benchmark --wide 2500
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import pygit2 as git
+
+from ghit.ghit import ghit
+from ghit.stack import parse
+
+from .mock_github import MockGitHub, Shape, SyntheticRepository
+
+SIZES = (1, 10, 50, 200)
+# The commands by name, with their environment.
+COMMANDS = {
+    'ls': (['ls'], {}),
+    'ls search': (['ls'], {'GHIT_FETCH_MODE': 'search'}),
+    'ls -v': (['-v', 'ls'], {}),
+    'stack submit': (['stack', 'submit'], {}),
+}
+
+
+@dataclass
+class Result:
+    command: str
+    size: int
+    # cold without the .ghit cache, warm with the cache of the cold run.
+    run: str
+    requests: int
+    bytes_sent: int
+    bytes_received: int
+    seconds: float
+    status: int
+
+
+def make_repository(path: Path, branches: list[str]) -> None:
+    """Creates a repository with a stack of the branches on top of main, each
+    one commit ahead of the previous one and pushed to origin."""
+    repo = git.init_repository(str(path), initial_head='main')
+    signature = git.Signature('ghit', 'ghit@example.com')
+    tree = repo.TreeBuilder().write()
+    parent = repo.create_commit('refs/heads/main', signature, signature, 'main', tree, [])
+    for branch in branches:
+        parent = repo.create_commit(f'refs/heads/{branch}', signature, signature, branch, tree, [parent])
+    repo.remotes.create('origin', 'https://github.com/owner/repository.git')
+    for branch in ['main', *branches]:
+        repo.references.create(f'refs/remotes/origin/{branch}', repo.branches[branch].target)
+        repo.branches[branch].upstream = repo.branches.remote[f'origin/{branch}']
+    (path / '.ghit').mkdir()
+    (path / '.ghit' / 'stack').write_text(
+        '\n'.join(['main', *('.' * (depth + 1) + branch for depth, branch in enumerate(branches))]) + '\n'
+    )
+
+
+@contextlib.contextmanager
+def environment(**variables: str):
+    saved = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def run_command(api: MockGitHub, path: Path, argv: list[str]) -> tuple[int, int, int, float, int]:
+    """Runs ghit and returns the requests, the bytes sent and received by
+    ghit, the seconds and the exit status."""
+    requests, sent, received = len(api.requests), api.bytes_received, api.bytes_sent
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        status = ghit(['-r', str(path), *argv])
+    seconds = time.perf_counter() - start
+    return len(api.requests) - requests, api.bytes_received - sent, api.bytes_sent - received, seconds, status
+
+
+def benchmark(
+    sizes: tuple[int, ...] = SIZES,
+    commands: tuple[str, ...] = tuple(COMMANDS),
+    shape: Shape | None = None,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+) -> list[Result]:
+    """Runs every command on a fresh repository of every size, without and
+    then with the cache."""
+    results = []
+    for size in sizes:
+        branches = [f'feature/branch-{i:04}' for i in range(1, size + 1)]
+        for command in commands:
+            argv, variables = COMMANDS[command]
+            with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as cache:
+                path = Path(directory)
+                make_repository(path, branches)
+                repository = SyntheticRepository(branches, shape)
+                with MockGitHub(repository, latency, error_rate) as api, environment(
+                    GITHUB_API_URL=api.url, GITHUB_TOKEN='token', XDG_CACHE_HOME=cache, **variables  # noqa: S106
+                ):
+                    for run in ('cold', 'warm'):
+                        results.append(Result(command, size, run, *run_command(api, path, argv)))
+    return results
+
+
+def report(results: list[Result]) -> str:
+    lines = [f'{"command":14} {"size":>5} {"run":5} {"requests":>8} {"sent KB":>9} {"recv KB":>9} {"seconds":>8}']
+    lines.extend(
+        f'{r.command:14} {r.size:5} {r.run:5} {r.requests:8} {r.bytes_sent / 1024:9.1f} '
+        f'{r.bytes_received / 1024:9.1f} {r.seconds:8.3f}' + (f' exit {r.status}' if r.status else '')
+        for r in results
+    )
+    return '\n'.join(lines)
+
+
+def wide_stack(width: int) -> list[str]:
+    """Returns the lines of a stack of 4 * width branches, half of them
+    under disabled ones."""
+    text = ['main']
+    for i in range(width):
+        if i % 2:
+            text += [f'.a{i}', f'#..d{i}', f'...b{i}', f'..c{i}']
+        else:
+            text += [f'#.d{i}', f'..a{i}', f'..b{i}', f'...c{i}']
+    return text
+
+
+def deep_stack(depth: int) -> list[str]:
+    """Returns the lines of a linear stack of depth branches, every tenth one
+    disabled."""
+    return ['main'] + [('' if (i + 5) % 10 else '#') + '.' * (i + 1) + f'branch-{i}' for i in range(depth)]
+
+
+def stack_timings(text: list[str]) -> str:
+    """Times the Stack operations on the lines of a stack."""
+    lines = []
+
+    def timed(name: str, operation: Callable[[], object]) -> object:
+        start = time.perf_counter()
+        result = operation()
+        lines.append(f'{name:12} {time.perf_counter() - start:8.3f}s')
+        return result
+
+    names = [line.lstrip('#.') for line in text]
+    stack = timed('parse', lambda: parse(text))
+    timed('traverse', lambda: list(stack.traverse()))
+    timed('ls queries', lambda: [(r.get_parent(), r.length(), r.is_last_child()) for r in stack.traverse()])
+    timed('find', lambda: [stack.find(name) for name in names])
+    timed('dumps', stack.dumps)
+    timed('rtraverse', lambda: list(stack.rtraverse()))
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='the stack sizes, comma separated')
+    parser.add_argument('--commands', default=','.join(COMMANDS), help='the commands, comma separated')
+    parser.add_argument('--latency', type=float, default=0.0, help='the seconds every request takes')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='the share of requests failing with 502')
+    for name, default in vars(Shape()).items():
+        parser.add_argument(f'--{name.replace("_", "-")}', type=int, default=default, help=f'{name} per PR')
+    parser.add_argument('--deep', type=int, help='time the Stack operations on a linear stack of that depth')
+    parser.add_argument('--wide', type=int, help='time the Stack operations on a stack of 4 * that many branches')
+    args = parser.parse_args()
+    if args.deep or args.wide:
+        print(stack_timings(deep_stack(args.deep) if args.deep else wide_stack(args.wide)))  # noqa: T201
+        return
+    shape = Shape(**{name: getattr(args, name) for name in vars(Shape())})
+    print(  # noqa: T201
+        report(
+            benchmark(
+                tuple(int(size) for size in args.sizes.split(',')),
+                tuple(args.commands.split(',')),
+                shape,
+                args.latency,
+                args.error_rate,
+            )
+        )
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+# Handler returns the status, the headers and the JSON body of a response.
+Response = tuple[int, dict[str, str], any]
+
+
+class MockAPI:
+    """A local stand-in for the GitHub GraphQL endpoint. It replies with the
+    queued responses in order, or with whatever the handler returns. The
+    handler is called with the lock held, unless it is concurrent. The bytes
+    of the request and response bodies are counted."""
+
+    def __init__(self, handler: Callable[[dict[str, any]], Response] | None = None, concurrent: bool = False) -> None:
+        self.handler = handler or self._next_response
+        self.concurrent = concurrent
+        self.responses: list[Response] = []
+        self.requests: list[dict[str, any]] = []
+        self.connections = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/graphql'
+
+    def reply(self, body: any, status: int = 200, headers: dict[str, str] | None = None) -> None:
+        self.responses.append((status, headers or {}, body))
+
+    def _next_response(self, _: dict[str, any]) -> Response:
+        if not self.responses:
+            return 500, {}, {'message': 'no response queued'}
+        return self.responses.pop(0)
+
+    def __enter__(self) -> MockAPI:
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self) -> None:
+                super().setup()
+                with api._lock:
+                    api.connections += 1
+
+            def do_POST(self) -> None:  # noqa: N802
+                content = self.rfile.read(int(self.headers['Content-Length']))
+                request = json.loads(content)
+                with api._lock:
+                    api.requests.append(request)
+                    api.bytes_received += len(content)
+                    if not api.concurrent:
+                        status, headers, body = api.handler(request)
+                if api.concurrent:
+                    status, headers, body = api.handler(request)
+                payload = json.dumps(body).encode()
+                with api._lock:
+                    api.bytes_sent += len(payload)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._server.shutdown()
+        self._server.server_close()
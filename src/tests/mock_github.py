@@ -0,0 +1,569 @@
+from __future__ import annotations
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from .mock_api import MockAPI, Response
+
+# region parser
+
+_TOKEN = re.compile(r'[\s,]+|(\.\.\.|[{}():!$\[\]=@]|-?\d+(?:\.\d+)?|"(?:\\.|[^"\\])*"|[_A-Za-z][_0-9A-Za-z]*)')
+
+
+@dataclass
+class Var:
+    name: str
+
+
+@dataclass
+class Selection:
+    """A field, or a fragment spread if name starts with ..., or an inline
+    fragment if on is set."""
+
+    name: str
+    alias: str = ''
+    args: dict[str, any] = field(default_factory=dict)
+    selections: list[Selection] = field(default_factory=list)
+    on: str = ''
+
+    @property
+    def key(self) -> str:
+        return self.alias or self.name
+
+
+@dataclass
+class Document:
+    kind: str
+    defaults: dict[str, any]
+    selections: list[Selection]
+    fragments: dict[str, tuple[str, list[Selection]]]
+
+
+class _Parser:
+    """Parses the subset of the GraphQL language that ghit sends."""
+
+    def __init__(self, text: str) -> None:
+        self.tokens = [m.group(1) for m in _TOKEN.finditer(text) if m.group(1)]
+        self.i = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def take(self, expected: str | None = None) -> str:
+        token = self.peek()
+        if token is None or expected is not None and token != expected:
+            raise SyntaxError(f'expected {expected or "a token"}, got {token}')
+        self.i += 1
+        return token
+
+    def document(self) -> Document:
+        document = Document('query', {}, [], {})
+        while self.peek():
+            if self.peek() == '{':
+                document.selections = self.selection_set()
+            elif self.take() == 'fragment':
+                name = self.take()
+                self.take('on')
+                document.fragments[name] = (self.take(), self.selection_set())
+            else:
+                document.kind = self.tokens[self.i - 1]
+                if self.peek() not in ('(', '{'):
+                    self.take()
+                if self.peek() == '(':
+                    document.defaults = self.variable_definitions()
+                document.selections = self.selection_set()
+        return document
+
+    def variable_definitions(self) -> dict[str, any]:
+        defaults = {}
+        self.take('(')
+        while self.peek() != ')':
+            self.take('$')
+            name = self.take()
+            self.take(':')
+            self.type()
+            if self.peek() == '=':
+                self.take()
+                defaults[name] = self.value()
+        self.take(')')
+        return defaults
+
+    def type(self) -> None:
+        if self.peek() == '[':
+            self.take()
+            self.type()
+            self.take(']')
+        else:
+            self.take()
+        if self.peek() == '!':
+            self.take()
+
+    def selection_set(self) -> list[Selection]:
+        selections = []
+        self.take('{')
+        while self.peek() != '}':
+            if self.peek() == '...':
+                self.take()
+                if self.peek() == 'on':
+                    self.take()
+                    on = self.take()
+                    selections.append(Selection('...', selections=self.selection_set(), on=on))
+                else:
+                    selections.append(Selection('...' + self.take()))
+                continue
+            selection = Selection(self.take())
+            if self.peek() == ':':
+                self.take()
+                selection.alias, selection.name = selection.name, self.take()
+            if self.peek() == '(':
+                self.take()
+                while self.peek() != ')':
+                    name = self.take()
+                    self.take(':')
+                    selection.args[name] = self.value()
+                self.take(')')
+            if self.peek() == '{':
+                selection.selections = self.selection_set()
+            selections.append(selection)
+        self.take('}')
+        return selections
+
+    def value(self) -> any:
+        text = self.take()
+        if text == '$':
+            return Var(self.take())
+        if text == '[':
+            values = []
+            while self.peek() != ']':
+                values.append(self.value())
+            self.take(']')
+            return values
+        if text == '{':
+            values = {}
+            while self.peek() != '}':
+                name = self.take()
+                self.take(':')
+                values[name] = self.value()
+            self.take('}')
+            return values
+        if text.startswith('"'):
+            return json.loads(text)
+        if text[0].isdigit() or text[0] == '-':
+            return json.loads(text)
+        return {'true': True, 'false': False, 'null': None}.get(text, text)
+
+
+def parse(text: str) -> Document:
+    return _Parser(text).document()
+
+
+# endregion parser
+
+# region executor
+
+# The abstract types of the schema, with the object types implementing them.
+_COMMENTS = {'IssueComment', 'PullRequestReviewComment', 'CommitComment'}
+INTERFACES = {
+    'Actor': {'User', 'Bot'},
+    'Comment': _COMMENTS,
+    'Reactable': {*_COMMENTS, 'PullRequest'},
+    'UniformResourceLocatable': {*_COMMENTS, 'PullRequest', 'User', 'Bot'},
+}
+
+
+class QueryError(Exception):
+    pass
+
+
+def _applies(on: str, typename: str | None) -> bool:
+    return not typename or on == typename or typename in INTERFACES.get(on, ())
+
+
+def _resolve(value: any, variables: dict[str, any]) -> any:
+    if isinstance(value, Var):
+        return variables.get(value.name)
+    if isinstance(value, list):
+        return [_resolve(v, variables) for v in value]
+    if isinstance(value, dict):
+        return {k: _resolve(v, variables) for k, v in value.items()}
+    return value
+
+
+def paginate(items: list[any], first: int | None = None, last: int | None = None, after: str | None = None) -> dict:
+    """The connection of the page of items, with the item positions as the
+    cursors."""
+    start = int(after) if after else 0
+    if last is not None:
+        start = max(start, len(items) - last)
+    end = len(items) if first is None else min(len(items), start + first)
+    edges = [{'cursor': str(i + 1), 'node': items[i]} for i in range(start, end)]
+    return {
+        'totalCount': len(items),
+        'pageInfo': {
+            'endCursor': edges[-1]['cursor'] if edges else None,
+            'hasNextPage': end < len(items),
+        },
+        'edges': edges,
+        'nodes': items[start:end],
+    }
+
+
+class Executor:
+    """Executes a parsed document on objects that are dicts with a __typename.
+    A callable value is a field taking the arguments, and a list value is a
+    connection when the field is given first or last."""
+
+    def __init__(self, document: Document, variables: dict[str, any]) -> None:
+        self.document = document
+        self.variables = {**document.defaults, **(variables or {})}
+        self.errors: list[dict[str, any]] = []
+
+    def execute(self, root: dict[str, any]) -> dict[str, any]:
+        data = self.object(root, self.document.selections, [])
+        return {'data': data, 'errors': self.errors} if self.errors else {'data': data}
+
+    def object(self, obj: dict[str, any], selections: list[Selection], path: list[str]) -> dict[str, any]:
+        result: dict[str, any] = {}
+        for selection in selections:
+            if selection.name.startswith('...'):
+                if selection.on:
+                    on, spread = selection.on, selection.selections
+                else:
+                    on, spread = self.document.fragments[selection.name[3:]]
+                if _applies(on, obj.get('__typename')):
+                    _merge(result, self.object(obj, spread, path))
+                continue
+            try:
+                value = self.field(obj, selection, [*path, selection.key])
+            except QueryError as e:
+                self.errors.append({'message': str(e), 'path': [*path, selection.key]})
+                value = None
+            if selection.key in result and isinstance(value, (dict, list)):
+                _merge(result, {selection.key: value})
+            else:
+                result[selection.key] = value
+        return result
+
+    def field(self, obj: dict[str, any], selection: Selection, path: list[str]) -> any:
+        if selection.name == '__typename':
+            return obj.get('__typename')
+        if selection.name not in obj:
+            raise QueryError(f"Field '{selection.name}' doesn't exist on type '{obj.get('__typename')}'")
+        args = _resolve(selection.args, self.variables)
+        value = obj[selection.name]
+        if callable(value):
+            value = value(**args)
+        elif isinstance(value, list) and ('first' in args or 'last' in args):
+            value = paginate(value, args.get('first'), args.get('last'), args.get('after'))
+        return self.complete(value, selection.selections, path)
+
+    def complete(self, value: any, selections: list[Selection], path: list[str]) -> any:
+        if value is None or not selections:
+            return value
+        if isinstance(value, list):
+            return [self.complete(v, selections, [*path, i]) for i, v in enumerate(value)]
+        return self.object(value, selections, path)
+
+
+def _merge(result: dict[str, any], other: dict[str, any]) -> None:
+    for key, value in other.items():
+        if isinstance(result.get(key), dict) and isinstance(value, dict):
+            _merge(result[key], value)
+        elif isinstance(result.get(key), list) and isinstance(value, list):
+            for mine, theirs in zip(result[key], value):
+                if isinstance(mine, dict) and isinstance(theirs, dict):
+                    _merge(mine, theirs)
+        else:
+            result[key] = value
+
+
+# endregion executor
+
+# region repository
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# GitHub formats the timestamps in UTC with a Z suffix.
+TIMESTAMP = '%Y-%m-%dT%H:%M:%SZ'
+USERS = ('author', 'reviewer', 'bot')
+REACTIONS = ('THUMBS_UP', 'HEART', 'ROCKET', 'EYES')
+
+
+def _timestamp(t: datetime) -> str:
+    return t.astimezone(timezone.utc).strftime(TIMESTAMP)
+
+
+def _parse_timestamp(value: str) -> datetime:
+    return datetime.strptime(value, TIMESTAMP).replace(tzinfo=timezone.utc)
+
+
+def _user(login: str) -> dict[str, any]:
+    return {'__typename': 'User', 'login': login, 'name': login.title(), 'url': f'https://github.com/{login}'}
+
+
+@dataclass
+class Shape:
+    """The number of items of every connection of a synthetic PR."""
+
+    comments: int = 0
+    threads: int = 0
+    thread_comments: int = 1
+    reviews: int = 0
+    commits: int = 1
+    reactions: int = 0
+
+
+class SyntheticRepository:
+    """A GitHub repository with a PR for every branch of a stack, each based
+    on the previous one. The PRs, their connections and the nodes are plain
+    objects for the Executor, and the mutations change them."""
+
+    def __init__(
+        self,
+        branches: list[str],
+        shape: Shape | None = None,
+        owner: str = 'owner',
+        name: str = 'repository',
+        base: str = 'main',
+        without_pr: tuple[str, ...] = (),
+    ) -> None:
+        self.owner = owner
+        self.name = name
+        self.shape = shape or Shape()
+        self.nodes: dict[str, dict[str, any]] = {}
+        self.prs: list[dict[str, any]] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.repository = self._node(
+            'Repository', f'R_{owner}_{name}', pullRequests=self._pull_requests, url=self.url(), name=name
+        )
+        for branch in branches:
+            if branch not in without_pr:
+                self.create_pr(base, branch, branch, '')
+            base = branch
+
+    def url(self, *path: str) -> str:
+        return '/'.join(('https://github.com', self.owner, self.name, *path))
+
+    def _node(self, typename: str, node_id: str, **fields: any) -> dict[str, any]:
+        node = {'__typename': typename, 'id': node_id, **fields}
+        self.nodes[node_id] = node
+        return node
+
+    def _reactions(self, subject: str) -> dict[str, any]:
+        reactions = [
+            self._node(
+                'Reaction',
+                f'{subject}_R{i}',
+                content=REACTIONS[i % len(REACTIONS)],
+                user=_user(USERS[i % len(USERS)]),
+            )
+            for i in range(self.shape.reactions)
+        ]
+        groups = {}
+        for reaction in reactions:
+            groups[reaction['content']] = groups.get(reaction['content'], 0) + 1
+        return {
+            'reactions': reactions,
+            'reactionGroups': [
+                {'content': content, 'reactors': {'totalCount': groups.get(content, 0)}} for content in REACTIONS
+            ],
+        }
+
+    def _comment(self, typename: str, comment_id: str, url: str, body: str = 'comment', **fields: any) -> dict:
+        return self._node(
+            typename,
+            comment_id,
+            body=body,
+            createdAt=_timestamp(NOW),
+            author=_user(USERS[len(self.nodes) % len(USERS)]),
+            url=url,
+            **self._reactions(comment_id),
+            **fields,
+        )
+
+    def create_pr(self, base: str, head: str, title: str, body: str, draft: bool = False) -> dict[str, any]:
+        number = next(self._ids)
+        url = self.url('pull', str(number))
+        pr_id = f'PR_{number}'
+        shape = self.shape
+        pr = self._node(
+            'PullRequest',
+            pr_id,
+            number=number,
+            title=title,
+            author=_user(USERS[0]),
+            body=body,
+            url=url,
+            baseRefName=base,
+            headRefName=head,
+            isDraft=draft,
+            locked=False,
+            closed=False,
+            merged=False,
+            mergedAt=None,
+            updatedAt=_timestamp(NOW),
+            state='OPEN',
+            comments=[
+                self._comment('IssueComment', f'IC_{number}_{i}', f'{url}#issuecomment-{i}')
+                for i in range(shape.comments)
+            ],
+            reviewThreads=[
+                self._node(
+                    'PullRequestReviewThread',
+                    f'PRRT_{number}_{i}',
+                    path=f'src/file{i % 10}.py',
+                    isResolved=i % 2 == 1,
+                    isOutdated=False,
+                    comments=[
+                        self._comment('PullRequestReviewComment', f'PRRC_{number}_{i}_{j}', f'{url}#r{i}_{j}')
+                        for j in range(shape.thread_comments)
+                    ],
+                )
+                for i in range(shape.threads)
+            ],
+            reviews=[
+                self._node(
+                    'PullRequestReview',
+                    f'PRR_{number}_{i}',
+                    state=('APPROVED', 'CHANGES_REQUESTED', 'COMMENTED')[i % 3],
+                    url=f'{url}#pullrequestreview-{i}',
+                    author=_user(USERS[1 + i % 2]),
+                )
+                for i in range(shape.reviews)
+            ],
+            commits=[
+                self._node('PullRequestCommit', f'PURC_{number}_{i}', commit={'comments': []})
+                for i in range(shape.commits)
+            ],
+            **self._reactions(pr_id),
+        )
+        pr['latestReviews'] = pr['reviews'][-len(USERS) :]
+        self.prs.append(pr)
+        return pr
+
+    def _pull_requests(self, headRefName: str | None = None, **page: any) -> dict:  # noqa: N803
+        return paginate([pr for pr in self.prs if headRefName in (None, pr['headRefName'])], **page)
+
+    def search(self, query: str, type: str, **page: any) -> dict:  # noqa: A002
+        terms = query.split()
+        if type != 'ISSUE' or f'repo:{self.owner}/{self.name}' not in terms:
+            return paginate([], **page)
+        heads = {term.removeprefix('head:') for term in terms if term.startswith('head:')}
+        return paginate([pr for pr in self.prs if pr['headRefName'] in heads], **page)
+
+    def _touch(self, node: dict[str, any], **fields: any) -> dict[str, any]:
+        node.update({k: v for k, v in fields.items() if v is not None})
+        node['updatedAt'] = _timestamp(_parse_timestamp(node['updatedAt']) + timedelta(seconds=1))
+        return node
+
+    def _input_node(self, node_id: str, typename: str) -> dict[str, any]:
+        node = self.nodes.get(node_id)
+        if not node or node['__typename'] != typename:
+            raise QueryError(f"Could not resolve to a node with the global id of '{node_id}'")
+        return node
+
+    def update_pull_request(self, input: dict[str, any]) -> dict:  # noqa: A002
+        pr = self._input_node(input['pullRequestId'], 'PullRequest')
+        if input.get('baseRefName') == pr['headRefName']:
+            raise QueryError('Base branch was modified.')
+        fields = {k: input.get(k) for k in ('title', 'body', 'baseRefName')}
+        return {'clientMutationId': None, 'pullRequest': self._touch(pr, **fields)}
+
+    def create_pull_request(self, input: dict[str, any]) -> dict:  # noqa: A002
+        if input['repositoryId'] != self.repository['id']:
+            raise QueryError(f"Could not resolve to a node with the global id of '{input['repositoryId']}'")
+        head = input['headRefName'].removeprefix(f'{self.owner}:')
+        pr = self.create_pr(input['baseRefName'], head, input['title'], input.get('body') or '', input.get('draft'))
+        return {'clientMutationId': None, 'pullRequest': pr}
+
+    def add_comment(self, input: dict[str, any]) -> dict:  # noqa: A002
+        pr = self._input_node(input['subjectId'], 'PullRequest')
+        number = len(pr['comments'])
+        comment = self._comment(
+            'IssueComment', f'IC_{pr["number"]}_{number}', f'{pr["url"]}#issuecomment-{number}', input['body']
+        )
+        pr['comments'].append(comment)
+        self._touch(pr)
+        return {'clientMutationId': None, 'commentEdge': {'node': comment}}
+
+    def update_issue_comment(self, input: dict[str, any]) -> dict:  # noqa: A002
+        comment = self._input_node(input['id'], 'IssueComment')
+        comment['body'] = input['body']
+        return {'clientMutationId': None, 'issueComment': comment}
+
+    def query_root(self) -> dict[str, any]:
+        return {
+            'repository': lambda owner, name: self.repository if (owner, name) == (self.owner, self.name) else None,
+            'search': self.search,
+            'node': lambda id: self.nodes.get(id),  # noqa: A006, PLW0108 the argument is named id
+            'nodes': lambda ids: [self.nodes.get(node_id) for node_id in ids],
+            'viewer': _user(USERS[0]),
+            'rateLimit': {
+                'cost': 1,
+                'remaining': 5000,
+                'resetAt': _timestamp(datetime.now(timezone.utc) + timedelta(hours=1)),
+            },
+        }
+
+    def mutation_root(self) -> dict[str, any]:
+        return {
+            'updatePullRequest': self.update_pull_request,
+            'createPullRequest': self.create_pull_request,
+            'addComment': self.add_comment,
+            'updateIssueComment': self.update_issue_comment,
+        }
+
+    def handle(self, request: dict[str, any]) -> Response:
+        """Executes the GraphQL request, with the mutations one at a time."""
+        try:
+            document = parse(request['query'])
+        except SyntaxError as e:
+            return 200, {}, {'errors': [{'message': f'Parse error: {e}'}]}
+        executor = Executor(document, request.get('variables'))
+        if document.kind == 'mutation':
+            with self._lock:
+                return 200, {}, executor.execute(self.mutation_root())
+        return 200, {}, executor.execute(self.query_root())
+
+
+# endregion repository
+
+
+class MockGitHub(MockAPI):
+    """A local stand-in for the GitHub GraphQL API serving a synthetic
+    repository, for the tests and the benchmarks. Every request waits for
+    latency seconds, and fails with error_status at error_rate, randomly but
+    reproducibly. The requests are answered concurrently."""
+
+    def __init__(
+        self,
+        repository: SyntheticRepository,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 502,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(self._handle, concurrent=True)
+        self.repository = repository
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.errors = 0
+        self._random = random.Random(seed)  # noqa: S311 not for security
+
+    def _handle(self, request: dict[str, any]) -> Response:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            return self.error_status, {}, {'message': 'Server Error'}
+        return self.repository.handle(request)
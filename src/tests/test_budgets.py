@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import pytest
+
+from ghit import gh_transport
+from ghit.gh_graphql import CALLS
+
+from .benchmark import COMMANDS, environment, make_repository, run_command
+from .mock_github import MockGitHub, Shape, SyntheticRepository
+
+# The reactions to the last comments of the unresolved threads are what ls
+# looks at to tell whether the PR author has answered.
+SHAPE = Shape(comments=3, threads=3, reviews=2, commits=1, reactions=2)
+
+# The most GraphQL requests of every operation that the commands may make on
+# a stack of PRs, without and then with the cache.
+BUDGETS = {
+    (10, 'ls'): ({'stack_pr_versions': 1, 'prs_by_id': 1}, {'stack_pr_versions': 1}),
+    (10, 'ls search'): ({'search_prs': 1}, {'search_prs': 1}),
+    (10, 'ls -v'): ({'stack_pr_versions': 1, 'prs_by_id': 1}, {'stack_pr_versions': 1}),
+    # The first submit adds the dependencies to the PR bodies, which the
+    # second one fetches again.
+    (10, 'stack submit'): (
+        {'stack_pr_versions': 1, 'prs_by_id': 1, 'batch': 1},
+        {'stack_pr_versions': 1, 'prs_by_id': 1},
+    ),
+    (100, 'ls'): ({'stack_pr_versions': 1, 'prs_by_id': 1}, {'stack_pr_versions': 1}),
+    (100, 'ls -v'): ({'stack_pr_versions': 1, 'prs_by_id': 1}, {'stack_pr_versions': 1}),
+    # The search queries are split to stay short.
+    (100, 'ls search'): ({'search_prs': 7}, {'search_prs': 7}),
+    (100, 'stack submit'): (
+        {'stack_pr_versions': 1, 'prs_by_id': 1, 'batch': 10},
+        {'stack_pr_versions': 1, 'prs_by_id': 1},
+    ),
+}
+
+
+@pytest.mark.parametrize(('size', 'command'), BUDGETS, ids=[f'{command} {size}' for size, command in BUDGETS])
+def test_budget(size: int, command: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(gh_transport, 'MUTATION_INTERVAL', 0)
+    branches = [f'branch-{i}' for i in range(size)]
+    make_repository(tmp_path, branches)
+    argv, variables = COMMANDS[command]
+    with MockGitHub(SyntheticRepository(branches, SHAPE)) as api, environment(
+        GITHUB_API_URL=api.url, GITHUB_TOKEN='token', **variables  # noqa: S106
+    ):
+        for budget in BUDGETS[size, command]:
+            CALLS.reset()
+            requests, *_ = run_command(api, tmp_path, argv)
+            assert all(stats.calls <= budget.get(name, 0) for name, stats in CALLS.operations.items()), CALLS.dump()
+            assert requests == CALLS.calls()
@@ -0,0 +1,106 @@
+import stat
+from pathlib import Path
+
+import pygit2 as git
+import pytest
+
+from ghit import cache
+from ghit.cache import PRCache
+from ghit.common import cache_filename
+from ghit.error import GhitError
+from ghit.gh_graphql import PR, make_pr
+
+from .benchmark import make_repository
+
+EMPTY = {'pageInfo': {'endCursor': None, 'hasNextPage': False}, 'edges': []}
+
+
+def make_test_pr(number: int, head: str, updated_at: str = '2024-01-01T00:00:00Z') -> PR:
+    return make_pr(
+        {
+            'node': {
+                'number': number,
+                'id': f'PR_{number}',
+                'title': f'PR {number}',
+                'author': {'login': 'author'},
+                'body': '',
+                'url': f'https://github.com/owner/repository/pull/{number}',
+                'baseRefName': 'main',
+                'headRefName': head,
+                'isDraft': False,
+                'locked': False,
+                'closed': False,
+                'merged': False,
+                'mergedAt': None,
+                'updatedAt': updated_at,
+                'state': 'OPEN',
+                'comments': EMPTY,
+                'reviewThreads': EMPTY,
+                'reviews': EMPTY,
+                'commits': EMPTY,
+            }
+        }
+    )
+
+
+def test_store_and_load(tmp_path: Path):
+    prs = PRCache(tmp_path / 'cache')
+    prs.store([make_test_pr(1, 'a'), make_test_pr(2, 'b'), make_test_pr(3, 'a')], 'full')
+    assert prs.versions(['PR_1', 'PR_4'], ['full']) == {'PR_1': '2024-01-01T00:00:00+00:00'}
+    assert [pr.number for pr in prs.load_heads(['a'], ['full'])] == [1, 3]
+    loaded = prs.load(['PR_2'])
+    assert list(loaded) == ['PR_2']
+    assert loaded['PR_2'].head == 'b'
+    assert loaded['PR_2'].comments.complete()
+    prs.close()
+
+    prs = PRCache(tmp_path / 'cache')
+    prs.retain(['a'], ['PR_3'])
+    assert [pr.number for pr in prs.load_heads(['a', 'b'], ['full'])] == [3, 2]
+    prs.close()
+
+
+def test_profiles(tmp_path: Path):
+    prs = PRCache(tmp_path / 'cache')
+    prs.store([make_test_pr(1, 'a')], 'ls')
+    prs.store([make_test_pr(2, 'a')], 'full')
+    assert list(prs.versions(['PR_1', 'PR_2'], ['ls', 'full'])) == ['PR_1', 'PR_2']
+    assert list(prs.versions(['PR_1', 'PR_2'], ['full'])) == ['PR_2']
+    assert [pr.number for pr in prs.load_heads(['a'], ['full'])] == [2]
+    assert list(prs.load(['PR_1', 'PR_2'], ['full'])) == ['PR_2']
+    prs.close()
+
+
+def test_reset(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    prs = PRCache(tmp_path / 'cache')
+    prs.store([make_test_pr(1, 'a')], 'full')
+    prs.close()
+    monkeypatch.setattr(cache, 'CACHE_VERSION', cache.CACHE_VERSION + 1)
+    prs = PRCache(tmp_path / 'cache')
+    assert prs.load_heads(['a'], ['full']) == []
+    prs.close()
+
+
+def test_max_age(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    prs = PRCache(tmp_path / 'cache')
+    prs.store([make_test_pr(1, 'a')], 'full')
+    monkeypatch.setattr(cache, 'MAX_AGE_SECONDS', -1)
+    assert prs.versions(['PR_1'], ['full']) == {}
+    prs.close()
+
+
+def test_cache_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    home = tmp_path / 'home'
+    monkeypatch.setenv('XDG_CACHE_HOME', str(home))
+    path = cache.cache_path(tmp_path / 'a')
+    assert path.parent == home / 'ghit'
+    assert stat.S_IMODE(path.parent.stat().st_mode) == 0o700  # noqa: PLR2004
+    assert cache.cache_path(tmp_path / 'b') != path
+    # A .ghit/cache in the work tree, e.g. committed to the repository, is
+    # never read.
+    make_repository(tmp_path / 'repository', ['a'])
+    assert cache_filename(git.Repository(str(tmp_path / 'repository'))) == cache.cache_path(tmp_path / 'repository')
+    path.parent.chmod(0o755)
+    with pytest.raises(GhitError):
+        cache.cache_path(tmp_path / 'a')
+    assert cache_filename(git.Repository(str(tmp_path / 'repository'))) is None
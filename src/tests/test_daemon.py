@@ -0,0 +1,105 @@
+import os
+import socket
+import stat
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from ghit.daemon import Daemon, DaemonClient, connect_daemon, is_supported, runtime_dir, socket_path
+from ghit.error import GhitError
+from ghit.stack import Stack
+
+from .test_cache import make_test_pr
+
+pytestmark = pytest.mark.skipif(not is_supported(), reason='no Unix domain sockets')
+
+
+class FakeGH:
+    def __init__(self) -> None:
+        self.stack = None
+        self.fetched: list[list[str]] = []
+
+    def heads(self) -> list[str]:
+        return [record.branch_name for record in self.stack.traverse()]
+
+    def fetch_prs(self, heads: list[str]) -> list:
+        self.fetched.append(heads)
+        return [make_test_pr(i, head) for i, head in enumerate(heads) if head != 'main']
+
+
+def test_socket_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    assert socket_path(tmp_path) == tmp_path / 'daemon.sock'
+    long = tmp_path / ('x' * 100)
+    assert socket_path(long).parent == tmp_path / f'ghit-{os.getuid()}'
+    assert stat.S_IMODE(socket_path(long).parent.stat().st_mode) == 0o700  # noqa: PLR2004
+    assert len(str(socket_path(long))) < 100  # noqa: PLR2004
+    assert connect_daemon(tmp_path) is None
+
+    runtime = tmp_path / 'runtime'
+    runtime.mkdir(mode=0o755)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(runtime))
+    with pytest.raises(GhitError):
+        runtime_dir()
+    assert connect_daemon(long) is None
+    runtime.chmod(0o700)
+    assert socket_path(long).parent == runtime
+
+
+def test_foreign_response(tmp_path: Path):
+    path = tmp_path / 'daemon.sock'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(str(path))
+        server.listen()
+
+        def reply() -> None:
+            connection, _ = server.accept()
+            with connection:
+                connection.recv(1024)
+                connection.sendall(b'not a pickle')
+
+        replier = threading.Thread(target=reply)
+        replier.start()
+        # The socket is not private to the user yet.
+        path.chmod(0o666)  # noqa: S103
+        assert DaemonClient(path).refresh() is False
+        path.chmod(0o600)
+        assert DaemonClient(path).refresh() is False
+        replier.join(5)
+
+
+def test_daemon(tmp_path: Path):
+    stack = Stack()
+    stack.add_child('main').add_child('a')
+    gh = FakeGH()
+    repo = SimpleNamespace(references={})
+    path = tmp_path / 'daemon.sock'
+    daemon = Daemon(repo, gh, lambda: stack, tmp_path / 'stack', path)
+    server = threading.Thread(target=daemon.serve)
+    server.start()
+    try:
+        # Wait for the socket and for the initial refresh by the watcher.
+        for _ in range(100):
+            if path.exists() and gh.fetched:
+                break
+            threading.Event().wait(0.01)
+        client = connect_daemon(tmp_path)
+        assert client is not None
+        assert stat.S_IMODE(path.stat().st_mode) == 0o600  # noqa: PLR2004
+
+        prs = client.prs(['a', 'b'], fresh=False)
+        assert [pr.head for pr in prs] == ['a', 'b']
+        fetched = len(gh.fetched)
+        assert [pr.head for pr in client.prs(['b'], fresh=False)] == ['b']
+        assert len(gh.fetched) == fetched
+        client.prs(['a'], fresh=True)
+        assert gh.fetched[-1] == ['a']
+        assert client.stop()
+    finally:
+        server.join(5)
+    assert not server.is_alive()
+    assert not path.exists()
+    assert DaemonClient(path).prs(['a'], fresh=False) is None
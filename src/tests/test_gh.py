@@ -1,4 +1,21 @@
-from ghit.gh import COMMENT_BEGIN, COMMENT_END, COMMENT_FIRST_LINE, _find_stack_comment, _patch_body
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pygit2 as git
+import pytest
+
+from ghit import gh as gh_module
+from ghit.cache import PRCache
+from ghit.error import GhitError
+from ghit.gh import COMMENT_BEGIN, COMMENT_END, COMMENT_FIRST_LINE, GH, _find_stack_comment, _patch_body, init_gh
+from ghit.gh_graphql import make_pr
+from ghit.gh_transport import Transport
+from ghit.stack import Stack
+
+from .benchmark import make_repository
+from .mock_api import MockAPI
+from .test_cache import make_test_pr
 
 
 def test_find_stack_comment():
@@ -10,3 +27,119 @@ def test_patch_body():
     assert _patch_body('body', 'comment') == 'body\ncomment'
     body = ['body', COMMENT_BEGIN, COMMENT_FIRST_LINE, COMMENT_END]
     assert _patch_body('\n'.join(body), 'comment') == 'body\ncomment'
+
+
+def make_summary_thread(i: int, author: str, groups: dict[str, int]) -> dict:
+    reaction_groups = [{'content': content, 'reactors': {'totalCount': count}} for content, count in groups.items()]
+    comment = {'id': f'C_{i}', 'author': {'login': author}, 'reactionGroups': reaction_groups}
+    page = {'pageInfo': {'endCursor': 'c', 'hasNextPage': False}, 'edges': [{'cursor': 'c', 'node': comment}]}
+    node = {'id': f'T_{i}', 'path': 'f', 'isResolved': False, 'isOutdated': False, 'comments': page}
+    return {'cursor': f't{i}', 'node': node}
+
+
+def test_unresolved_summary():
+    threads = [
+        make_summary_thread(0, 'author', {}),
+        make_summary_thread(1, 'reviewer', {'EYES': 1, 'THUMBS_UP': 0}),
+        make_summary_thread(2, 'reviewer', {'THUMBS_UP': 1}),
+    ]
+    pr = make_pr(
+        {
+            'node': {
+                'number': 1,
+                'id': 'PR_1',
+                'title': '',
+                'author': {'login': 'author'},
+                'url': '',
+                'baseRefName': 'main',
+                'headRefName': 'a',
+                'isDraft': False,
+                'locked': False,
+                'closed': False,
+                'merged': False,
+                'mergedAt': None,
+                'updatedAt': '2024-01-01T00:00:00Z',
+                'state': 'OPEN',
+                'reviewThreads': {'pageInfo': {'endCursor': 't2', 'hasNextPage': False}, 'edges': threads},
+            }
+        }
+    )
+    comments = [thread.comments.data[-1] for thread in pr.threads.data]
+    assert [comment.reactions.complete() for comment in comments] == [True, False, False]
+
+    # The reactions are fetched only when the counts can't tell.
+    fetched = []
+
+    def next_page(after: str) -> dict:
+        fetched.append(after)
+        edge = {'cursor': 'r', 'node': {'content': 'THUMBS_UP', 'user': {'login': 'author', 'name': None}}}
+        return {'reactions': {'pageInfo': {'endCursor': 'r', 'hasNextPage': False}, 'edges': [edge]}}
+
+    comments[2].reactions.lazy(next_page)
+    unresolved = GH.unresolved(pr)
+    assert [c.id for thread_comments in unresolved.values() for c in thread_comments] == ['C_1']
+    assert fetched == [None]
+
+
+def test_repository_meta(tmp_path: Path):
+    origin = SimpleNamespace(url='https://github.com/owner/repository.git')
+    repo = SimpleNamespace(remotes={'origin': origin}, workdir=tmp_path)
+    cache = PRCache(tmp_path / 'cache')
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        api.reply({'data': {'repository': {'id': 'R_1'}}})
+        gh = GH(repo, Stack(), transport=transport, cache=cache)
+        assert (gh.owner, gh.repository) == ('owner', 'repository')
+        assert gh.template is None
+        assert gh.repository_id() == 'R_1'
+        template = tmp_path / '.github' / 'pull_request_template.md'
+        template.parent.mkdir()
+        template.write_text('template')
+        assert gh.template == 'template'
+
+        gh = GH(repo, Stack(), transport=transport, cache=cache)
+        assert gh.repository_id() == 'R_1'
+        assert len(api.requests) == 1
+        assert gh.template == 'template'
+        template.write_text('changed')
+        os.utime(template, ns=(0, 0))
+        assert gh.template == 'changed'
+    assert cache.load_repository('https://github.com/other/repository.git') is None
+    cache.close()
+
+
+def test_lazy_init(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    def no_token(_: any) -> str:
+        raise AssertionError('no token expected')
+
+    monkeypatch.setattr(gh_module, 'get_gh_token', no_token)
+    origin = SimpleNamespace(url='https://github.com/owner/repository.git')
+    repo = SimpleNamespace(remotes={'origin': origin}, workdir=tmp_path)
+    gh = GH(repo, Stack(), cache=PRCache(tmp_path / 'cache'))
+    gh.close()
+    assert not (tmp_path / 'cache').exists()
+
+    make_repository(tmp_path / 'repository', ['a'])
+    gh = init_gh(git.Repository(str(tmp_path / 'repository')), Stack(), False, tmp_path / 'cache')
+    assert gh is not None
+    gh.close()
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_send_updates(capsys: pytest.CaptureFixture):
+    stack = Stack()
+    a = stack.add_child('main').add_child('a')
+    b = a.add_child('b')
+    prs = [make_test_pr(1, 'a'), make_test_pr(2, 'b')]
+    prs[0].base = 'other'
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        gh = GH(SimpleNamespace(), stack, transport=transport)
+        assert gh.update_pr(a, prs[0], 'updated a')
+        assert gh.update_pr(b, prs[1], 'updated b')
+        assert not gh.update_pr(a, prs[0], 'updated a again')
+        # Nothing is reported before the updates are sent.
+        assert capsys.readouterr().out == ''
+        api.reply({'data': {'m0': {}, 'm1': None}, 'errors': [{'path': ['m1'], 'message': 'no'}]})
+        with pytest.raises(GhitError):
+            gh.send_updates()
+    assert capsys.readouterr().out == 'updated a\n'
+    assert [pr.base for pr in prs] == ['main', 'a']
@@ -1,19 +1,387 @@
-from ghit.gh_graphql import first_n_after, pr_details_query
+import json
+import pickle
+import re
+from datetime import datetime, timezone
+
+from ghit.gh_graphql import (
+    BATCH_PAGE_SIZES,
+    CALLS,
+    CLEANUP,
+    FULL,
+    GQL_COMMENT,
+    GQL_PR,
+    LS,
+    MAX_QUERY_COST,
+    MAX_QUERY_NODES,
+    MAX_SEARCH_QUERY_LENGTH,
+    MODELS,
+    MUTATIONS_PER_REQUEST,
+    STATS,
+    SUBMIT,
+    MutationBatch,
+    PageSizes,
+    adapt_page_sizes,
+    fetch_prs_by_id,
+    first_n_after,
+    fit_page_sizes,
+    make_continuations_query,
+    make_pr,
+    make_pr_version,
+    make_prs_by_id_query,
+    make_selection,
+    make_stack_prs_query,
+    observed_sizes,
+    operation_name,
+    parse_timestamp,
+    search_prs,
+)
+from ghit.gh_transport import Transport
+
+from .mock_api import MockAPI
+from .test_cache import EMPTY
 
 
 def test_first_n_after():
-    assert first_n_after('test', 'obj', 10, 'after', opt='opt') == (
-        'test(first: 10, after: "after", opt: opt)'
+    assert first_n_after('test', 'obj', 10, opt='opt') == (
+        'test(first: 10, after: $after, opt: opt)'
         '{ pageInfo{ endCursor hasNextPage } '
         'edges{ cursor node{ obj } } }'
     )
 
-def test_pr_details():
-    q = pr_details_query('pr_test', lambda after: first_n_after('test', 'obj', 10, after))
-    assert q('owner', 'repository', 42, 'abc') == (
-        'query pr_test{ repository(owner: "owner", name: "repository")'
-        '{ pullRequest(number: 42)'
-        '{ test(first: 10, after: "abc")'
-        '{ pageInfo{ endCursor hasNextPage } '
-        'edges{ cursor node{ obj } } } } } }'
+
+def test_continuations_query():
+    q = make_continuations_query((('reactions', 1), ('commitComments', 2)))
+    assert q is make_continuations_query((('reactions', 1), ('commitComments', 2)))
+    assert q.startswith(
+        'query continuations($reactions: Int = 10, '
+        '$reactions0Id: ID!, $reactions0First: Int!, $reactions0After: String, '
+        '$commitComments0Id: ID!, $commitComments0First: Int!, $commitComments0After: String, '
+        '$commitComments1Id: ID!, '
+    )
+    assert (
+        '{ reactions0: node(id: $reactions0Id){ ... on Reactable{ '
+        'reactions(first: $reactions0First, after: $reactions0After){ totalCount '
+    ) in q
+    assert (
+        ' commitComments1: node(id: $commitComments1Id){ ... on PullRequestCommit{ commit{ '
+        'comments(first: $commitComments1First, after: $commitComments1After){ totalCount '
+    ) in q
+
+
+def test_fragments():
+    q = make_continuations_query((('comments', 1),))
+    assert q.startswith('query continuations($reactions: Int = 10, $comments0Id: ID!')
+    assert q.endswith(
+        'fragment actor on Actor{ login ... on User{ name } } '
+        'fragment reaction on Reaction{ content user{ ...actor } } ' + GQL_COMMENT.definition
+    )
+    assert q.count('fragment actor') == 1
+    assert set(GQL_PR.variables) == {'comments', 'reactions', 'threads', 'reviews', 'commits'}
+    assert GQL_PR.definitions()['...pr'] == GQL_PR.definition
+
+
+def test_profiles():
+    assert FULL.covers(LS)
+    assert LS.covers(CLEANUP)
+    assert not LS.covers(SUBMIT)
+    assert not CLEANUP.covers(LS)
+
+    cleanup = make_selection(CLEANUP).pr
+    assert cleanup.startswith('...cleanup_pr')
+    assert not cleanup.variables
+    for field in ('author', 'body', 'comments', 'reviews'):
+        assert f' {field}' not in cleanup.definition
+
+    ls = make_selection(LS).pr
+    assert set(ls.variables) == {'threads', 'reviews', 'reactions'}
+    assert 'reviews: latestReviews(first: $reviews)' in ls.definition
+    # The last comments of the threads come with their reactions, not to fetch
+    # them thread by thread.
+    assert 'reactionGroups{ content reactors{ totalCount } }' in make_selection(LS).comment.definition
+    assert ' reactions(first: $reactions)' in make_selection(LS).comment.definition
+    assert ' body' not in ls.definition
+    assert ' comments(' not in ls.definition.split('reviewThreads')[0]
+
+    pr = make_pr(
+        {
+            'node': {
+                'number': 1,
+                'id': 'PR_1',
+                'title': 'PR 1',
+                'url': 'https://github.com/owner/repository/pull/1',
+                'baseRefName': 'main',
+                'headRefName': 'a',
+                'isDraft': False,
+                'locked': False,
+                'closed': False,
+                'merged': False,
+                'mergedAt': None,
+                'updatedAt': '2024-01-01T00:00:00Z',
+                'state': 'OPEN',
+            }
+        }
     )
+    assert pr.author is None
+    assert pr.body is None
+    assert pr.comments.complete()
+    assert pr.comments.data == []
+
+
+def test_schema():
+    for profile in (CLEANUP, LS, SUBMIT, FULL):
+        selection = make_selection(profile)
+        for name, _, schema in MODELS:
+            fragment = getattr(selection, name)
+            for field in schema:
+                if field.selected(profile):
+                    assert (field.key or field.attr) in fragment.definition
+
+    node = make_node('PR_1', 1, 1)
+    comment = {
+        'id': 'C_1',
+        'author': None,
+        'createdAt': '2024-01-01T00:00:00Z',
+        'reactions': EMPTY,
+    }
+    page_info = {'endCursor': 'c1', 'hasNextPage': False}
+    comments = {'pageInfo': page_info, 'edges': [{'cursor': 'c1', 'node': comment}]}
+    commit = {'id': 'PC_1', 'commit': {'comments': comments}}
+    node['commits'] = {'pageInfo': page_info, 'edges': [{'cursor': 'pc1', 'node': commit}]}
+    pr = make_pr({'node': node})
+    assert pr.updated_at == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert pr.merged_at is None
+    ((comment,),) = [commit.comments.data for commit in pr.commits.data]
+    assert comment.author is None
+    assert comment.created_at == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert comment.body is None
+    assert comment.reaction_groups is None
+    copy = pickle.loads(pickle.dumps(pr))  # noqa: S301
+    assert copy.commits.data[0].comments.obj_ctor is pr.comments.obj_ctor
+
+
+def test_timestamps():
+    # GitHub ends the timestamps with Z, which Python 3.9 and 3.10 don't parse.
+    utc = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert parse_timestamp('2024-01-02T03:04:05Z') == utc
+    assert parse_timestamp('2024-01-02T03:04:05+00:00') == utc
+    assert make_pr_version({'node': {'id': 'PR_1', 'updatedAt': '2024-01-02T03:04:05Z'}}) == ('PR_1', utc)
+    node = make_node('PR_1', 0, 0)
+    node.update(merged=True, mergedAt='2024-01-02T03:04:05Z', updatedAt='2024-01-02T03:04:05Z')
+    pr = make_pr({'node': node})
+    assert pr.merged_at == pr.updated_at == utc
+
+
+def test_interned_authors():
+    node = make_node('PR_1', 2, 2)
+    pr = make_pr({'node': node})
+    assert pr.author is make_pr({'node': node}).author
+    assert not hasattr(pr, '__dict__')
+    assert not hasattr(pr.threads, '__dict__')
+    copy = pickle.loads(pickle.dumps(pr))  # noqa: S301
+    assert copy.author is pr.author
+    assert copy.threads.data[1].id == 'T_1'
+
+
+def test_fit_page_sizes():
+    sizes, chunk = fit_page_sizes(1)
+    assert sizes == BATCH_PAGE_SIZES[0]
+    assert chunk >= 1
+
+    sizes, chunk = fit_page_sizes(25)
+    assert chunk >= 25  # noqa: PLR2004
+    nodes, requests = sizes.head_cost()
+    assert nodes * 25 <= MAX_QUERY_NODES
+    assert requests * 25 <= MAX_QUERY_COST * 100
+
+    sizes, chunk = fit_page_sizes(1000)
+    assert sizes == BATCH_PAGE_SIZES[-1]
+    assert chunk < 1000  # noqa: PLR2004
+
+
+def test_stack_prs_query():
+    q = make_stack_prs_query(2)
+    assert q is make_stack_prs_query(2)
+    assert '$h0: String!, $h1: String!)' in q
+    assert (
+        '{ repository(owner: $owner, name: $name){ '
+        'h0: ' + first_n_after('pullRequests', GQL_PR, '$first', headRefName='$h0') + ' '
+        'h1: ' + first_n_after('pullRequests', GQL_PR, '$first', headRefName='$h1') + ' } '
+        'rateLimit{ cost remaining resetAt } } '
+    ) in q
+    assert q.endswith(GQL_PR.definition)
+    assert set(PageSizes().variables()) == set(GQL_PR.variables)
+
+
+def test_adapt_page_sizes():
+    assert adapt_page_sizes(PageSizes(1, 0, 5, 60, 3, 100)) == PageSizes(1, 5, 10, 100, 5, 100)
+
+
+def make_thread(i: int) -> dict:
+    node = {'id': f'T_{i}', 'path': 'f', 'isResolved': False, 'isOutdated': False, 'comments': EMPTY}
+    return {'cursor': f't{i}', 'node': node}
+
+
+def make_node(pr_id: str, threads: int, total: int) -> dict:
+    node = {
+        'number': 1,
+        'id': pr_id,
+        'title': '',
+        'author': {'login': 'author'},
+        'body': '',
+        'url': '',
+        'baseRefName': 'main',
+        'headRefName': 'a',
+        'isDraft': False,
+        'locked': False,
+        'closed': False,
+        'merged': False,
+        'mergedAt': None,
+        'updatedAt': '2024-01-01T00:00:00Z',
+        'state': 'OPEN',
+        'comments': EMPTY,
+        'reviews': EMPTY,
+        'commits': EMPTY,
+    }
+    node['reviewThreads'] = {
+        'totalCount': total,
+        'pageInfo': {'endCursor': f't{threads - 1}', 'hasNextPage': threads < total},
+        'edges': [make_thread(i) for i in range(threads)],
+    }
+    return node
+
+
+def threads_handler(request: dict) -> tuple:
+    """Replies with 10 of 60 threads per PR, then with the 50 remaining ones."""
+    variables = request['variables']
+    if request['query'].startswith('query prs_by_id'):
+        return 200, {}, {'data': {'nodes': [make_node(pr_id, 10, 60) for pr_id in variables['ids']]}}
+    threads = [make_thread(i) for i in range(10, 60)]
+    page = {'pageInfo': {'endCursor': 't59', 'hasNextPage': False}, 'edges': threads}
+    aliases = [name[: -len('Id')] for name in variables if name.endswith('Id')]
+    return 200, {}, {'data': {alias: {'reviewThreads': page} for alias in aliases}}
+
+
+def test_lazy_fetch():
+    with MockAPI(threads_handler) as api, Transport('token', api.url) as transport:
+        (pr,) = fetch_prs_by_id(transport, 'owner', 'repository', ['PR_1'], profile=LS)
+        assert len(api.requests) == 1
+        assert len(pr.threads.data) == 10  # noqa: PLR2004
+        assert pr.threads.total_count == 60  # noqa: PLR2004
+        assert next(iter(pr.threads)).cursor == 't0'
+        assert len(api.requests) == 1
+        assert len(list(pr.threads)) == 60  # noqa: PLR2004
+        assert len(api.requests) == 2  # noqa: PLR2004
+        assert api.requests[1]['variables']['reviewThreads0First'] == 50  # noqa: PLR2004
+
+
+def test_nested_continuations():
+    def reactions(*contents: str, more: bool) -> dict:
+        return {
+            'totalCount': 3,
+            'pageInfo': {'endCursor': contents[-1], 'hasNextPage': more},
+            'edges': [{'cursor': c, 'node': {'content': c, 'user': {'login': 'x', 'name': None}}} for c in contents],
+        }
+
+    def comment(i: int) -> dict:
+        node = {'id': f'C_{i}', 'author': {'login': 'x'}, 'reactions': reactions('A', more=True)}
+        return {'cursor': f'c{i}', 'node': node}
+
+    def handler(request: dict) -> tuple:
+        variables = request['variables']
+        if request['query'].startswith('query prs_by_id'):
+            node = make_node('PR_1', 0, 0)
+            page_info = {'endCursor': 'c1', 'hasNextPage': False}
+            node['comments'] = {'pageInfo': page_info, 'edges': [comment(0), comment(1)]}
+            return 200, {}, {'data': {'nodes': [node]}}
+        aliases = [name[: -len('Id')] for name in variables if name.endswith('Id')]
+        return 200, {}, {'data': {alias: {'reactions': reactions('B', 'C', more=False)} for alias in aliases}}
+
+    with MockAPI(handler) as api, Transport('token', api.url) as transport:
+        (pr,) = fetch_prs_by_id(transport, 'owner', 'repository', ['PR_1'])
+        assert [[r.content for r in c.reactions.data] for c in pr.comments.data] == [['A', 'B', 'C']] * 2
+        assert len(api.requests) == 2  # noqa: PLR2004
+        batch = api.requests[1]['variables']
+        assert (batch['reactions0Id'], batch['reactions1Id']) == ('C_0', 'C_1')
+        assert batch['reactions0First'] == batch['reactions1First'] == 2  # noqa: PLR2004
+
+
+def test_adaptive_fetch():
+    with MockAPI(threads_handler) as api, Transport('token', api.url) as transport:
+        continuations = STATS.continuations
+        history = {'PR_1': PageSizes(1, 0, 0, 1, 0, 0), 'PR_2': PageSizes(1, 3, 2, 0, 1, 1)}
+        prs = fetch_prs_by_id(transport, 'owner', 'repository', ['PR_2', 'PR_1'], history=history)
+        assert [pr.id for pr in prs] == ['PR_2', 'PR_1']
+        assert [len(pr.threads.data) for pr in prs] == [60, 60]
+        # The continuations of both PRs are batched in one query.
+        assert STATS.continuations == continuations + 1
+        (batch,) = [request['variables'] for request in api.requests if 'reviewThreads1Id' in request['variables']]
+        assert {batch['reviewThreads0Id'], batch['reviewThreads1Id']} == {'PR_1', 'PR_2'}
+        assert batch['reviewThreads0First'] == batch['reviewThreads1First'] == 50  # noqa: PLR2004
+        queries = [request['variables'] for request in api.requests if 'ids' in request['variables']]
+        assert len(queries) == 1
+        assert queries[0]['comments'] == 5  # noqa: PLR2004
+        assert queries[0]['threads'] == 5  # noqa: PLR2004
+        assert observed_sizes(prs[0]).threads == 60  # noqa: PLR2004
+
+
+def test_search_prs():
+    branches = [f'feature/synthetic-branch-{i:03}' for i in range(200)]
+
+    def handler(request: dict) -> tuple:
+        heads = re.findall(r'head:(\S+)', request['variables']['query'])
+        edges = []
+        for head in heads:
+            node = {**make_node(f'PR_{head}', 0, 0), 'headRefName': head, 'reviewThreads': EMPTY}
+            edges.append({'cursor': head, 'node': node})
+        page = {'pageInfo': {'endCursor': heads[-1], 'hasNextPage': False}, 'edges': edges}
+        return 200, {}, {'data': {'search': page}}
+
+    with MockAPI(handler) as api, Transport('token', api.url) as transport:
+        prs = search_prs(transport, 'owner', 'repository', branches)
+        assert [pr.head for pr in prs] == branches
+        queries = [request['variables']['query'] for request in api.requests]
+        assert len(queries) > 1
+        assert all(len(query) <= MAX_SEARCH_QUERY_LENGTH for query in queries)
+        assert all(query.startswith('repo:owner/repository is:pr head:') for query in queries)
+        assert sum(query.count('head:') for query in queries) == len(branches)
+
+
+def test_mutation_batch():
+    def handler(request: dict) -> tuple:
+        variables = request['variables']
+        data = {alias: {'clientMutationId': None} for alias in variables if alias != 'm1'}
+        errors = [{'path': ['m1'], 'message': 'Base branch was modified.'}] if 'm1' in variables else []
+        return 200, {}, {'data': data, 'errors': errors}
+
+    with MockAPI(handler) as api, Transport('token', api.url) as transport:
+        transport.sleep = lambda _: None
+        batch = MutationBatch()
+        for i in range(MUTATIONS_PER_REQUEST + 1):
+            batch.update_pr(f'b{i}', f'PR_{i}', body='body')
+        batch.update_pr('b0', 'PR_0', baseRefName='main')
+        assert len(batch) == MUTATIONS_PER_REQUEST + 1
+        assert batch.send(transport) == {'b1': ['Base branch was modified.']}
+        assert not batch
+        assert len(api.requests) == 2  # noqa: PLR2004
+        assert api.requests[0]['query'].startswith('mutation batch($m0: UpdatePullRequestInput!, ')
+        assert ' m0: updatePullRequest(input: $m0){ clientMutationId }' in api.requests[0]['query']
+        assert api.requests[0]['variables']['m0'] == {'pullRequestId': 'PR_0', 'body': 'body', 'baseRefName': 'main'}
+        assert list(api.requests[1]['variables']) == ['m0']
+
+
+def test_call_stats():
+    assert operation_name(make_prs_by_id_query()) == 'prs_by_id'
+    assert operation_name('mutation batch($m0: X){ m0: f }') == 'batch'
+    assert operation_name('query{ viewer{ login } }') == 'query'
+    rate_limit = {'cost': 2, 'remaining': 4000, 'resetAt': '2024-01-01T00:00:00Z'}
+    with MockAPI(lambda _: (200, {}, {'data': {'nodes': [], 'rateLimit': rate_limit}})) as api, Transport(
+        'token', api.url
+    ) as transport:
+        CALLS.reset()
+        fetch_prs_by_id(transport, 'owner', 'repository', ['PR_1'])
+        fetch_prs_by_id(transport, 'owner', 'repository', ['PR_2'])
+        assert CALLS.calls() == CALLS.calls('prs_by_id') == 2  # noqa: PLR2004
+        assert CALLS.calls('search_prs') == 0
+        assert CALLS.operations['prs_by_id'].cost == 4  # noqa: PLR2004
+        assert CALLS.operations['prs_by_id'].bytes == sum(len(json.dumps(api.handler(None)[2])) for _ in range(2))
+        assert CALLS.dump().splitlines()[-1].startswith('total ')
@@ -0,0 +1,137 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from ghit import gh_transport
+from ghit.error import GhitError
+from ghit.gh_graphql import CALLS, graphql
+from ghit.gh_transport import Transport
+
+from .mock_api import MockAPI
+from .mock_github import TIMESTAMP
+
+
+def test_keep_alive():
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        for i in range(3):
+            api.reply({'data': {'i': i}})
+        assert [graphql(transport, 'query')['data']['i'] for _ in range(3)] == [0, 1, 2]
+        assert transport.requests == 3  # noqa: PLR2004
+        assert transport.connections() == 1
+    assert api.connections == 1
+    assert api.requests == [{'query': 'query', 'variables': {}}] * 3
+
+
+def test_url_from_env(monkeypatch: pytest.MonkeyPatch):
+    with MockAPI() as api:
+        monkeypatch.setenv('GITHUB_API_URL', api.url)
+        with Transport('token') as transport:
+            api.reply({'data': {}})
+            assert graphql(transport, 'query') == {'data': {}}
+
+
+def test_retry(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(gh_transport, 'BACKOFF_SECONDS', 0.5)
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        delays = []
+        transport.sleep = delays.append
+        api.reply({'message': 'bad gateway'}, 502)
+        api.reply({'message': 'unavailable'}, 503, {'Retry-After': '2'})
+        api.reply({'data': {}})
+        assert graphql(transport, 'query') == {'data': {}}
+        assert len(api.requests) == 3  # noqa: PLR2004
+        assert 0 <= delays[0] <= 1
+        assert delays[1] == 2  # noqa: PLR2004
+
+        delays.clear()
+        for _ in range(gh_transport.MAX_ATTEMPTS):
+            api.reply({'message': 'bad gateway'}, 502)
+        with pytest.raises(BaseException, match='bad gateway'):
+            graphql(transport, 'query')
+        assert len(delays) == gh_transport.MAX_ATTEMPTS - 1
+
+
+@pytest.mark.parametrize(
+    ('status', 'headers', 'body', 'delay'),
+    [
+        (403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '{reset}'}, {'message': 'rate limit exceeded'}, 31),
+        (403, {'Retry-After': '5'}, {'message': 'You have exceeded a secondary rate limit'}, 5),
+        (403, {}, {'message': 'You have exceeded a secondary rate limit'}, gh_transport.SECONDARY_LIMIT_SECONDS),
+        (200, {'Retry-After': '7'}, {'errors': [{'type': 'RATE_LIMITED', 'message': 'limited'}]}, 7),
+    ],
+)
+def test_rate_limits(status: int, headers: dict[str, str], body: dict, delay: float):
+    reset = time.time() + 30
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        delays = []
+        transport.sleep = delays.append
+        api.reply(body, status, {k: v.format(reset=reset) for k, v in headers.items()})
+        api.reply({'data': {}})
+        assert graphql(transport, 'query') == {'data': {}}
+        assert delay - 1 < delays[0] <= delay
+
+
+def test_forbidden():
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        api.reply({'message': 'Resource not accessible by integration'}, 403)
+        with pytest.raises(BaseException, match='not accessible'):
+            graphql(transport, 'query')
+        assert len(api.requests) == 1
+
+
+def rate_limit(remaining: int, seconds: float, cost: int = 3) -> dict:
+    reset_at = datetime.fromtimestamp(time.time() + seconds, timezone.utc)
+    return {'data': {'rateLimit': {'cost': cost, 'remaining': remaining, 'resetAt': reset_at.strftime(TIMESTAMP)}}}
+
+
+def test_throttle(capsys: pytest.CaptureFixture):
+    CALLS.reset()
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        delays = []
+        transport.sleep = delays.append
+        api.reply(rate_limit(50, 60))
+        api.reply(rate_limit(2, 60))
+        api.reply(rate_limit(5000, 3600))
+        graphql(transport, 'query')
+        graphql(transport, 'query')
+        assert delays == []
+        # Fewer points remain than the query has cost so far.
+        graphql(transport, 'query')
+        assert 58 < delays[0] <= 60  # noqa: PLR2004
+        assert transport.rate_limit.cost == 9  # noqa: PLR2004
+    assert 'Waiting 60s: the GitHub rate limit resets at' in capsys.readouterr().err
+
+
+def test_throttle_limit():
+    CALLS.reset()
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        delays = []
+        transport.sleep = delays.append
+        api.reply(rate_limit(2, 58 * 60, cost=1))
+        api.reply(rate_limit(0, 58 * 60, cost=1))
+        graphql(transport, 'query')
+        # A 1-point query doesn't wait for the budget of a batched one.
+        graphql(transport, 'query')
+        assert delays == []
+        with pytest.raises(GhitError, match='exhausted until'):
+            graphql(transport, 'query')
+        assert len(api.requests) == 2  # noqa: PLR2004
+
+
+def test_mutations():
+    with MockAPI() as api, Transport('token', api.url) as transport:
+        delays = []
+        transport.sleep = delays.append
+        api.reply({'message': 'bad gateway'}, 502)
+        with pytest.raises(BaseException, match='bad gateway'):
+            graphql(transport, 'mutation')
+        assert len(api.requests) == 1
+
+        api.reply({'message': 'secondary rate limit'}, 429, {'Retry-After': '3'})
+        api.reply({'data': {}})
+        assert graphql(transport, 'mutation') == {'data': {}}
+        assert len(api.requests) == 3  # noqa: PLR2004
+        assert len(delays) == 2  # noqa: PLR2004
+        assert 0 < delays[0] <= gh_transport.MUTATION_INTERVAL
+        assert delays[1] == 3  # noqa: PLR2004
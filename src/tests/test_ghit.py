@@ -0,0 +1,78 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pygit2 as git
+
+import ghit
+from ghit.cache import cache_path
+from ghit.ghit import ghit as ghit_main
+
+from .benchmark import make_repository
+
+# The modules that importing ghit.ghit adds to a bare interpreter, as
+# reported by -X importtime, which stand in for the startup time without
+# depending on the clock. Only the module of the command that runs is loaded
+# later. Importing every command module, pygit2 and requests takes over 250ms
+# instead of around 15ms.
+STARTUP_MODULES = {'ghit', 'ghit.__init__', 'ghit.error', 'ghit.ghit', 'ghit.terminal'}
+# The standard library modules it may add, such as argparse and logging.
+MAX_STARTUP_STDLIB_MODULES = 25
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=str(Path(ghit.__file__).parent.parent))
+    return subprocess.run(  # noqa: S603 runs the current interpreter
+        [sys.executable, *args], capture_output=True, text=True, env=env, check=True
+    )
+
+
+def imported_modules(code: str) -> set[str]:
+    result = run_python('-X', 'importtime', '-c', code)
+    return {line.split('|')[-1].strip() for line in result.stderr.splitlines()[1:]}
+
+
+def test_import_budget():
+    added = imported_modules('import ghit.ghit') - imported_modules('pass')
+    startup = {module for module in added if module.partition('.')[0] == 'ghit'}
+    assert startup <= STARTUP_MODULES
+    assert not added & {'pygit2', 'requests', 'sqlite3', 'concurrent.futures'}
+    assert len(added - startup) <= MAX_STARTUP_STDLIB_MODULES, sorted(added - startup)
+
+
+def test_deferred_imports():
+    loaded = run_python(
+        '-c',
+        'import sys; from ghit.ghit import ghit; ghit(["version"]); '
+        'print(*(m for m in ("pygit2", "requests", "ghit.top_commands") if m in sys.modules))',
+    )
+    assert loaded.stdout.splitlines() == [ghit.__version__, '']
+    loaded = run_python('-c', 'import sys, ghit.top_commands; print("requests" in sys.modules)')
+    assert loaded.stdout.strip() == 'False'
+
+
+def test_navigation(tmp_path: Path):
+    make_repository(tmp_path, ['a', 'b', 'c'])
+    repo = git.Repository(str(tmp_path))
+
+    def move(command: str) -> str:
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert ghit_main(['-r', str(tmp_path), command]) == 0
+        return repo.head.shorthand
+
+    assert [move(command) for command in ('down', 'down', 'up', 'bottom', 'down', 'up', 'top', 'up')] == [
+        'a',
+        'b',
+        'a',
+        'c',
+        'c',
+        'b',
+        'main',
+        'main',
+    ]
+    # Moving around the stack neither reads the repository metadata nor
+    # opens the cache.
+    assert not cache_path(tmp_path).exists()
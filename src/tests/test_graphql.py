@@ -1,8 +1,15 @@
+import pickle
+import threading
 from dataclasses import dataclass
+from operator import itemgetter
+
+import pytest
 
 from ghit.graphql import (
+    Field,
     Pages,
     cursor_or_null,
+    decoder,
     edges,
     end_cursor,
     fields,
@@ -13,6 +20,8 @@ from ghit.graphql import (
     on,
     paged,
     path,
+    run_tasks,
+    schema_fragment,
 )
 
 
@@ -148,6 +157,44 @@ def test_pages_class():
     assert tcs.data[0].subclasses.data[1].value == 'subtest two'
 
 
+def test_lazy_pages():
+    def page(*values: str, more: bool) -> dict:
+        return {
+            'items': {
+                'totalCount': 4,
+                'pageInfo': {'endCursor': values[-1], 'hasNextPage': more},
+                'edges': [{'cursor': v, 'node': v} for v in values],
+            }
+        }
+
+    fetched: list[str] = []
+    seen: list[list[str]] = []
+
+    def next_page(after: str) -> dict:
+        fetched.append(after)
+        return page('c', 'd', more=False) if after == 'b' else None
+
+    pages = Pages('items', itemgetter('node'), page('a', 'b', more=True))
+    assert pages.total_count == 4  # noqa: PLR2004
+    pages.lazy(next_page, seen.append)
+    assert seen == [['a', 'b']]
+    assert fetched == []
+
+    values = iter(pages)
+    assert [next(values), next(values)] == ['a', 'b']
+    assert fetched == []
+    assert list(values) == ['c', 'd']
+    assert fetched == ['b']
+    assert seen == [['a', 'b'], ['c', 'd']]
+    assert pages.complete()
+    assert list(pages) == ['a', 'b', 'c', 'd']
+    assert fetched == ['b']
+
+    copy = pickle.loads(pickle.dumps(pages))  # noqa: S301
+    assert copy.data == pages.data
+    assert copy.next_page is None
+
+
 def test_path():
     assert path({'a': 'abc'}, 'a') == 'abc'
     assert path(['abc'], 0) == 'abc'
@@ -200,3 +247,54 @@ def test_cursor():
     data['subClasses']['pageInfo']['hasNextPage'] = True
     c, has_next = end_cursor(data, 'subClasses')
     assert has_next
+
+
+def test_run_tasks():
+    done: list[str] = []
+    lock = threading.Lock()
+
+    def task(name: str, *follow_ups: str):
+        def run():
+            with lock:
+                done.append(name)
+            return [task(f) for f in follow_ups]
+
+        return run
+
+    run_tasks([task('a', 'a1', 'a2'), task('b', 'b1')], 4)
+    assert sorted(done) == ['a', 'a1', 'a2', 'b', 'b1']
+    assert done.index('a') < done.index('a1')
+    assert done.index('a') < done.index('a2')
+    assert done.index('b') < done.index('b1')
+
+    def fail():
+        raise ValueError
+
+    with pytest.raises(ValueError):  # noqa: PT011
+        run_tasks([task('c'), fail], 1)
+
+
+def test_decoder():
+    schema = (
+        Field('value', 'v', decode=str.upper),
+        Field('subclasses', select='items', decode=lambda node: Pages('items', itemgetter('node'), node), node=True),
+        Field('value', 'w'),
+    )
+    decode = decoder('decode', __name__, TestClass, schema)
+    items = {'pageInfo': {'endCursor': 'x', 'hasNextPage': False}, 'edges': [{'cursor': 'x', 'node': 'b'}]}
+    decoded = decode({'node': {'v': 'a', 'items': items}})
+    assert decoded.value == 'A'
+    assert decoded.subclasses.data == ['b']
+    assert decode({'node': {'v': None}}).value is None
+    assert decode.__name__ == 'decode'
+    assert decode.__module__ == __name__
+
+    fragment = schema_fragment('test', 'Test', schema, None, {})
+    assert fragment.definition == 'fragment test on Test{ v items w }'
+    optional = (Field('value', when=bool), Field('subclasses', edge=True))
+    assert schema_fragment('test', 'Test', optional, False, {}).definition == 'fragment test on Test{  }'
+    decode = decoder('decode', __name__, TestSubClass, optional[:1], edge=False)
+    assert decode({}).value is None
+    # The attributes are passed positionally.
+    with pytest.raises(TypeError):
+        decoder('decode', __name__, TestClass, schema[1:2])
@@ -0,0 +1,65 @@
+import pytest
+
+from ghit.gh_graphql import PROFILES, fetch_pr_versions, fetch_prs_by_id, fetch_stack_prs, search_prs
+from ghit.gh_transport import Transport
+
+from .benchmark import benchmark
+from .mock_github import Executor, MockGitHub, Shape, SyntheticRepository, parse
+
+BRANCHES = ['a', 'b', 'c']
+SHAPE = Shape(comments=12, threads=60, thread_comments=2, reviews=45, commits=2, reactions=11)
+
+
+def test_executor():
+    repository = SyntheticRepository(BRANCHES)
+    document = parse(
+        'query q($n: Int = 2, $h: String!){ repository(owner: "owner", name: "repository"){ '
+        'x: pullRequests(first: $n, headRefName: $h){ totalCount edges{ node{ ...pr } } } } } '
+        'fragment pr on PullRequest{ number ... on Reactable{ id } ... on User{ login } }'
+    )
+    assert Executor(document, {'h': 'b'}).execute(repository.query_root()) == {
+        'data': {'repository': {'x': {'totalCount': 1, 'edges': [{'node': {'number': 2, 'id': 'PR_2'}}]}}}
+    }
+    result = Executor(parse('{ node(id: "PR_1"){ login } }'), {}).execute(repository.query_root())
+    assert result['data'] == {'node': {'login': None}}
+    assert result['errors'] == [
+        {'message': "Field 'login' doesn't exist on type 'PullRequest'", 'path': ['node', 'login']}
+    ]
+
+
+@pytest.mark.parametrize('profile', PROFILES.values(), ids=PROFILES)
+def test_fetch(profile):
+    with MockGitHub(SyntheticRepository(BRANCHES, SHAPE)) as api, Transport('token', api.url) as transport:
+        prs = fetch_stack_prs(transport, 'owner', 'repository', BRANCHES, profile=profile)
+        found = search_prs(transport, 'owner', 'repository', BRANCHES, profile=profile)
+        by_id = fetch_prs_by_id(transport, 'owner', 'repository', [pr.id for pr in prs], profile=profile)
+        for fetched in (prs, found, by_id):
+            assert [(pr.head, pr.base) for pr in fetched] == [('a', 'main'), ('b', 'a'), ('c', 'b')]
+            for pr in fetched:
+                if profile.reviews:
+                    assert [thread.id for thread in pr.threads] == [f'PRRT_{pr.number}_{i}' for i in range(60)]
+                if profile.comments:
+                    assert [len(list(comment.reactions)) for comment in pr.comments] == [11] * 12
+
+
+def test_versions_and_errors():
+    with MockGitHub(SyntheticRepository(BRANCHES), error_rate=0.3) as api, Transport('token', api.url) as transport:
+        transport.sleep = lambda _: None
+        for _ in range(5):
+            assert [pr_id for pr_id, _ in fetch_pr_versions(transport, 'owner', 'repository', BRANCHES)] == [
+                'PR_1',
+                'PR_2',
+                'PR_3',
+            ]
+        assert api.errors
+        assert len(api.requests) == 5 + api.errors
+
+
+def test_benchmark():
+    results = {(r.command, r.run): r for r in benchmark((3,), ('ls -v', 'stack submit'), Shape(threads=2))}
+    assert all(r.requests and r.bytes_sent and r.bytes_received for r in results.values())
+    # The dependencies are added to the PR bodies by the first submit.
+    assert results['stack submit', 'cold'].status == results['stack submit', 'warm'].status == 0
+    assert results['stack submit', 'cold'].bytes_sent > results['stack submit', 'warm'].bytes_sent
+    # The PRs are not refetched once cached.
+    assert results['ls -v', 'cold'].bytes_received > results['ls -v', 'warm'].bytes_received
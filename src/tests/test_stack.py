@@ -1,7 +1,11 @@
+import sys
+
 import pytest
 from ghit.error import GhitError
 from ghit.stack import Stack, parse, parse_line
 
+from .benchmark import deep_stack, wide_stack
+
 
 def test_get_parent():
     stack = Stack()
@@ -129,3 +133,99 @@ def test_parse_disabled():
     s = stack.find('disabled')
     assert s.get_parent().branch_name == 'main'
     assert s.get_parent(True).branch_name == 'main'
+
+
+def test_children():
+    text = ['main', '.a', '#.disabled', '..b', '...c', '..d', '#..e', '#.f']
+    stack = parse(text)
+    assert stack.length() == 1
+    assert [(r.branch_name, r.length(), r.is_last_child()) for r in stack.traverse()] == [
+        ('main', 3, True),
+        ('a', 0, False),
+        ('b', 1, False),
+        ('c', 0, True),
+        ('d', 0, True),
+    ]
+    assert stack.find('disabled').length() == 2  # noqa: PLR2004
+
+    stack.find('main').add_child('g')
+    assert not stack.find('d').is_last_child()
+    assert stack.find('g').is_last_child()
+    assert stack.find('main').length() == 4  # noqa: PLR2004
+
+    stack.find('b').disable()
+    assert stack.find('c').get_parent().branch_name == 'main'
+    assert [r.branch_name for r in stack.find('main').traverse() if r.is_last_child()] == ['main', 'g']
+    assert stack.find('main').length() == 4  # noqa: PLR2004
+
+
+def test_wide_stack(monkeypatch: pytest.MonkeyPatch):
+    reindexed = []
+    reindex = Stack._reindex
+    monkeypatch.setattr(Stack, '_reindex', lambda self: reindexed.append(self) or reindex(self))
+    stack = parse(wide_stack(2500))
+    records = [(r.get_parent(), r.is_last_child(), r.length()) for r in stack.traverse()]
+    # The stack is indexed once for all the records, instead of every call
+    # walking the children.
+    assert reindexed == [stack]
+    assert len(records) == 7501  # noqa: PLR2004
+    assert sum(last for parent, last, _ in records if parent) == 2501  # noqa: PLR2004
+    assert sum(length for _, _, length in records) == 7500  # noqa: PLR2004
+
+
+def test_find():
+    stack = parse(['main', '.a', '#.disabled', '..b', '.c', 'dev', '.d'])
+    assert stack.find('b').get_parent().branch_name == 'main'
+    assert stack.find('disabled').branch_name == 'disabled'
+    assert 'b' in stack
+    assert 'x' not in stack
+    assert stack.find('main').find('b') is stack.find('b')
+    assert stack.find('main').find('main') is stack.find('main')
+    assert stack.find('disabled').find('c') is None
+    assert 'd' not in stack.find('main')
+    stack.find('a').add_child('x')
+    assert stack.find('main').find('x').get_parent().branch_name == 'a'
+
+    # An enabled record of the branch wins over a disabled one.
+    stack = parse(['main', '#.feature', '..x', 'feature', '.y'])
+    feature = stack.find('feature')
+    assert feature.is_enabled()
+    assert feature.get_parent() is None
+    assert [r for r in stack.traverse() if r.branch_name == 'feature'] == [feature]
+    assert stack.find('main').find('feature').depth == 1
+    assert not stack.find('main').find('feature').is_enabled()
+    feature.disable()
+    assert stack.find('feature').depth == 1
+
+
+def test_records():
+    text = ['main', '.a', '#.disabled', '..b', '...c', '..d', '#..e', '.f', 'dev', '.g']
+    stack = parse(text)
+    assert [r.branch_name for r in stack.records()] == [r.branch_name for r in stack.traverse()]
+    assert [r.position() for r in stack.records()] == list(range(8))
+    assert stack.find('disabled').position() is None
+    stack.find('b').add_child('h')
+    stack.find('f').disable()
+    assert [r.branch_name for r in stack.records()] == ['main', 'a', 'b', 'c', 'h', 'd', 'dev', 'g']
+    assert stack.find('d').position() == 5  # noqa: PLR2004
+    assert [r.branch_name for r in stack.rtraverse()] == ['c', 'h', 'b', 'd', 'a', 'g']
+    assert [r.branch_name for r in stack.find('b').rtraverse()] == ['c', 'h', 'b']
+
+
+def test_deep_stack():
+    # Far deeper than the recursion limit, with every tenth branch disabled.
+    depth = 5000
+    assert depth > sys.getrecursionlimit()
+    text = deep_stack(depth)
+    stack = parse(text)
+    records = list(stack.traverse())
+    assert stack.dumps() == text
+    assert [r.branch_name for r in stack.rtraverse()] == [r.branch_name for r in reversed(records[1:])]
+    assert len(records) == 1 + depth - depth // 10
+    assert len(list(stack.traverse(False, True))) == depth + 1
+    assert stack.find('branch-6').get_parent().branch_name == 'branch-4'
+    assert [r.length() for r in records] == [1] * (len(records) - 1) + [0]
+    assert all(r.is_last_child() for r in records)
+    stack.find('branch-7').disable()
+    assert stack.find('branch-8').get_parent().branch_name == 'branch-6'
+    assert stack.find('branch-8').position() == 7  # noqa: PLR2004